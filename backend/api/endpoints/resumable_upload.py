@@ -0,0 +1,330 @@
+"""
+Возобновляемая загрузка видео кусками.
+
+    POST   /videos/uploads                           — создать сессию (имя, размер файла)
+    PUT    /videos/uploads/{id}/chunks?offset=N      — прислать кусок сырым телом запроса
+    GET    /videos/uploads/{id}                      — какие диапазоны байтов уже приняты
+    POST   /videos/uploads/{id}/complete             — собрать видео и запустить обработку
+    DELETE /videos/uploads/{id}                      — отменить загрузку
+
+Куски можно слать в любом порядке и параллельно: каждый пишется через pwrite по своему смещению
+во временный файл заранее заданного размера. Принятые куски хранятся в БД, поэтому после обрыва
+клиент запрашивает диапазоны и досылает только недостающее. Пишущиеся куски учитываются в
+chunks_in_flight сессии: complete не отдает файл в обработку, пока в него кто-то пишет.
+
+Прямая загрузка в хранилище, минуя API:
+
+    POST   /videos/uploads/direct                    — multipart-загрузка S3 и подписанные ссылки на части
+    PUT    <url части>                               — клиент отправляет часть прямо в MinIO/S3
+    POST   /videos/uploads/direct/{id}/complete      — сверить части, собрать объект и запустить обработку
+
+Задача обработки получает ключ объекта и сама скачивает оригинал.
+
+Брошенные сессии (без новых кусков дольше UPLOAD_SESSION_TTL_SECONDS) отменяет периодическая задача
+expire_upload_sessions_task: multipart-загрузка S3 прерывается, каталог временного файла удаляется.
+"""
+import math
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from db.base import SessionLocal
+from db.models.upload_session import UploadSessionStatus, UploadSessionMode
+from db.repositories.upload_repository import UploadSessionRepository
+from db.repositories.video_repository import VideoRepository
+from schemas.upload import (
+    UploadResponse, UploadStatus, ResumableUploadCreate, ResumableUploadStatus, ByteRange,
+    DirectUploadSession, DirectUploadComplete, PresignedPart
+)
+from tasks.process_video_task import process_video_task, original_video_key
+from tasks.upload_cleanup_task import release_session_storage
+from utils.s3_utils import (
+    calculate_part_size, create_multipart_upload, presign_upload_parts, list_uploaded_parts,
+    complete_multipart_upload, abort_multipart_upload
+)
+from api.endpoints.upload import VideoUploader
+from utils.temp_storage import temp_storage
+from utils.upload_io import run_io
+from core.config import settings
+from core.logger import logger
+from core import timing
+
+router = APIRouter()
+
+def session_lease_seconds():
+    """Незавершенная сессия хранит куски не дольше, чем живут временные файлы"""
+    return settings.TEMP_FILES_MAX_AGE_HOURS * 3600
+
+def session_status(session, ranges):
+    return ResumableUploadStatus(
+        upload_id=session.id,
+        status=session.status,
+        size=session.size,
+        chunk_size=settings.RESUMABLE_UPLOAD_CHUNK_SIZE,
+        received_bytes=sum(end - start for start, end in ranges),
+        received=[ByteRange(start=start, end=end) for start, end in ranges],
+        video_id=str(session.video_id) if session.video_id else None,
+        task_id=session.task_id
+    )
+
+def get_open_session(repo, upload_id, for_update=False):
+    session = repo.get_session(upload_id, for_update=for_update)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.status == UploadSessionStatus.aborted:
+        raise HTTPException(status_code=410, detail="Upload session was aborted")
+    if session.status == UploadSessionStatus.open and session.temp_path and not os.path.exists(session.temp_path):
+        # Временный файл удалила очистка старых файлов
+        raise HTTPException(status_code=410, detail="Upload session expired")
+    return session
+
+def direct_ranges(session, parts):
+    """Диапазоны байтов по частям, уже принятым хранилищем"""
+    return [((part["PartNumber"] - 1) * session.part_size, (part["PartNumber"] - 1) * session.part_size + part["Size"])
+            for part in sorted(parts, key=lambda part: part["PartNumber"])]
+
+def start_processing(db, session, **task_kwargs):
+    """Создает видео, закрывает сессию и ставит задачу обработки; db — сессия с заблокированной строкой"""
+    video_repo = VideoRepository(db)
+    video = video_repo.create_video(name=session.name, description=session.description,
+                                    s3_url=session.s3_key or "", status=UploadStatus.uploading)
+    session.status = UploadSessionStatus.completed
+    session.video_id = video.id
+    # Видео должно быть в БД до того, как задача начнет его обрабатывать
+    db.commit()
+    try:
+        task = process_video_task.delay(video_id=video.id, **task_kwargs)
+    except Exception as e:
+        video_repo.update_video_status(video.id, UploadStatus.failed)
+        db.commit()
+        logger.error(f"Не удалось запустить обработку видео {video.id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    session.task_id = task.id
+    db.commit()
+    return video, task
+
+@router.post("", response_model=ResumableUploadStatus)
+def create_upload(request: ResumableUploadCreate):
+    if request.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+    uploader = VideoUploader()
+    upload_id = temp_storage.new_job_id()
+    # Сессия держит аренду каталога, пока клиент докачивает куски; каждый кусок ее продлевает
+    uploader.reserve_space(upload_id, request.size, lease_seconds=session_lease_seconds())
+    temp_path = temp_storage.job_path(upload_id, f"{upload_id}_{os.path.basename(request.filename)}")
+    # Файл нужного размера без выделения блоков: куски дописываются по своим смещениям
+    with open(temp_path, "wb") as f:
+        f.truncate(request.size)
+    try:
+        with SessionLocal() as db:
+            repo = UploadSessionRepository(db)
+            session = repo.create_session(upload_id, request.name, request.description,
+                                          request.filename, request.size, temp_path)
+            db.commit()
+    except Exception as e:
+        uploader.discard(upload_id)
+        logger.error(f"Ошибка при создании сессии загрузки: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    logger.info(f"Создана сессия загрузки {upload_id}: {request.filename}, {request.size/1024/1024:.1f} МБ")
+    return session_status(session, [])
+
+@router.post("/direct", response_model=DirectUploadSession)
+def create_direct_upload(request: ResumableUploadCreate):
+    if request.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+    upload_id = str(uuid.uuid4())
+    original_filename = f"{upload_id}_{os.path.basename(request.filename)}"
+    key = original_video_key(original_filename)
+    part_size = calculate_part_size(request.size)
+    part_count = max(1, math.ceil(request.size / part_size))
+    s3_upload_id = create_multipart_upload(key)
+    try:
+        urls = presign_upload_parts(key, s3_upload_id, part_count, settings.DIRECT_UPLOAD_URL_EXPIRATION)
+        with SessionLocal() as db:
+            UploadSessionRepository(db).create_session(
+                upload_id, request.name, request.description, original_filename, request.size,
+                mode=UploadSessionMode.direct, s3_key=key, s3_upload_id=s3_upload_id, part_size=part_size)
+            db.commit()
+    except Exception as e:
+        abort_multipart_upload(key, s3_upload_id)
+        logger.error(f"Ошибка при создании прямой загрузки: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    logger.info(f"Создана прямая загрузка {upload_id}: {key}, {part_count} частей по {part_size/1024/1024:.0f} МБ")
+    return DirectUploadSession(
+        upload_id=upload_id,
+        key=key,
+        part_size=part_size,
+        expires_in=settings.DIRECT_UPLOAD_URL_EXPIRATION,
+        parts=[PresignedPart(part_number=i, url=url) for i, url in enumerate(urls, start=1)]
+    )
+
+@router.post("/direct/{upload_id}/complete", response_model=UploadResponse)
+def complete_direct_upload(upload_id: str, request: Optional[DirectUploadComplete] = None):
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        session = get_open_session(repo, upload_id, for_update=True)
+        if session.mode != UploadSessionMode.direct:
+            raise HTTPException(status_code=409, detail="Not a direct upload session")
+        if session.status == UploadSessionStatus.completed:
+            return UploadResponse(video_id=str(session.video_id), status=UploadStatus.uploading, task_id=session.task_id or "")
+
+        # Части сверяются с тем, что реально приняло хранилище, а не с отчетом клиента
+        parts = list_uploaded_parts(session.s3_key, session.s3_upload_id)
+        expected = max(1, math.ceil(session.size / session.part_size))
+        received = sum(part["Size"] for part in parts)
+        if len(parts) != expected or received != session.size:
+            raise HTTPException(status_code=409, detail=f"Upload is incomplete: {len(parts)}/{expected} parts, "
+                                                        f"{received}/{session.size} bytes")
+        if request and request.parts:
+            etags = {part["PartNumber"]: part["ETag"].strip('"') for part in parts}
+            mismatched = [part.part_number for part in request.parts if etags.get(part.part_number) != part.etag.strip('"')]
+            if mismatched:
+                raise HTTPException(status_code=409, detail=f"ETag mismatch for parts {mismatched}")
+        complete_multipart_upload(session.s3_key, session.s3_upload_id,
+                                  [{"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in parts])
+
+        video, task = start_processing(db, session, temp_file_path=None,
+                                       original_filename=session.filename, s3_key=session.s3_key)
+    logger.info(f"Прямая загрузка {upload_id} завершена, видео {video.id}, задача {task.id}")
+    return UploadResponse(video_id=str(video.id), status=UploadStatus.uploading, task_id=task.id)
+
+@router.get("/{upload_id}", response_model=ResumableUploadStatus)
+def get_upload(upload_id: str):
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        session = get_open_session(repo, upload_id)
+        if session.mode == UploadSessionMode.direct:
+            return session_status(session, direct_ranges(session, list_uploaded_parts(session.s3_key, session.s3_upload_id)))
+        return session_status(session, repo.received_ranges(upload_id))
+
+def load_open_session(upload_id: str):
+    with SessionLocal() as db:
+        return get_open_session(UploadSessionRepository(db), upload_id)
+
+def lock_open_session(repo, upload_id):
+    """Строка сессии под FOR UPDATE; статус сверяется под блокировкой, а не по снимку до записи куска"""
+    session = get_open_session(repo, upload_id, for_update=True)
+    if session.status != UploadSessionStatus.open:
+        raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+    return session
+
+def begin_chunk(upload_id: str):
+    """Отмечает кусок как пишущийся: complete откажет, пока запись не закончится"""
+    with SessionLocal() as db:
+        session = lock_open_session(UploadSessionRepository(db), upload_id)
+        session.chunks_in_flight += 1
+        db.commit()
+
+def record_chunk(upload_id: str, offset: int, size: int):
+    """Снимает отметку записи и учитывает записанный кусок (size=0 — запись не удалась); возвращает принятые диапазоны"""
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        session = repo.get_session(upload_id, for_update=True)
+        if not session:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        session.chunks_in_flight = max(0, session.chunks_in_flight - 1)
+        if not size:
+            db.commit()
+            return None
+        if session.status != UploadSessionStatus.open:
+            db.commit()
+            raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+        repo.add_chunk(upload_id, offset, size)
+        db.commit()
+        return repo.received_ranges(upload_id)
+
+def chunks_being_written(session) -> bool:
+    """Есть пишущиеся куски; отметка без движения дольше RESUMABLE_UPLOAD_CHUNK_TIMEOUT осталась от упавшего процесса"""
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.RESUMABLE_UPLOAD_CHUNK_TIMEOUT)
+    return session.chunks_in_flight > 0 and session.updated_at > stale_before
+
+@router.put("/{upload_id}/chunks", response_model=ResumableUploadStatus)
+async def put_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    session = await run_io(load_open_session, upload_id)
+    if session.mode != UploadSessionMode.chunked:
+        raise HTTPException(status_code=409, detail="Parts of a direct upload go to object storage")
+    if session.status != UploadSessionStatus.open:
+        raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > settings.RESUMABLE_UPLOAD_MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=413, detail=f"Chunk exceeds {settings.RESUMABLE_UPLOAD_MAX_CHUNK_SIZE} bytes")
+    if offset + content_length > session.size:
+        raise HTTPException(status_code=416, detail=f"Chunk ends past the declared size {session.size}")
+    job_id = temp_storage.job_of(session.temp_path)
+    if job_id:
+        await run_io(temp_storage.acquire, job_id, session_lease_seconds())
+
+    await run_io(begin_chunk, upload_id)
+    written = 0
+    try:
+        with timing.span("save"):
+            fd = await run_io(os.open, session.temp_path, os.O_WRONLY)
+            try:
+                buffer = bytearray()
+                async for data in request.stream():
+                    buffer += data
+                    if offset + written + len(buffer) > session.size or written + len(buffer) > settings.RESUMABLE_UPLOAD_MAX_CHUNK_SIZE:
+                        raise HTTPException(status_code=416, detail="Chunk is larger than announced")
+                    if len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+                        written += await run_io(os.pwrite, fd, bytes(buffer), offset + written)
+                        buffer.clear()
+                if buffer:
+                    written += await run_io(os.pwrite, fd, bytes(buffer), offset + written)
+            finally:
+                await run_io(os.close, fd)
+    except FileNotFoundError:
+        # Сессию отменили или ее файл удалила очистка, пока кусок был в пути
+        await run_io(record_chunk, upload_id, offset, 0)
+        raise HTTPException(status_code=409, detail="Upload session file is gone")
+    except Exception:
+        await run_io(record_chunk, upload_id, offset, 0)
+        raise
+    if not written:
+        await run_io(record_chunk, upload_id, offset, 0)
+        raise HTTPException(status_code=400, detail="Empty chunk")
+
+    # Кусок учитывается только после того, как он целиком записан в файл
+    with timing.span("db"):
+        ranges = await run_io(record_chunk, upload_id, offset, written)
+    timing.handler_done()
+    return session_status(session, ranges)
+
+@router.post("/{upload_id}/complete", response_model=UploadResponse)
+def complete_upload(upload_id: str):
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        # Блокировка строки: повторный или параллельный complete не создаст второе видео
+        session = get_open_session(repo, upload_id, for_update=True)
+        if session.status == UploadSessionStatus.completed:
+            return UploadResponse(video_id=str(session.video_id), status=UploadStatus.uploading, task_id=session.task_id or "")
+        if session.mode != UploadSessionMode.chunked:
+            raise HTTPException(status_code=409, detail="Complete a direct upload via /direct/{upload_id}/complete")
+        if chunks_being_written(session):
+            raise HTTPException(status_code=409, detail=f"{session.chunks_in_flight} chunks are still being written")
+        ranges = repo.received_ranges(upload_id)
+        if ranges != [(0, session.size)]:
+            missing = session.size - sum(end - start for start, end in ranges)
+            raise HTTPException(status_code=409, detail=f"Upload is incomplete: {missing} bytes missing")
+
+        job_id = temp_storage.job_of(session.temp_path)
+        if job_id:
+            VideoUploader().hand_off(job_id)
+        video, task = start_processing(db, session, temp_file_path=session.temp_path,
+                                       original_filename=os.path.basename(session.temp_path))
+    logger.info(f"Сессия загрузки {upload_id} завершена, видео {video.id}, задача {task.id}")
+    return UploadResponse(video_id=str(video.id), status=UploadStatus.uploading, task_id=task.id)
+
+@router.delete("/{upload_id}")
+def abort_upload(upload_id: str):
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        session = repo.get_session(upload_id, for_update=True)
+        if not session:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        if session.status == UploadSessionStatus.completed:
+            raise HTTPException(status_code=409, detail="Upload session is already completed")
+        session.status = UploadSessionStatus.aborted
+        db.commit()
+    release_session_storage(session)
+    return {"message": "Upload aborted", "upload_id": upload_id}
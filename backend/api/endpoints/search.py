@@ -1,83 +1,158 @@
+import asyncio
+import time
 from typing import List, Optional
 from fastapi import APIRouter, Query, HTTPException
-from db.repositories.video_repository import VideoRepository
-from schemas.search import SearchResultResponse, SearchResult, SearchFragment, VideoInfo, SearchStatus
-from utils.elasticsearch_utils import get_elasticsearch
-from utils.s3_utils import generate_presigned_url
-from db.base import SessionLocal
+from schemas.search import (
+    SearchResultResponse, SearchStatus, SuggestResponse, BatchSearchRequest, BatchSearchResponse
+)
+from db.base import AsyncSessionLocal
 from core.config import settings
+from core import timing, metrics
 from core.logger import logger
-from services.search_service import search_in_elasticsearch 
-import random
+from utils.hls import is_hls_key
+from services.search_service import (
+    async_search_videos_collapsed, multi_search_videos_collapsed, collapsed_fragment_ids,
+    hydrate_fragments, async_hydrate_fragments, async_sign_urls,
+    assemble_collapsed_results, suggest_phrases, new_search_budget, count_overrun,
+    get_hydration_mode, hydrate_from_source, sign_urls, fragment_media_keys
+)
 
 router = APIRouter()
 
+async def hydrate_from_database(search, budget, query):
+    """Дочитывает фрагменты из БД; видео берутся из денормализованных полей документов"""
+    page = await search
+    partial = page.get("partial", False)
+    async with AsyncSessionLocal() as db:
+        try:
+            fragments_by_id, videos_by_id = await asyncio.wait_for(
+                async_hydrate_fragments(db, page["video_hits"]),
+                timeout=budget.remaining_seconds()
+            )
+        except asyncio.TimeoutError:
+            count_overrun("db")
+            logger.warning(f"Search '{query}' exceeded its latency budget hydrating fragments")
+            fragments_by_id, videos_by_id, partial = {}, {}, True
+    return fragments_by_id, videos_by_id, page, partial
+
 @router.get("", response_model=SearchResultResponse)
-def search_videos(
-    query: str, 
-    exact: bool = False, 
-    tags: Optional[List[str]] = Query(None), 
-    max_fragments_per_video: int = 3,
-    max_videos: int = 5
+async def search_videos(
+    query: str,
+    exact: bool = False,
+    tags: Optional[List[str]] = Query(None),
+    max_fragments_per_video: int = Query(3, ge=1, le=settings.SEARCH_MAX_FRAGMENTS_PER_VIDEO),
+    max_videos: int = Query(5, ge=1, le=settings.SEARCH_MAX_VIDEOS_PER_PAGE),
+    cursor: Optional[str] = None,
+    mode: Optional[str] = Query(None, description="lexical или hybrid (BM25 + kNN)"),
+    profile: bool = Query(False, description="Приложить профиль запроса Elasticsearch и замеры этапов"),
+    budget_ms: Optional[int] = Query(None, ge=settings.SEARCH_BUDGET_MIN_STEP_MS, le=settings.SEARCH_MAX_LATENCY_BUDGET_MS,
+                                     description="Бюджет задержки в мс; по его исчерпании возвращаются частичные результаты")
 ):
+    if profile and not settings.SEARCH_PROFILE_ALLOWED:
+        raise HTTPException(status_code=403, detail="Search profiling is disabled")
+    budget = new_search_budget(budget_ms)
     try:
-        # Выполнение поиска в Elasticsearch
-        hits = search_in_elasticsearch(query, exact, tags)
-        fragment_ids = [hit["_source"]["fragment_id"] for hit in hits]
-        scores = {hit["_source"]["fragment_id"]: hit["_score"] for hit in hits}
-        
-        # Открытие сессии базы данных
-        db = SessionLocal()
-        repo = VideoRepository(db)
-        video_fragments = {}
-        
-        # Получение фрагментов и видео
-        for frag_id in fragment_ids:
-            frag = repo.get_fragment_by_id(frag_id)
-            if frag:
-                video = repo.get_video_by_id(frag.video_id)
-                if video:
-                    if video.id not in video_fragments:
-                        video_fragments[video.id] = {
-                            "video": VideoInfo(
-                                video_id=str(video.id),
-                                name=video.name,
-                                description=video.description,
-                                s3_url=generate_presigned_url(video.s3_url, expiration=3600)
-                            ),
-                            "fragments": []
-                        }
-                    frag_url = generate_presigned_url(frag.s3_url, expiration=3600)
-                    video_fragments[video.id]["fragments"].append({
-                        "fragment_id": str(frag.id),
-                        "text": frag.text,
-                        "timecode_start": frag.timecode_start,
-                        "timecode_end": frag.timecode_end,
-                        "s3_url": frag_url,
-                        "score": scores[frag.id]
-                    })
-        
-        # Ограничиваем количество фрагментов и видео
-        results = []
-        for vid, data in video_fragments.items():
-            data["fragments"].sort(key=lambda x: x["score"], reverse=True)
-            # Ограничиваем количество фрагментов для каждого видео
-            data["fragments"] = data["fragments"][:max_fragments_per_video]
-            results.append(SearchResult(
-                video=data["video"],
-                fragments=[SearchFragment(**f) for f in data["fragments"]],
-                fragments_count=len(data["fragments"])
-            ))
-
-        # Ограничиваем количество видео
-        results = random.sample(results, k=min(max_videos, len(results)))
+        source_hydration = get_hydration_mode() == "source"
+        # Поиск в Elasticsearch: одно попадание на видео, лучшие фрагменты в inner_hits
+        search = async_search_videos_collapsed(query, exact, tags,
+                                               max_videos=max_videos,
+                                               max_fragments_per_video=max_fragments_per_video,
+                                               cursor=cursor,
+                                               mode=mode,
+                                               profile=profile,
+                                               budget=budget)
+        if source_hydration:
+            # Все поля выдачи уже есть в _source документов, БД в поиске не участвует
+            page = await search
+            partial = page.get("partial", False)
+            fragments_by_id, videos_by_id = hydrate_from_source(page["video_hits"])
+        else:
+            fragments_by_id, videos_by_id, page, partial = await hydrate_from_database(search, budget, query)
+        video_hits = page["video_hits"]
 
-        # Сортировка результатов по максимальному score
-        results.sort(key=lambda x: max(f.score for f in x.fragments) if x.fragments else 0, reverse=True)
+        keys = set(fragment_media_keys(fragments_by_id.values())) | {video.s3_url for video in videos_by_id.values()}
+        keys = {key for key in keys if key and not is_hls_key(key)}
+        signed_urls = await async_sign_urls(keys, timeout=budget.remaining_seconds())
+        if len(signed_urls) < len(keys):
+            # Неподписанные ссылки отдаются пустыми
+            count_overrun("sign")
+            partial = True
+        with timing.span("assemble"):
+            results = assemble_collapsed_results(video_hits, fragments_by_id, videos_by_id, signed_urls)
 
-        db.close()
-        return SearchResultResponse(status=SearchStatus.completed, results=results)
+        response = SearchResultResponse(
+            status=SearchStatus.completed,
+            results=results,
+            total_videos=page["total_videos"],
+            next_cursor=page["next_cursor"],
+            partial=partial
+        )
+        if budget.expired:
+            metrics.inc("search_budget_exceeded_total", help_text="Search requests that finished over their latency budget")
+        if profile:
+            timings = timing.current()
+            response.profile = {
+                "elasticsearch": page.get("profile"),
+                "spans": timings.as_dict() if timings else []
+            }
+        timing.handler_done()
+        return response
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(str(e))
-        return SearchResultResponse(status=SearchStatus.failed, results=[], error=str(e))
\ No newline at end of file
+        return SearchResultResponse(status=SearchStatus.failed, results=[], error=str(e))
+
+@router.post("/batch", response_model=BatchSearchResponse)
+def batch_search_videos(request: BatchSearchRequest):
+    # Число запросов и размеры страниц проверяет схема BatchSearchRequest (422)
+    queries = request.queries
+    try:
+        # Все поиски одним _msearch, затем одна гидратация фрагментов на весь пакет
+        pages = multi_search_videos_collapsed(queries)
+        if get_hydration_mode() == "source":
+            fragments_by_id, videos_by_id = hydrate_from_source(
+                [video_hit for page in pages if "error" not in page for video_hit in page["video_hits"]])
+            keys = fragment_media_keys(fragments_by_id.values()) + [video.s3_url for video in videos_by_id.values()]
+            with timing.span("sign"):
+                signed_urls = sign_urls(keys)
+        else:
+            fragment_ids = [frag_id for page in pages if "error" not in page
+                            for frag_id in collapsed_fragment_ids(page["video_hits"])]
+            fragments_by_id, videos_by_id, signed_urls = hydrate_fragments(fragment_ids)
+
+        assemble_start = time.perf_counter()
+        results = []
+        for page in pages:
+            if "error" in page:
+                results.append(SearchResultResponse(status=SearchStatus.failed, results=[], error=page["error"]))
+                continue
+            results.append(SearchResultResponse(
+                status=SearchStatus.completed,
+                results=assemble_collapsed_results(page["video_hits"], fragments_by_id, videos_by_id, signed_urls),
+                total_videos=page["total_videos"],
+                next_cursor=page["next_cursor"],
+                partial=page.get("partial", False)
+            ))
+        timing.record("assemble", (time.perf_counter() - assemble_start) * 1000)
+        timing.handler_done()
+        return BatchSearchResponse(results=results)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch search error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/suggest", response_model=SuggestResponse)
+def suggest(
+    prefix: str = Query(..., min_length=settings.SUGGEST_MIN_PREFIX_LENGTH, max_length=100),
+    size: int = Query(5, ge=1, le=settings.SUGGEST_MAX_SIZE)
+):
+    try:
+        language, suggestions = suggest_phrases(prefix, size)
+        return SuggestResponse(prefix=prefix, language=language, suggestions=suggestions)
+    except Exception as e:
+        logger.error(f"Suggest error: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
@@ -1,80 +1,121 @@
 import os
-import uuid
-import shutil
 import time
-import glob
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, BackgroundTasks
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, Query, HTTPException, Request, BackgroundTasks
 from db.repositories.video_repository import VideoRepository
 from db.base import SessionLocal
 from schemas.upload import UploadResponse, UploadStatus
-from tasks.process_video_task import process_video_task
+from tasks.process_video_task import process_video_task, original_video_key
 from core.config import settings
-from utils.s3_utils import generate_presigned_url
+from utils.s3_utils import generate_presigned_url, calculate_part_size, StreamingMultipartUpload
+from utils.upload_io import run_io, copy_file_async
+from utils.temp_storage import TempStorageManager, InsufficientTempSpace, temp_storage
 from core.logger import logger
+from core import timing
 
 router = APIRouter()
 
 class VideoUploader:
-    def __init__(self, temp_dir: str):
-        self.temp_dir = temp_dir
-        os.makedirs(temp_dir, exist_ok=True)
-        
-    def check_disk_space(self, file_size: int) -> bool:
-        """Проверяет, достаточно ли свободного места для загрузки файла"""
-        free_space = shutil.disk_usage(self.temp_dir).free
-        # Требуем в 1.5 раза больше места, чем размер файла, для обработки
-        required_space = file_size * 1.5
-        return free_space >= required_space
-    
-    def clean_old_temp_files(self, max_age_hours: int = 24) -> int:
+    """Прием файла загрузки в каталог задачи временного хранилища"""
+
+    def __init__(self, storage: TempStorageManager = temp_storage):
+        self.storage = storage
+
+    def reserve_space(self, job_id: str, file_size: int, lease_seconds: float = None):
+        """Резервирует временное место под файл и берет аренду каталога задачи; при нехватке HTTP 507"""
+        try:
+            self.storage.reserve(job_id, file_size, lease_seconds=lease_seconds)
+        except InsufficientTempSpace as e:
+            logger.error(f"Недостаточно места для загрузки {file_size/1024/1024:.1f} МБ: {str(e)}")
+            raise HTTPException(status_code=507, detail=str(e))
+        logger.info(f"Запрошена загрузка файла размером {file_size/1024/1024:.1f} МБ, место зарезервировано")
+
+    def discard(self, job_id: str):
+        """Удаляет каталог задачи, если загрузка не дошла до постановки задачи обработки"""
+        self.storage.release(job_id, delete=True)
+
+    def hand_off(self, job_id: str):
         """
-        Удаляет временные файлы старше указанного количества часов.
-        Возвращает количество освобожденных байтов.
+        Продлевает аренду принятого файла до начала обработки: задача может ждать в очереди
+        за многочасовыми задачами, а без аренды файл станет кандидатом на вытеснение.
+        Задача при старте берет аренду уже на свой срок.
         """
-        freed_space = 0
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        try:
-            for file_path in glob.glob(os.path.join(self.temp_dir, "*")):
-                if os.path.isfile(file_path):
-                    file_stat = os.stat(file_path)
-                    file_age = current_time - file_stat.st_mtime
-                    
-                    # Файл старше максимального возраста
-                    if file_age > max_age_seconds:
-                        try:
-                            file_size = os.path.getsize(file_path)
-                            os.remove(file_path)
-                            freed_space += file_size
-                            logger.info(f"Удален старый временный файл: {file_path}, возраст: {file_age/3600:.1f} часов, размер: {file_size/1024/1024:.1f} МБ")
-                        except Exception as e:
-                            logger.warning(f"Не удалось удалить временный файл {file_path}: {str(e)}")
-            
-            logger.info(f"Очистка временных файлов: освобождено {freed_space/1024/1024:.1f} МБ")
-            return freed_space
-        except Exception as e:
-            logger.error(f"Ошибка при очистке временных файлов: {str(e)}")
-            return 0
-        
-    def save_temp_file(self, file: UploadFile) -> (str, str):
-        """Сохраняет загруженный файл во временную директорию, используя поточную передачу данных"""
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        temp_path = os.path.join(self.temp_dir, unique_filename)
+        self.storage.acquire(job_id, lease_seconds=settings.TEMP_QUEUED_LEASE_SECONDS)
+
+    async def save_temp_file(self, job_id: str, file: UploadFile) -> (str, str):
+        """Сохраняет загруженный файл в каталог задачи кусками в пуле потоков загрузок"""
+        unique_filename = f"{job_id}_{os.path.basename(file.filename)}"
+        temp_path = await run_io(self.storage.job_path, job_id, unique_filename)
+        buffer = await run_io(open, temp_path, "wb")
         try:
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            return temp_path, unique_filename
+            try:
+                await copy_file_async(file.file, buffer, max_size=settings.MAX_UPLOAD_SIZE)
+            finally:
+                await run_io(buffer.close)
+        except ValueError as e:
+            await run_io(remove_temp_file, temp_path)
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            await run_io(remove_temp_file, temp_path)
             logger.error(f"Error saving file: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+        return temp_path, unique_filename
+
+    async def save_stream_tee(self, job_id: str, request: Request, filename: str, expected_size: int = 0):
+        """
+        Пишет тело запроса одновременно во временный файл и в multipart-загрузку S3.
+        Чанки копятся до UPLOAD_CHUNK_SIZE и пишутся в потоке, чтобы не блокировать цикл событий;
+        части в S3 уходят параллельно, пока клиент еще передает файл.
+        Возвращает (temp_path, unique_filename, s3_key, size).
+        """
+        unique_filename = f"{job_id}_{os.path.basename(filename)}"
+        temp_path = await run_io(self.storage.job_path, job_id, unique_filename)
+        s3_key = original_video_key(unique_filename)
+        upload = await run_io(StreamingMultipartUpload, s3_key, calculate_part_size(expected_size))
+
+        def write(f, data):
+            f.write(data)
+            upload.write(data)
+
+        try:
+            f = await run_io(open, temp_path, "wb")
+            try:
+                buffer = bytearray()
+                async for chunk in request.stream():
+                    buffer += chunk
+                    if upload.size + len(buffer) > settings.MAX_UPLOAD_SIZE:
+                        raise HTTPException(status_code=413, detail=f"File exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+                    if len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+                        # Следующий кусок читается только после записи этого
+                        await run_io(write, f, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await run_io(write, f, bytes(buffer))
+            finally:
+                await run_io(f.close)
+            if upload.size == 0:
+                raise HTTPException(status_code=400, detail="Empty request body")
+            await run_io(upload.complete)
+            return temp_path, unique_filename, s3_key, upload.size
+        except BaseException:
+            await run_io(upload.abort)
+            await run_io(remove_temp_file, temp_path)
+            raise
+
+def remove_temp_file(temp_path):
+    if temp_path and os.path.exists(temp_path):
+        os.remove(temp_path)
+
+def create_video_record(name: str, description: Optional[str], s3_url: str):
+    with SessionLocal() as db:
+        video = VideoRepository(db).create_video(name=name, description=description, s3_url=s3_url,
+                                                 status=UploadStatus.uploading)
+        db.commit()
+        return video
 
 def cleanup_background_task():
     """Фоновая задача для очистки временных файлов"""
-    uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
-    uploader.clean_old_temp_files(max_age_hours=settings.TEMP_FILES_MAX_AGE_HOURS)
+    temp_storage.cleanup()
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_video(
@@ -84,122 +125,115 @@ async def upload_video(
     name: str = Form(...), 
     description: str = Form(None)
 ):
-    temp_path = None  # initialize variable
-    uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
+    uploader = VideoUploader()
+    job_id = temp_storage.new_job_id()
     
     try:
         # Получаем размер файла из заголовков запроса, если доступно
+        disk_check_start = time.perf_counter()
         content_length = request.headers.get("content-length")
         if content_length:
-            file_size = int(content_length)
-            
-            # Получаем информацию о свободном месте
-            disk_usage = shutil.disk_usage(settings.TEMP_UPLOAD_DIR)
-            free_space = disk_usage.free
-            free_percent = free_space * 100 / disk_usage.total
-            
-            # Логируем информацию о дисковом пространстве
-            logger.info(f"Запрошена загрузка файла размером {file_size/1024/1024:.1f} МБ. "
-                       f"Свободное место: {free_space/1024/1024/1024:.1f} ГБ ({free_percent:.1f}%)")
-            
-            # Проверяем достаточно ли места на диске
-            if not uploader.check_disk_space(file_size):
-                # Пробуем освободить место, удаляя старые временные файлы
-                logger.warning("Недостаточно места на диске, пытаемся освободить место...")
-                freed_space = uploader.clean_old_temp_files(max_age_hours=1)  # Удаляем файлы старше 1 часа
-                
-                # Проверяем, достаточно ли места после очистки
-                if freed_space > 0:
-                    free_space = shutil.disk_usage(settings.TEMP_UPLOAD_DIR).free
-                    if free_space >= file_size * 1.5:
-                        logger.info(f"Успешно освободили {freed_space/1024/1024:.1f} МБ места. "
-                                  f"Теперь доступно {free_space/1024/1024/1024:.1f} ГБ")
-                    else:
-                        # Если всё еще недостаточно места, возвращаем ошибку
-                        logger.error(f"После очистки всё еще недостаточно места. "
-                                   f"Требуется: {file_size*1.5/1024/1024:.1f} МБ, доступно: {free_space/1024/1024:.1f} МБ")
-                        raise HTTPException(
-                            status_code=507, 
-                            detail=f"Not enough disk space even after cleanup. "
-                                  f"Required: {file_size*1.5} bytes, available: {free_space} bytes"
-                        )
-                else:
-                    # Если не удалось освободить место, возвращаем ошибку
-                    raise HTTPException(
-                        status_code=507, 
-                        detail=f"Not enough disk space. Required: {file_size*1.5} bytes, available: {free_space} bytes"
-                    )
+            await run_io(uploader.reserve_space, job_id, int(content_length))
+        else:
+            await run_io(temp_storage.acquire, job_id)
+        
+        timing.record("disk_check", (time.perf_counter() - disk_check_start) * 1000)
         
         # Запускаем фоновую задачу по очистке старых временных файлов
         background_tasks.add_task(cleanup_background_task)
                 
         # Сохраняем файл
-        temp_path, unique_filename = uploader.save_temp_file(video_file)
-        actual_size = os.path.getsize(temp_path)
+        with timing.span("save"):
+            temp_path, unique_filename = await uploader.save_temp_file(job_id, video_file)
+        actual_size = await run_io(os.path.getsize, temp_path)
         logger.info(f"Файл {unique_filename} успешно загружен, размер: {actual_size/1024/1024:.1f} МБ")
         
         # Создаем запись в базе данных
-        db = SessionLocal()
-        repo = VideoRepository(db)
-        video = repo.create_video(name=name, description=description, s3_url="", status=UploadStatus.uploading)
-        db.commit()
-        db.close()
+        with timing.span("db"):
+            video = await run_io(create_video_record, name, description, "")
         
         # Запускаем обработку видео асинхронно
-        task = process_video_task.delay(video_id=video.id, temp_file_path=temp_path, original_filename=unique_filename)
+        with timing.span("enqueue"):
+            await run_io(uploader.hand_off, job_id)
+            task = await run_io(process_video_task.delay, video_id=video.id, temp_file_path=temp_path,
+                                original_filename=unique_filename)
         
+        # Аренда каталога остается за задачей обработки
+        timing.handler_done()
         return UploadResponse(video_id=str(video.id), status=UploadStatus.uploading, task_id=task.id)
     except HTTPException as he:
         # Удаляем временный файл в случае ошибки HTTP
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
+        await run_io(uploader.discard, job_id)
         raise he
     except Exception as e:
         # Удаляем временный файл в случае других ошибок
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
+        await run_io(uploader.discard, job_id)
         logger.error(f"Ошибка при загрузке видео: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/upload/stream", response_model=UploadResponse)
+async def upload_video_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    name: str = Query(...),
+    filename: str = Query(..., description="Исходное имя файла"),
+    description: Optional[str] = Query(None)
+):
+    """
+    Загрузка видео сырым телом запроса (не multipart/form-data). Данные одновременно пишутся
+    во временный файл и в S3, поэтому к концу запроса оригинал уже в хранилище,
+    а задача обработки пропускает этап его загрузки.
+    """
+    uploader = VideoUploader()
+    job_id = temp_storage.new_job_id()
+    try:
+        with timing.span("disk_check"):
+            content_length = int(request.headers.get("content-length") or 0)
+            if content_length > settings.MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail=f"File exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+            if content_length:
+                await run_io(uploader.reserve_space, job_id, content_length)
+            else:
+                await run_io(temp_storage.acquire, job_id)
+        background_tasks.add_task(cleanup_background_task)
+
+        with timing.span("save", "temp file + s3"):
+            temp_path, unique_filename, s3_key, size = await uploader.save_stream_tee(job_id, request, filename, content_length)
+        logger.info(f"Файл {unique_filename} загружен потоком в файл и S3 ({s3_key}), размер: {size/1024/1024:.1f} МБ")
+
+        with timing.span("db"):
+            video = await run_io(create_video_record, name, description, s3_key)
+
+        with timing.span("enqueue"):
+            await run_io(uploader.hand_off, job_id)
+            task = await run_io(process_video_task.delay, video_id=video.id, temp_file_path=temp_path,
+                                original_filename=unique_filename, s3_key=s3_key)
+
+        timing.handler_done()
+        return UploadResponse(video_id=str(video.id), status=UploadStatus.uploading, task_id=task.id)
+    except HTTPException:
+        await run_io(uploader.discard, job_id)
+        raise
+    except Exception as e:
+        await run_io(uploader.discard, job_id)
+        logger.error(f"Ошибка при потоковой загрузке видео: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Добавим эндпоинт для ручной очистки временных файлов
 @router.post("/cleanup-temp")
-async def cleanup_temp_files(hours: int = 12, force: bool = False):
+def cleanup_temp_files(hours: int = 12, force: bool = False):
     """
-    Ручная очистка временных файлов.
+    Ручная очистка временных файлов. Файлы задач, которые сейчас загружаются или обрабатываются, не удаляются.
     - hours: удалить файлы старше указанного количества часов
-    - force: если True, удалит все временные файлы независимо от возраста
+    - force: если True, удалит все неиспользуемые временные файлы независимо от возраста
     """
     try:
-        uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
-        
-        if force:
-            # Принудительная очистка всех временных файлов
-            total_freed = 0
-            file_count = 0
-            
-            for file_path in glob.glob(os.path.join(settings.TEMP_UPLOAD_DIR, "*")):
-                if os.path.isfile(file_path):
-                    try:
-                        size = os.path.getsize(file_path)
-                        os.remove(file_path)
-                        total_freed += size
-                        file_count += 1
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить файл {file_path}: {str(e)}")
-            
-            return {
-                "status": "success",
-                "files_removed": file_count,
-                "space_freed_mb": total_freed / (1024 * 1024)
-            }
-        else:
-            # Обычная очистка файлов старше указанного времени
-            freed_space = uploader.clean_old_temp_files(max_age_hours=hours)
-            
-            return {
-                "status": "success",
-                "space_freed_mb": freed_space / (1024 * 1024)
-            }
+        freed_space = temp_storage.evict_all() if force else temp_storage.cleanup(max_age_hours=hours)
+        return {
+            "status": "success",
+            "space_freed_mb": freed_space / (1024 * 1024),
+            "usage": temp_storage.usage()
+        }
     except Exception as e:
         logger.error(f"Ошибка при очистке временных файлов: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,11 +1,18 @@
-from typing import List
-from fastapi import APIRouter, HTTPException
+import os
+from typing import List, Optional
+from botocore.exceptions import ClientError
+from fastapi import APIRouter, HTTPException, Response, Header, Query
+from fastapi.responses import StreamingResponse
 from db.base import SessionLocal
 from db.repositories.video_repository import VideoRepository
-from schemas.video import VideoFragmentsResponse, FragmentInfo, VideoInfo
-from utils.s3_utils import generate_presigned_url, delete_file_from_s3
-from utils.elasticsearch_utils import delete_fragment_by_id
+from schemas.video import VideoFragmentsResponse, FragmentInfo, VideoInfo, SpriteInfo
+from utils.s3_utils import generate_presigned_url, delete_file_from_s3, delete_prefix_from_s3
+from utils.hls import is_hls_key, hls_prefix, render_fragment_playlist, playlist_cache, PLAYLIST_CONTENT_TYPE
+from utils.media_cache import fragment_media_url, fragment_rendition_urls, fragment_keys, get_media_cache, parse_range, iter_file_range
+from utils.previews import previews_prefix
+from utils.renditions import rendition_media_type
 from core.logger import logger
+from tasks.indexing_task import drain_search_outbox_task
 
 router = APIRouter()
 
@@ -30,25 +37,36 @@ def get_video_fragments(video_id: int):
                 raise HTTPException(status_code=404, detail="Видео не найдено")
             
             fragments = video_repo.get_video_fragments(video_id)
+            keys = {key for fragment in fragments
+                    for key in (fragment.s3_url, fragment.thumbnail_url, *(fragment.renditions or {}).values())
+                    if key and not is_hls_key(key)}
+            signed_urls = {key: generate_presigned_url(key) for key in keys}
             fragments_info = [
                 FragmentInfo(
                     id=fragment.id,
                     timecode_start=fragment.timecode_start,
                     timecode_end=fragment.timecode_end,
                     text=fragment.text,
-                    s3_url=generate_presigned_url(fragment.s3_url),
+                    s3_url=fragment_media_url(fragment.id, fragment.s3_url, signed_urls),
+                    thumbnail_url=signed_urls.get(fragment.thumbnail_url),
+                    renditions=fragment_rendition_urls(fragment.id, fragment.renditions, signed_urls),
                     tags=fragment.tags or []
                 )
                 for fragment in fragments
             ]
             
             video_url = generate_presigned_url(video.s3_url) if video.s3_url else ""
+            sprite = None
+            if video.sprite:
+                sprite = SpriteInfo(url=generate_presigned_url(video.sprite["s3_url"]), **{
+                    field: video.sprite[field] for field in ("interval", "columns", "rows", "tile_width", "tile_height")})
             
             return VideoFragmentsResponse(
                 video_id=video_id,
                 title=video.name,
                 description=video.description,
                 video_url=video_url,
+                sprite=sprite,
                 fragments=fragments_info
             )
     except HTTPException:
@@ -57,6 +75,68 @@ def get_video_fragments(video_id: int):
         logger.error(f"Error fetching fragments for video {video_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching video fragments: {str(e)}")
 
+@router.get("/fragments/{fragment_id}/playlist.m3u8")
+def get_fragment_playlist(fragment_id: int):
+    """HLS-плейлист фрагмента: сегменты общего транскода видео, пересекающие отрезок фрагмента"""
+    with SessionLocal() as session:
+        fragment = VideoRepository(session).get_fragment_by_id(fragment_id)
+        if not fragment or not is_hls_key(fragment.s3_url):
+            raise HTTPException(status_code=404, detail="HLS playlist not found")
+        key, start, end = fragment.s3_url, fragment.timecode_start, fragment.timecode_end
+    try:
+        playlist = render_fragment_playlist(key, start, end)
+    except Exception as e:
+        logger.error(f"Error building playlist for fragment {fragment_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Could not read video playlist")
+    # Подписанные ссылки внутри плейлиста живут час, поэтому клиенту кэшировать его дольше нельзя
+    return Response(content=playlist, media_type=PLAYLIST_CONTENT_TYPE,
+                    headers={"Cache-Control": "private, max-age=600"})
+
+@router.get("/fragments/{fragment_id}/media")
+def stream_fragment_media(fragment_id: int, range_header: Optional[str] = Header(None, alias="Range"),
+                          rendition: Optional[str] = Query(None, description="Вариант файла; по умолчанию основной")):
+    """Файл фрагмента из локального кэша с поддержкой Range; при промахе кэш заполняется из S3"""
+    key = fragment_keys.get((fragment_id, rendition))
+    if key is None:
+        with SessionLocal() as session:
+            fragment = VideoRepository(session).get_fragment_by_id(fragment_id)
+            if not fragment or not fragment.s3_url:
+                raise HTTPException(status_code=404, detail="Fragment not found")
+            key = (fragment.renditions or {}).get(rendition) if rendition else fragment.s3_url
+            if not key:
+                raise HTTPException(status_code=404, detail=f"Rendition '{rendition}' not found")
+        fragment_keys.set((fragment_id, rendition), key)
+    if is_hls_key(key):
+        raise HTTPException(status_code=409, detail="Fragment is served as an HLS playlist")
+
+    try:
+        f = get_media_cache().open_file(key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            raise HTTPException(status_code=404, detail="Fragment media not found")
+        logger.error(f"Error fetching media of fragment {fragment_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Could not fetch fragment media")
+    size = os.fstat(f.fileno()).st_size
+    headers = {
+        "Accept-Ranges": "bytes",
+        # Ключ фрагмента уникален, файл под ним не меняется
+        "Cache-Control": "public, max-age=86400, immutable",
+        "ETag": f'"{fragment_id}-{os.path.basename(key)}-{size}"',
+    }
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file_range(f, start, end - start + 1), status_code=status_code,
+                             media_type=rendition_media_type(key), headers=headers)
 
 @router.delete("/{video_id}")
 def delete_video(video_id: int):
@@ -69,12 +149,27 @@ def delete_video(video_id: int):
             raise HTTPException(status_code=404, detail="Video not found")
         fragments = repo.get_video_fragments(video_id)
         for frag in fragments:
+            for rendition in [None, *(frag.renditions or {})]:
+                fragment_keys.pop((frag.id, rendition))
+        # Документы удалит из поискового индекса индексатор по записям outbox из delete_video
+        # Фрагменты HLS ссылаются на один плейлист, транскод удаляется целиком по префиксу
+        hls_keys = {frag.s3_url for frag in fragments if is_hls_key(frag.s3_url)}
+        if hls_keys:
             try:
-                delete_fragment_by_id(frag.id)
-            except:
-                pass
+                delete_prefix_from_s3(hls_prefix(video_id))
+            except Exception as e:
+                logger.warning(f"Could not delete HLS files of video {video_id}: {str(e)}")
+            for key in hls_keys:
+                playlist_cache.pop(key)
+        if video.sprite or any(frag.thumbnail_url for frag in fragments):
+            try:
+                delete_prefix_from_s3(previews_prefix(video_id))
+            except Exception as e:
+                logger.warning(f"Could not delete previews of video {video_id}: {str(e)}")
+        media_keys = {key for frag in fragments for key in (frag.s3_url, *(frag.renditions or {}).values())}
+        for key in media_keys - hls_keys:
             try:
-                delete_file_from_s3(frag.s3_url)
+                delete_file_from_s3(key)
             except:
                 pass
         if video.s3_url:
@@ -85,6 +180,10 @@ def delete_video(video_id: int):
         repo.delete_video(video_id)
         db.commit()
         db.close()
+        try:
+            drain_search_outbox_task.delay()
+        except Exception as e:
+            logger.warning(f"Could not schedule search outbox drain: {str(e)}")
         return {"message": "Video deleted", "video_id": video_id}
     except HTTPException as he:
         raise he
@@ -0,0 +1,78 @@
+"""
+Скорость пакетной индексации в зависимости от размера пачки и числа потоков.
+
+Запуск из каталога backend:
+    python -m benchmarks.bulk_indexing --chunk-sizes 100 500 2000 --threads 1 4
+    python -m benchmarks.bulk_indexing --corpus fragments.jsonl --repeat 10 --json
+
+Корпус — как в benchmarks.index_profiles; --repeat размножает его для оценки больших загрузок.
+Каждый прогон пишет во временный индекс <index>_bench_bulk, пересоздаваемый заново.
+"""
+import argparse
+import json
+from types import SimpleNamespace
+from core.config import settings
+from core.logger import logger
+from utils.bulk_indexer import bulk_index
+from utils.elasticsearch_utils import get_elasticsearch, create_reelearn_index, convert_fragment
+from benchmarks.index_profiles import load_corpus
+
+def repeat_corpus(corpus, times):
+    if times <= 1:
+        return corpus
+    rows = []
+    for _ in range(times):
+        for frag in corpus:
+            row = SimpleNamespace(**{key: getattr(frag, key, None) for key in (
+                "video_id", "text", "timecode_start", "timecode_end", "tags", "s3_url",
+                "speech_confidence", "no_speech_prob", "language")})
+            row.id = len(rows) + 1
+            rows.append(row)
+    return rows
+
+def bench_bulk(es, corpus, chunk_size, threads, large_load):
+    index = f"{settings.ELASTICSEARCH_INDEX_NAME}_bench_bulk"
+    create_reelearn_index(delete_if_exist=True, index=index)
+    try:
+        actions = [convert_fragment(frag, index=index) for frag in corpus]
+        report = bulk_index(es, actions, index=index, chunk_size=chunk_size, threads=threads, large_load=large_load)
+    finally:
+        es.indices.delete(index=index, ignore_unavailable=True)
+    return {
+        "chunk_size": chunk_size,
+        "threads": threads,
+        "large_load": large_load,
+        "docs": report.indexed,
+        "failed": len(report.failed),
+        "retried": report.retried,
+        "seconds": round(report.seconds, 3),
+        "docs_per_second": round(report.docs_per_second, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk indexing throughput")
+    parser.add_argument("--corpus", help="JSONL file with fragments; defaults to the fragments table")
+    parser.add_argument("--repeat", type=int, default=1, help="Multiply the corpus to simulate larger loads")
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[settings.ELASTICSEARCH_BATCH_SIZE])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--keep-refresh", action="store_true", help="Do not disable refresh and replicas during loads")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    corpus = repeat_corpus(load_corpus(args.corpus), args.repeat)
+    if not corpus:
+        parser.error("Corpus is empty")
+    logger.info(f"Benchmarking bulk indexing of {len(corpus)} fragments")
+
+    es = get_elasticsearch()
+    reports = [bench_bulk(es, corpus, chunk_size, threads, not args.keep_refresh)
+               for chunk_size in args.chunk_sizes for threads in args.threads]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    print(f"{'chunk':>6} {'threads':>7} {'docs':>8} {'failed':>7} {'seconds':>8} {'docs/s':>9}")
+    for r in reports:
+        print(f"{r['chunk_size']:>6} {r['threads']:>7} {r['docs']:>8} {r['failed']:>7} {r['seconds']:>8.2f} {r['docs_per_second']:>9.0f}")
+
+if __name__ == "__main__":
+    main()
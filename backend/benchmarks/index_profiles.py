@@ -0,0 +1,142 @@
+"""
+Сравнение профилей индекса на одном корпусе: размер на диске, скорость индексации и задержка запросов.
+
+Запуск из каталога backend:
+    python -m benchmarks.index_profiles --profiles full compact edge language
+    python -m benchmarks.index_profiles --corpus fragments.jsonl --queries queries.txt --json
+
+Корпус по умолчанию берется из таблицы fragments; файл корпуса — JSONL со строками
+{"text": ..., "language": ...}. Для каждого профиля создается временный индекс <index>_bench_<profile>.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from elasticsearch import helpers
+from core.config import settings
+from core.logger import logger
+from utils.elasticsearch_utils import get_elasticsearch, create_reelearn_index, convert_fragment
+from utils.index_profiles import INDEX_PROFILES, get_index_profile
+from services.search_service import build_query_clause
+
+def load_corpus(path=None):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [
+            SimpleNamespace(id=i + 1, video_id=row.get("video_id", 1), text=row["text"],
+                            timecode_start=row.get("timecode_start", 0.0), timecode_end=row.get("timecode_end", 0.0),
+                            tags=row.get("tags", []), s3_url=row.get("s3_url", ""),
+                            speech_confidence=1.0, no_speech_prob=0.0, language=row.get("language", "en"))
+            for i, row in enumerate(rows)
+        ]
+    from db.base import SessionLocal
+    from db.models.fragment import Fragment
+    from sqlalchemy.orm import joinedload
+    with SessionLocal() as db:
+        return db.query(Fragment).options(joinedload(Fragment.video)).all()
+
+def load_queries(corpus, path=None, count=200, seed=42):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    # Запросы из самого корпуса: отрезки по 1–4 слова из случайных фрагментов
+    rng = random.Random(seed)
+    queries = []
+    texts = [frag.text for frag in corpus if frag.text]
+    for _ in range(min(count, len(texts) * 4)):
+        words = rng.choice(texts).split()
+        if not words:
+            continue
+        length = rng.randint(1, min(4, len(words)))
+        start = rng.randint(0, len(words) - length)
+        queries.append(" ".join(words[start:start + length]))
+    return queries
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def bench_profile(es, profile, corpus, queries, batch_size, keep=False):
+    index = f"{settings.ELASTICSEARCH_INDEX_NAME}_bench_{profile.name}"
+    create_reelearn_index(delete_if_exist=True, profile=profile, index=index)
+    try:
+        es.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1"}})
+        actions = (convert_fragment(frag, profile=profile, index=index) for frag in corpus)
+        start = time.perf_counter()
+        indexed, _ = helpers.bulk(es, actions, chunk_size=batch_size, refresh=False)
+        es.indices.refresh(index=index)
+        index_seconds = time.perf_counter() - start
+
+        es.indices.put_settings(index=index, body={"index": {"refresh_interval": None}})
+        es.indices.forcemerge(index=index, max_num_segments=1)
+        es.indices.refresh(index=index)
+        stats = es.indices.stats(index=index, metric="store")
+        size_bytes = stats["indices"][index]["primaries"]["store"]["size_in_bytes"]
+
+        results = {}
+        for exact in (False, True):
+            latencies, took = [], []
+            for query in queries:
+                body = {"query": build_query_clause(query, exact, profile=profile), "size": 20}
+                q_start = time.perf_counter()
+                res = es.search(index=index, body=body)
+                latencies.append((time.perf_counter() - q_start) * 1000)
+                took.append(res["took"])
+            results["exact" if exact else "fuzzy"] = {
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "mean_ms": statistics.mean(latencies),
+                "es_took_p95_ms": percentile(took, 95),
+            }
+
+        return {
+            "profile": profile.name,
+            "docs": indexed,
+            "index_seconds": index_seconds,
+            "docs_per_second": indexed / index_seconds if index_seconds > 0 else 0,
+            "size_mb": size_bytes / (1024 * 1024),
+            "queries": results,
+        }
+    finally:
+        if not keep:
+            es.indices.delete(index=index, ignore_unavailable=True)
+
+def print_report(reports):
+    header = f"{'profile':<10} {'docs':>7} {'size MB':>9} {'docs/s':>9} {'fuzzy p50':>10} {'fuzzy p95':>10} {'exact p50':>10} {'exact p95':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        fuzzy, exact = r["queries"]["fuzzy"], r["queries"]["exact"]
+        print(f"{r['profile']:<10} {r['docs']:>7} {r['size_mb']:>9.2f} {r['docs_per_second']:>9.0f} "
+              f"{fuzzy['p50_ms']:>10.1f} {fuzzy['p95_ms']:>10.1f} {exact['p50_ms']:>10.1f} {exact['p95_ms']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Elasticsearch index profiles")
+    parser.add_argument("--profiles", nargs="+", default=sorted(INDEX_PROFILES))
+    parser.add_argument("--corpus", help="JSONL file with fragments; defaults to the fragments table")
+    parser.add_argument("--queries", help="Text file with one query per line; defaults to samples from the corpus")
+    parser.add_argument("--query-count", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=settings.ELASTICSEARCH_BATCH_SIZE)
+    parser.add_argument("--keep", action="store_true", help="Keep benchmark indices after the run")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error("Corpus is empty")
+    queries = load_queries(corpus, args.queries, args.query_count)
+    logger.info(f"Benchmarking {len(args.profiles)} profiles on {len(corpus)} fragments and {len(queries)} queries")
+
+    es = get_elasticsearch()
+    reports = [bench_profile(es, get_index_profile(name), corpus, queries, args.batch_size, args.keep)
+               for name in args.profiles]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Сравнение синхронного и асинхронного пути поиска под конкурентной нагрузкой.
+
+Elasticsearch подменяется локальным HTTP-сервером с заданной задержкой и готовым ответом,
+Postgres — задержкой той же длительности, подпись ссылок выполняется настоящим boto3 (локально).
+Синхронный путь выполняется в пуле из 40 потоков, как sync-эндпоинты FastAPI по умолчанию.
+
+Запуск из каталога backend:
+    python -m benchmarks.search_concurrency --concurrency 1 10 50 200 --es-latency-ms 30 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from core.config import settings
+
+def make_es_response(videos, fragments_per_video):
+    hits = []
+    for video_id in range(1, videos + 1):
+        inner = [{"_score": 10.0 - i, "_source": {"fragment_id": video_id * 100 + i, "video_id": video_id}}
+                 for i in range(fragments_per_video)]
+        hits.append({
+            "_score": 10.0,
+            "_source": {"fragment_id": video_id * 100, "video_id": video_id},
+            "fields": {"video_id": [video_id]},
+            "inner_hits": {"top_fragments": {"hits": {"total": {"value": fragments_per_video, "relation": "eq"}, "hits": inner}}}
+        })
+    return json.dumps({
+        "took": 1, "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": videos, "relation": "eq"}, "max_score": 10.0, "hits": hits},
+        "aggregations": {"videos_total": {"value": videos}}
+    }).encode()
+
+def start_es_stand_in(latency_ms, body):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def summarize(name, concurrency, latencies, wall):
+    return {
+        "path": name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "rps": len(latencies) / wall if wall > 0 else 0,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))],
+    }
+
+def run_sync(concurrency, requests, db_latency_ms, keys):
+    from services.search_service import search_videos_collapsed, sign_urls
+
+    def one_request():
+        start = time.perf_counter()
+        search_videos_collapsed("machine learning basics")
+        time.sleep(db_latency_ms / 1000)  # гидратация из Postgres
+        sign_urls(keys)
+        return (time.perf_counter() - start) * 1000
+
+    # Не более concurrency запросов в полете; выполняет их пул из 40 потоков
+    in_flight = threading.BoundedSemaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        start = time.perf_counter()
+        futures = []
+        for _ in range(requests):
+            in_flight.acquire()
+            future = pool.submit(one_request)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        latencies = [f.result() for f in futures]
+        return summarize("sync", concurrency, latencies, time.perf_counter() - start)
+
+async def run_async(concurrency, requests, db_latency_ms, keys):
+    from services.search_service import async_search_videos_collapsed, async_sign_urls
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            start = time.perf_counter()
+            await asyncio.gather(
+                async_search_videos_collapsed("machine learning basics"),
+                asyncio.sleep(db_latency_ms / 1000)  # прогрев кэша видео
+            )
+            await asyncio.sleep(db_latency_ms / 1000)  # гидратация фрагментов
+            await async_sign_urls(keys)
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one_request() for _ in range(requests)))
+    return summarize("async", concurrency, list(latencies), time.perf_counter() - start)
+
+async def run_async_suite(levels, requests, db_latency_ms, keys):
+    from utils.elasticsearch_utils import close_async_elasticsearch
+    try:
+        return [await run_async(c, requests, db_latency_ms, keys) for c in levels]
+    finally:
+        await close_async_elasticsearch()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs async search paths against local stand-ins")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50, 200])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--es-latency-ms", type=float, default=30)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--videos", type=int, default=5)
+    parser.add_argument("--fragments-per-video", type=int, default=3)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    server = start_es_stand_in(args.es_latency_ms, make_es_response(args.videos, args.fragments_per_video))
+    settings.ELASTICSEARCH_HOST, settings.ELASTICSEARCH_PORT = server.server_address
+    keys = [f"fragments/fragment_{i}.mp4" for i in range(args.videos * (args.fragments_per_video + 1))]
+
+    try:
+        reports = [run_sync(c, args.requests, args.db_latency_ms, keys) for c in args.concurrency]
+        reports += asyncio.run(run_async_suite(args.concurrency, args.requests, args.db_latency_ms, keys))
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    print(f"{'path':<6} {'conc':>5} {'reqs':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in reports:
+        print(f"{r['path']:<6} {r['concurrency']:>5} {r['requests']:>6} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Задержка поиска во время параллельных больших загрузок.
+
+В одном цикле событий, как в процессе API, идут N загрузок и непрерывный поток поисковых запросов.
+Загрузка копирует заранее подготовленный временный файл (аналог spooled-файла UploadFile) в каталог
+загрузок: в режиме blocking — shutil.copyfileobj прямо в цикле событий, как делал обработчик раньше,
+в режиме offloaded — utils.upload_io.copy_file_async. Поиск — настоящий асинхронный путь
+(async_search_videos_collapsed и async_sign_urls) против локальной заглушки Elasticsearch
+из benchmarks.search_concurrency. Режим idle — поиск без загрузок.
+
+Запуск из каталога backend:
+    python -m benchmarks.upload_search_latency --uploads 4 --upload-mb 512 --es-latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from core.config import settings
+from benchmarks.search_concurrency import start_es_stand_in, make_es_response
+
+SOURCE_CHUNK = 1024 * 1024
+
+def make_source(size_mb):
+    """Временный файл заданного размера на диске, как UploadFile после приема тела запроса"""
+    f = tempfile.TemporaryFile(dir=settings.TEMP_UPLOAD_DIR)
+    block = os.urandom(SOURCE_CHUNK)
+    for _ in range(size_mb):
+        f.write(block)
+    f.flush()
+    return f
+
+async def blocking_upload(src, target_dir):
+    src.seek(0)
+    with open(os.path.join(target_dir, f"blocking_{id(src)}"), "wb") as dst:
+        shutil.copyfileobj(src, dst, settings.UPLOAD_CHUNK_SIZE)
+        os.fsync(dst.fileno())
+
+async def offloaded_upload(src, target_dir):
+    from utils.upload_io import run_io, copy_file_async
+    src.seek(0)
+    dst = await run_io(open, os.path.join(target_dir, f"offloaded_{id(src)}"), "wb")
+    try:
+        await copy_file_async(src, dst)
+        await run_io(os.fsync, dst.fileno())
+    finally:
+        await run_io(dst.close)
+
+async def probe_search(keys, stop, interval):
+    """Поисковые запросы подряд, пока не выставлен stop; возвращает задержки в мс"""
+    from services.search_service import async_search_videos_collapsed, async_sign_urls
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await async_search_videos_collapsed("machine learning basics")
+        await async_sign_urls(keys)
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+async def run_mode(mode, sources, keys, interval, idle_seconds):
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(probe_search(keys, stop, interval))
+    # Пусть первый запрос поиска уйдет раньше загрузок
+    await asyncio.sleep(interval)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=settings.TEMP_UPLOAD_DIR) as target_dir:
+        if mode == "idle":
+            await asyncio.sleep(idle_seconds)
+        else:
+            upload = blocking_upload if mode == "blocking" else offloaded_upload
+            await asyncio.gather(*(upload(src, target_dir) for src in sources))
+        wall = time.perf_counter() - start
+    stop.set()
+    latencies = await probe
+    return {
+        "mode": mode,
+        "uploads": 0 if mode == "idle" else len(sources),
+        "wall_s": wall,
+        "searches": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))],
+        "max_ms": max(latencies),
+    }
+
+async def run_suite(modes, sources, keys, interval, idle_seconds):
+    from utils.elasticsearch_utils import close_async_elasticsearch
+    try:
+        return [await run_mode(mode, sources, keys, interval, idle_seconds) for mode in modes]
+    finally:
+        await close_async_elasticsearch()
+
+def main():
+    parser = argparse.ArgumentParser(description="Search latency while large uploads are written to disk")
+    parser.add_argument("--modes", nargs="+", default=["idle", "blocking", "offloaded"],
+                        choices=["idle", "blocking", "offloaded"])
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--upload-mb", type=int, default=512)
+    parser.add_argument("--es-latency-ms", type=float, default=20)
+    parser.add_argument("--interval-ms", type=float, default=10)
+    parser.add_argument("--idle-seconds", type=float, default=3)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(settings.TEMP_UPLOAD_DIR, exist_ok=True)
+    server = start_es_stand_in(args.es_latency_ms, make_es_response(5, 3))
+    settings.ELASTICSEARCH_HOST, settings.ELASTICSEARCH_PORT = server.server_address
+    keys = [f"fragments/fragment_{i}.mp4" for i in range(20)]
+    sources = [make_source(args.upload_mb) for _ in range(args.uploads)]
+
+    try:
+        reports = asyncio.run(run_suite(args.modes, sources, keys, args.interval_ms / 1000, args.idle_seconds))
+    finally:
+        server.shutdown()
+        for src in sources:
+            src.close()
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    print(f"{'mode':<10} {'uploads':>7} {'wall s':>7} {'searches':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for r in reports:
+        print(f"{r['mode']:<10} {r['uploads']:>7} {r['wall_s']:>7.1f} {r['searches']:>9} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['max_ms']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
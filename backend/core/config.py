@@ -14,6 +14,7 @@ class Settings(BaseSettings):
     POSTGRES_SERVER: str = "localhost"
     POSTGRES_PORT: str = "5433"
     POSTGRES_DB: str = "reelearndb"
+    ASYNC_DB_POOL_SIZE: int = 20
     VIDEO_MIN_FRAGMENT_DURATION: float = 3.0
     VIDEO_MAX_FRAGMENT_DURATION: float = 60.0
     VIDEO_OPTIMAL_DURATION: float = 4.5
@@ -23,28 +24,121 @@ class Settings(BaseSettings):
     ELASTICSEARCH_HOST: str = "localhost"
     ELASTICSEARCH_PORT: int = 9200
     ELASTICSEARCH_INDEX_NAME: str = "reelearn_index"
+    ELASTICSEARCH_INDEX_PROFILE: str = "full"  # full, compact, edge, language (см. utils/index_profiles.py)
+    ELASTICSEARCH_INDEX_LAYOUT: str = "single"  # single или per_language (индекс на язык за алиасом ELASTICSEARCH_INDEX_NAME)
+    SEARCH_LANGUAGE_BOOST: float = 2.0  # Множитель score для индекса языка запроса при per_language
     ELASTICSEARCH_BATCH_SIZE: int = 100
+    ELASTICSEARCH_BULK_THREADS: int = 1  # Больше 1 — parallel_bulk
+    ELASTICSEARCH_BULK_MAX_RETRIES: int = 3
+    ELASTICSEARCH_BULK_INITIAL_BACKOFF: float = 2.0  # Секунды, удваивается с каждой попыткой
+    ELASTICSEARCH_BULK_LARGE_LOAD_DOCS: int = 1000  # С этого объема refresh и реплики отключаются на время загрузки
     ELASTICSEARCH_TIMEOUT: int = 30
+    SERVER_TIMING_ENABLED: bool = True  # Заголовок Server-Timing с этапами обработки запроса
+    SEARCH_BACKEND: str = "elasticsearch"  # elasticsearch или local (встроенный движок, services/local_search_engine.py)
+    LOCAL_SEARCH_INDEX_DIR: str = "data/local_index"
+    LOCAL_SEARCH_MAX_SEGMENTS: int = 8  # При превышении сегменты сливаются в один
+    LOCAL_SEARCH_MAX_EXPANSIONS: int = 50  # Максимум нечетких вариантов на слово запроса
+    SEARCH_OUTBOX_BATCH_SIZE: int = 500
+    SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS: float = 5.0
+    SEARCH_OUTBOX_MAX_ATTEMPTS: int = 10  # После этого строка остается в outbox, но не обрабатывается
+    SEARCH_OUTBOX_DRAIN_IN_API: bool = False  # Разбирать outbox в процессе API (установки без отдельного индексатора)
+    SEARCH_PLANNER_ENABLED: bool = True  # Сначала дешевый поиск фразы/слов, нечеткий — только при нехватке попаданий
+    SEARCH_PLANNER_MIN_HITS: int = 5  # Сколько видео с score не ниже порога достаточно, чтобы не расширять запрос
+    SEARCH_LATENCY_BUDGET_MS: int = 800  # Бюджет задержки поиска; по его исчерпании отдаются частичные результаты
+    SEARCH_MAX_LATENCY_BUDGET_MS: int = 10000  # Верхний предел для ?budget_ms
+    SEARCH_BATCH_LATENCY_BUDGET_MS: int = 3000
+    SEARCH_BUDGET_MIN_STEP_MS: int = 50  # Минимум времени на этап, даже если бюджет уже исчерпан
+    SEARCH_BUDGET_GRACE_SECONDS: float = 0.2  # Запас HTTP-таймаута клиента сверх timeout в теле запроса
+    SEARCH_TRACK_TOTAL_HITS: int = 1000  # Точный подсчет попаданий до этого предела
+    SEARCH_TERMINATE_AFTER: int = 0  # Максимум документов на шард; 0 — без ограничения
+    SEARCH_MAX_VIDEOS_PER_PAGE: int = 50
+    KEYWORD_TAGGING_ENABLED: bool = True  # Теги фрагментов из ключевых слов по TF-IDF (services/keyword_service.py)
+    KEYWORD_TAGS_PER_FRAGMENT: int = 5
+    KEYWORD_MIN_TERM_LENGTH: int = 3
+    KEYWORD_MIN_DOCUMENT_FREQUENCY: int = 1
+    KEYWORD_MAX_DOCUMENT_RATIO: float = 0.5  # Слова, встречающиеся в большей доле фрагментов, тегами не становятся
+    KEYWORD_RETAG_INTERVAL_SECONDS: float = 6 * 3600  # Период пересчета частот и тегов всего корпуса
+    KEYWORD_RETAG_BATCH_SIZE: int = 1000
+    SEARCH_HYDRATION: str = "database"  # database или source (результаты целиком из _source индекса, без запросов к БД)
+    SEARCH_PROFILE_ALLOWED: bool = True  # Разрешает ?profile=true (профиль запроса Elasticsearch в ответе)
+    SEARCH_MAX_FRAGMENTS_PER_VIDEO: int = 20
+    SEARCH_BATCH_MAX_QUERIES: int = 100
+    SEARCH_VECTOR_ENABLED: bool = False  # Векторы фрагментов и гибридный режим поиска
+    SEARCH_DEFAULT_MODE: str = "lexical"  # lexical или hybrid
+    SEARCH_HYBRID_WINDOW: int = 50  # Сколько видео из каждого ранжирования участвует в слиянии
+    SEARCH_KNN_K: int = 100
+    SEARCH_KNN_NUM_CANDIDATES: int = 200
+    SEARCH_KNN_MIN_SIMILARITY: float = 0.5  # Косинусная близость, ниже которой kNN-попадания не участвуют в слиянии
+    SEARCH_RRF_K: int = 60
+    EMBEDDING_BACKEND: str = "sentence-transformers"  # sentence-transformers или hashing
+    EMBEDDING_MODEL: str = "paraphrase-multilingual-MiniLM-L12-v2"
+    EMBEDDING_DIM: int = 384  # Размерность для hashing; у модели берется из нее самой
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_QUERY_CACHE_SIZE: int = 4096
+    EMBEDDING_QUERY_CACHE_TTL_SECONDS: int = 3600
+    SUGGEST_MIN_PREFIX_LENGTH: int = 2
+    SUGGEST_MAX_PHRASE_WORDS: int = 6
+    SUGGEST_MAX_SIZE: int = 20
+    SUGGEST_CACHE_SIZE: int = 2048
+    SUGGEST_CACHE_TTL_SECONDS: int = 300
+    SUGGEST_TIMEOUT_SECONDS: float = 0.5
     S3_ENDPOINT_URL: str = "http://minio:9000"
     S3_PUBLIC_URL: str = "http://localhost:9000"
     S3_ACCESS_KEY: str = "minioadmin"
     S3_SECRET_KEY: str = "minioadmin"
     S3_BUCKET_NAME: str = "videos"
+    S3_UPLOAD_CONCURRENCY: int = 8  # Параллельно загружаемых частей multipart
+    S3_UPLOAD_MAX_INFLIGHT_BYTES: int = 256 * 1024 * 1024  # Предел объема частей в полете
+    S3_MULTIPART_THRESHOLD: int = 5 * 1024 * 1024  # Файлы больше загружаются частями
+    S3_MULTIPART_PART_SIZE: int = 16 * 1024 * 1024  # Желаемый размер части; растет, если частей больше 10000
     FFMPEG_THREADS: int = 0
     FFMPEG_PRESET: str = "medium"
     FFMPEG_CRF: int = 23
+    FRAGMENT_OUTPUT_MODE: str = "mp4"  # mp4 — отдельный файл на фрагмент, hls — один fMP4-транскод видео и плейлисты фрагментов
+    FRAGMENT_RENDITIONS: List[str] = ["source"]  # Варианты файла фрагмента в режиме mp4: source, 1080p, 720p, 480p, 360p, audio
+    FRAGMENT_AUDIO_BITRATE: str = "128k"
+    HLS_SEGMENT_SECONDS: float = 2.0  # Длительность сегмента HLS, она же точность границ фрагмента
+    HLS_PLAYLIST_CACHE_SIZE: int = 1024
+    HLS_PLAYLIST_CACHE_TTL_SECONDS: int = 600
+    PUBLIC_API_URL: str = "http://localhost:8000"  # Адрес API для клиента, из него строятся ссылки на плейлисты фрагментов
+    PREVIEWS_ENABLED: bool = True  # Миниатюры фрагментов и спрайт перемотки при обработке видео
+    PREVIEW_THUMBNAIL_WIDTH: int = 320
+    PREVIEW_SPRITE_TILE_WIDTH: int = 160  # Кадр спрайта фиксированного размера, поля добиваются черным
+    PREVIEW_SPRITE_TILE_HEIGHT: int = 90
+    PREVIEW_SPRITE_COLUMNS: int = 10
+    PREVIEW_SPRITE_MAX_FRAMES: int = 100  # Для длинных видео интервал растет, спрайт остается одним листом
+    PREVIEW_SPRITE_MIN_INTERVAL: float = 2.0  # Секунд между кадрами спрайта у коротких видео
+    FRAGMENT_MEDIA_DELIVERY: str = "presigned"  # presigned — ссылки прямо в S3, cache — через эндпоинт с локальным кэшем
+    MEDIA_CACHE_DIR: str = "/tmp/media_cache"
+    MEDIA_CACHE_MAX_BYTES: int = 10 * 1024 * 1024 * 1024  # Объем локального кэша фрагментов, сверх него вытеснение по LRU
+    MEDIA_KEY_CACHE_SIZE: int = 10000  # Ключи S3 фрагментов для эндпоинта отдачи, без запроса к БД
+    MEDIA_KEY_CACHE_TTL_SECONDS: int = 300
     CELERY_BROKER_URL: str = "redis://localhost:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/0"
     TEMP_UPLOAD_DIR: str = "/tmp/videos"
     MAX_UPLOAD_SIZE: int = 15 * 1024 * 1024 * 1024  # 15 ГБ максимальный размер файла
     UPLOAD_CHUNK_SIZE: int = 5 * 1024 * 1024  # 5 МБ размер чанка для потоковой передачи
+    UPLOAD_IO_THREADS: int = 8  # Потоки для дисковых и БД-операций загрузок, отдельно от пула поиска
+    RESUMABLE_UPLOAD_CHUNK_SIZE: int = 16 * 1024 * 1024  # Рекомендуемый клиенту размер куска возобновляемой загрузки
+    RESUMABLE_UPLOAD_MAX_CHUNK_SIZE: int = 256 * 1024 * 1024
+    RESUMABLE_UPLOAD_CHUNK_TIMEOUT: int = 3600  # Кусок без движения дольше считается оборванным и не мешает complete
+    UPLOAD_SESSION_TTL_SECONDS: int = 24 * 3600  # Незавершенная сессия без новых кусков дольше отменяется, закрытая — удаляется
+    UPLOAD_SESSION_EXPIRE_INTERVAL_SECONDS: float = 3600  # Период поиска брошенных сессий загрузки
+    DIRECT_UPLOAD_URL_EXPIRATION: int = 6 * 3600  # Срок действия подписанных ссылок на части прямой загрузки
     MIN_FREE_SPACE_PERCENTAGE: float = 20.0  # Минимальный процент свободного места на диске
     TEMP_FILES_MAX_AGE_HOURS: int = 24  # Максимальное время хранения временных файлов в часах
     AUTO_CLEANUP_TEMP_FILES: bool = True  # Автоматическая очистка временных файлов
     CRITICAL_FREE_SPACE_MB: int = 1024  # Критический размер свободного места в MB (1 ГБ)
+    TEMP_RESERVATION_FACTOR: float = 1.5  # Резерв временного места от размера видео с запасом на обработку
+    TEMP_LEASE_SECONDS: int = 2 * 3600  # Аренда каталога задачи без продления; истекшие каталоги можно вытеснять
+    TEMP_QUEUED_LEASE_SECONDS: int = 48 * 3600  # Аренда принятого файла до начала обработки: ожидание в очереди и запас
     
     @property
     def DATABASE_URL(self) -> str:
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
 settings = Settings()
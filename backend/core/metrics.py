@@ -0,0 +1,80 @@
+"""
+Метрики процесса в памяти с выдачей в текстовом формате Prometheus (/metrics).
+
+Счетчики и гауги адресуются именем и метками:
+    metrics.inc("search_outbox_indexed_total", 10)
+    metrics.set_gauge("search_outbox_lag_seconds", 3.5)
+Значения живут в процессе, который их записал: у API и воркеров Celery они свои.
+"""
+import threading
+from collections import OrderedDict
+
+_lock = threading.Lock()
+_values = OrderedDict()  # (имя, метки) -> значение
+_types = {}
+_help = {}
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _register(name, metric_type, help_text):
+    _types.setdefault(name, metric_type)
+    if help_text:
+        _help.setdefault(name, help_text)
+
+def inc(name, value=1.0, help_text=None, **labels):
+    with _lock:
+        _register(name, "counter", help_text)
+        key = _key(name, labels)
+        _values[key] = _values.get(key, 0.0) + value
+
+def set_gauge(name, value, help_text=None, **labels):
+    with _lock:
+        _register(name, "gauge", help_text)
+        _values[_key(name, labels)] = float(value)
+
+def observe(name, value, help_text=None, **labels):
+    """Сумма и количество наблюдений (summary без квантилей)"""
+    with _lock:
+        _register(name, "summary", help_text)
+        for suffix, delta in (("_sum", value), ("_count", 1.0)):
+            key = _key(name + suffix, labels)
+            _values[key] = _values.get(key, 0.0) + delta
+
+def get(name, **labels):
+    with _lock:
+        return _values.get(_key(name, labels), 0.0)
+
+def snapshot():
+    """Значения для JSON (например, в /health)"""
+    with _lock:
+        result = {}
+        for (name, labels), value in _values.items():
+            label_str = ",".join(f"{k}={v}" for k, v in labels)
+            result[f"{name}{{{label_str}}}" if label_str else name] = value
+        return result
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus():
+    with _lock:
+        lines = []
+        described = set()
+        # Серии одной метрики должны идти подряд
+        for (name, labels), value in sorted(_values.items(), key=lambda item: item[0]):
+            base = name
+            for suffix in ("_sum", "_count"):
+                if name.endswith(suffix) and _types.get(name[:-len(suffix)]) == "summary":
+                    base = name[:-len(suffix)]
+            if base not in described:
+                described.add(base)
+                if base in _help:
+                    lines.append(f"# HELP {base} {_help[base]}")
+                lines.append(f"# TYPE {base} {_types.get(base, 'untyped')}")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,100 @@
+"""
+Замеры этапов обработки запроса для заголовка Server-Timing.
+
+Middleware создает сборщик на каждый запрос и кладет его в contextvar; код эндпоинтов и сервисов
+отмечает этапы через span()/record(). asyncio.to_thread и пул потоков FastAPI копируют контекст,
+поэтому этапы из потоков попадают в тот же сборщик. Вне запроса (Celery, скрипты) замеры игнорируются.
+LatencyBudget — бюджет задержки запроса, который делится между этапами поиска.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_current = ContextVar("request_timings", default=None)
+_TOKEN_RE = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+class RequestTimings:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.handler_done_at = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration_ms: float, description: Optional[str] = None):
+        with self._lock:
+            self.spans.append((name, duration_ms, description))
+
+    def header_value(self) -> str:
+        parts = []
+        for name, duration_ms, description in self.spans:
+            part = f"{_TOKEN_RE.sub('_', name)};dur={duration_ms:.1f}"
+            if description:
+                # desc — quoted-string: кавычки и обратные косые черты экранируются
+                escaped = description.replace("\\", "\\\\").replace('"', '\\"')
+                part += f';desc="{escaped}"'
+            parts.append(part)
+        return ", ".join(parts)
+
+    def as_dict(self):
+        return [{"name": name, "duration_ms": round(duration_ms, 3), "description": description}
+                for name, duration_ms, description in self.spans]
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+def finish_request(token):
+    _current.reset(token)
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+def record(name: str, duration_ms: float, description: Optional[str] = None):
+    timings = _current.get()
+    if timings is not None:
+        timings.record(name, duration_ms, description)
+
+@contextmanager
+def span(name: str, description: Optional[str] = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, description)
+
+def handler_done():
+    """Отмечает конец работы эндпоинта; остаток до отправки ответа считается сериализацией"""
+    timings = _current.get()
+    if timings is not None:
+        timings.handler_done_at = time.perf_counter()
+
+class LatencyBudget:
+    """
+    Бюджет задержки запроса: каждый следующий этап получает оставшееся время,
+    но не меньше min_step_ms, чтобы уже начатый запрос мог вернуть хоть что-то.
+    """
+
+    def __init__(self, budget_ms: float, min_step_ms: float = 0.0):
+        self.budget_ms = budget_ms
+        self.min_step_ms = min_step_ms
+        self.started_at = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def remaining_ms(self) -> float:
+        return max(self.min_step_ms, self.budget_ms - self.elapsed_ms())
+
+    def remaining_seconds(self) -> float:
+        return self.remaining_ms() / 1000
+
+    @property
+    def expired(self) -> bool:
+        return self.elapsed_ms() >= self.budget_ms
+
+    def es_timeout(self) -> str:
+        """Значение параметра timeout для тела запроса Elasticsearch"""
+        return f"{max(1, int(self.remaining_ms()))}ms"
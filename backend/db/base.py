@@ -1,8 +1,12 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from core.config import settings
 
 engine = create_engine(settings.DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+# Асинхронный движок для горячего пути поиска в API
+async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, echo=False, pool_size=settings.ASYNC_DB_POOL_SIZE)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 Base = declarative_base()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, ARRAY, Float
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, ARRAY, Float, JSON
 from sqlalchemy.orm import relationship
 from db.base import Base
 
@@ -14,4 +14,6 @@ class Fragment(Base):
     speech_confidence = Column(Float, nullable=True)
     no_speech_prob = Column(Float, nullable=True)
     language = Column(String, nullable=True)
+    thumbnail_url = Column(String, nullable=True)
+    renditions = Column(JSON, nullable=True)  # {имя варианта: ключ S3}, основной вариант также в s3_url
     video = relationship("Video", back_populates="fragments")
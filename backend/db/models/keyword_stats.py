@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String
+from db.base import Base
+
+class TermDocumentFrequency(Base):
+    """Число фрагментов корпуса, в которых встречается слово; обновляется при сохранении и удалении фрагментов"""
+    __tablename__ = "term_document_frequencies"
+    language = Column(String, primary_key=True)
+    term = Column(String, primary_key=True)
+    df = Column(Integer, nullable=False, default=0)
+
+class CorpusDocumentCount(Base):
+    """Число фрагментов корпуса по языкам — знаменатель IDF"""
+    __tablename__ = "corpus_document_counts"
+    language = Column(String, primary_key=True)
+    documents = Column(Integer, nullable=False, default=0)
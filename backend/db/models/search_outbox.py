@@ -0,0 +1,17 @@
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, func
+from db.base import Base
+
+class OutboxOperation:
+    upsert = "upsert"
+    delete = "delete"
+
+class SearchOutbox(Base):
+    """Изменения фрагментов, ожидающие переноса в поисковый индекс; пишутся в одной транзакции с фрагментами"""
+    __tablename__ = "search_outbox"
+    id = Column(BigInteger, primary_key=True, index=True)
+    fragment_id = Column(Integer, nullable=False, index=True)
+    operation = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    failed_at = Column(DateTime(timezone=True), nullable=True)  # Время последней неудачной попытки
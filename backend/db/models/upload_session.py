@@ -0,0 +1,41 @@
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, ForeignKey, func
+from db.base import Base
+
+class UploadSessionStatus:
+    open = "open"
+    completed = "completed"
+    aborted = "aborted"
+
+class UploadSessionMode:
+    chunked = "chunked"  # Куски через API во временный файл
+    direct = "direct"    # Части напрямую в S3 по подписанным ссылкам
+
+class UploadSession(Base):
+    """
+    Возобновляемая загрузка: файл собирается во временном файле из кусков, присланных в любом порядке,
+    либо (mode=direct) клиент загружает части multipart-загрузки s3_upload_id прямо в хранилище
+    """
+    __tablename__ = "upload_sessions"
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    filename = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    mode = Column(String, nullable=False, default=UploadSessionMode.chunked)
+    temp_path = Column(String, nullable=True)
+    s3_key = Column(String, nullable=True)
+    s3_upload_id = Column(String, nullable=True)
+    part_size = Column(BigInteger, nullable=True)
+    status = Column(String, nullable=False, default=UploadSessionStatus.open)
+    chunks_in_flight = Column(Integer, nullable=False, default=0, server_default="0")  # Куски, которые сейчас пишутся в файл
+    video_id = Column(Integer, nullable=True)
+    task_id = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+class UploadChunk(Base):
+    """Принятый кусок сессии: байты [offset, offset + length) уже записаны во временный файл"""
+    __tablename__ = "upload_chunks"
+    session_id = Column(String, ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    offset = Column(BigInteger, primary_key=True)
+    length = Column(BigInteger, nullable=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Enum
+from sqlalchemy import Column, Integer, String, Text, Enum, JSON
 from sqlalchemy.orm import relationship
 from db.base import Base
 from schemas.upload import UploadStatus
@@ -9,5 +9,6 @@ class Video(Base):
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     s3_url = Column(String, nullable=True)
+    sprite = Column(JSON, nullable=True)  # Ключ листа спрайта перемотки и его геометрия
     status = Column(Enum(UploadStatus), nullable=False, default=UploadStatus.uploading)
     fragments = relationship("Fragment", back_populates="video", cascade="all, delete-orphan")
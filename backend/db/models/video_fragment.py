@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Optional
 
 @dataclass
 class VideoFragment:
@@ -12,3 +12,5 @@ class VideoFragment:
     s3_url: str
     speech_confidence: float
     no_speech_prob: float
+    thumbnail_url: Optional[str] = None
+    renditions: Optional[Dict[str, str]] = None
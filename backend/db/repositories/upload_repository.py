@@ -0,0 +1,64 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from db.models.upload_session import UploadSession, UploadChunk, UploadSessionStatus, UploadSessionMode
+
+def merge_ranges(chunks):
+    """Сливает куски [(offset, length)] в непересекающиеся диапазоны [(start, end)), end не включается"""
+    ranges = []
+    for offset, length in sorted(chunks):
+        end = offset + length
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return [(start, end) for start, end in ranges]
+
+class UploadSessionRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_session(self, session_id: str, name: str, description: str, filename: str, size: int,
+                       temp_path: str = None, mode: str = UploadSessionMode.chunked, s3_key: str = None,
+                       s3_upload_id: str = None, part_size: int = None):
+        session = UploadSession(id=session_id, name=name, description=description, filename=filename,
+                                size=size, temp_path=temp_path, mode=mode, s3_key=s3_key,
+                                s3_upload_id=s3_upload_id, part_size=part_size, status=UploadSessionStatus.open)
+        self.db.add(session)
+        self.db.flush()
+        return session
+
+    def get_session(self, session_id: str, for_update: bool = False):
+        query = select(UploadSession).where(UploadSession.id == session_id)
+        if for_update:
+            query = query.with_for_update()
+        return self.db.execute(query).scalars().first()
+
+    def add_chunk(self, session_id: str, offset: int, length: int):
+        # Повторно присланный кусок с тем же смещением заменяет прежний, если он длиннее
+        stmt = insert(UploadChunk).values(session_id=session_id, offset=offset, length=length)
+        self.db.execute(stmt.on_conflict_do_update(
+            index_elements=["session_id", "offset"],
+            set_={"length": func.greatest(UploadChunk.length, stmt.excluded.length)}
+        ))
+
+    def received_ranges(self, session_id: str):
+        chunks = self.db.execute(
+            select(UploadChunk.offset, UploadChunk.length).where(UploadChunk.session_id == session_id)
+        ).all()
+        return merge_ranges((chunk.offset, chunk.length) for chunk in chunks)
+
+    def get_expired_session_ids(self, before):
+        """Незавершенные сессии без изменений с момента before"""
+        return self.db.execute(
+            select(UploadSession.id).where(UploadSession.status == UploadSessionStatus.open,
+                                           UploadSession.updated_at < before)
+        ).scalars().all()
+
+    def delete_closed_sessions(self, before) -> int:
+        """Удаляет завершенные и отмененные сессии старше before; куски удаляются каскадом"""
+        result = self.db.execute(
+            delete(UploadSession).where(UploadSession.status.in_([UploadSessionStatus.completed, UploadSessionStatus.aborted]),
+                                        UploadSession.updated_at < before)
+        )
+        return result.rowcount
@@ -3,11 +3,17 @@ from sqlalchemy import select, func, delete
 from db.models.video import Video
 from db.models.fragment import Fragment
 from db.models.video_fragment import VideoFragment as VideoFragmentData
-from utils.elasticsearch_utils import add_new_fragment
+from db.models.search_outbox import OutboxOperation
+from services.indexing_service import enqueue_outbox
+from services.keyword_service import update_document_frequencies, tag_fragments
+from core.config import settings
 import logging
 
 logger = logging.getLogger("ReeLearnLogger")
 
+# Поля видео, копируемые в документы фрагментов поискового индекса
+INDEXED_VIDEO_FIELDS = {"name", "description", "s3_url"}
+
 class VideoRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -35,6 +41,10 @@ class VideoRepository:
             for key, value in kwargs.items():
                 setattr(video, key, value)
             self.db.flush()
+            if INDEXED_VIDEO_FIELDS.intersection(kwargs):
+                # Документы фрагментов хранят копию полей видео и переиндексируются вместе с ним
+                fragment_ids = self.db.execute(select(Fragment.id).where(Fragment.video_id == video_id)).scalars().all()
+                enqueue_outbox(self.db, fragment_ids, OutboxOperation.upsert)
         return video
     
     def save_fragments(self, video_id: int, fragments: list):
@@ -53,17 +63,20 @@ class VideoRepository:
                 tags=frag.tags,
                 speech_confidence=frag.speech_confidence,
                 no_speech_prob=frag.no_speech_prob,
-                language=frag.language
+                language=frag.language,
+                thumbnail_url=getattr(frag, "thumbnail_url", None),
+                renditions=getattr(frag, "renditions", None)
             )
             self.db.add(db_frag)
             saved.append(db_frag)
             logger.info(f"Фрагмент {db_frag.id}({db_frag.timecode_start} - {db_frag.timecode_end}) сохранен")
+        if settings.KEYWORD_TAGGING_ENABLED:
+            # Частоты корпуса обновляются до подсчета тегов, чтобы новые слова уже имели df
+            update_document_frequencies(self.db, saved)
+            tag_fragments(self.db, saved)
         self.db.flush()
-        for frag in saved:
-            try:
-                add_new_fragment(frag)
-            except Exception as e:
-                logger.error(f"Error indexing fragment {frag.id}: {e}")
+        # Индексатор заберет фрагменты из outbox после commit вызывающей стороны
+        enqueue_outbox(self.db, [frag.id for frag in saved], OutboxOperation.upsert)
         return saved
     
     def get_all_videos_with_fragments_count(self):
@@ -81,6 +94,12 @@ class VideoRepository:
         return self.db.query(Fragment).filter(Fragment.id == fragment_id).first()
     
     def delete_video(self, video_id: int):
+        fragments = self.db.execute(
+            select(Fragment.id, Fragment.text, Fragment.language).where(Fragment.video_id == video_id)
+        ).all()
+        enqueue_outbox(self.db, [frag.id for frag in fragments], OutboxOperation.delete)
+        if settings.KEYWORD_TAGGING_ENABLED:
+            update_document_frequencies(self.db, fragments, sign=-1)
         self.db.execute(delete(Fragment).where(Fragment.video_id == video_id))
         self.db.execute(delete(Video).where(Video.id == video_id))
         self.db.flush()
@@ -0,0 +1,22 @@
+"""
+Колонки, добавленные к уже существующим таблицам. create_all создает только отсутствующие таблицы,
+поэтому в развернутой базе новые колонки добавляются при старте API; ADD COLUMN IF NOT EXISTS
+делает это идемпотентным.
+"""
+from sqlalchemy import text
+from core.logger import logger
+
+# (таблица, колонка, тип)
+ADDED_COLUMNS = [
+    ("fragments", "thumbnail_url", "VARCHAR"),
+    ("videos", "sprite", "JSON"),
+    ("fragments", "renditions", "JSON"),
+    ("upload_sessions", "chunks_in_flight", "INTEGER NOT NULL DEFAULT 0"),
+    ("search_outbox", "failed_at", "TIMESTAMP WITH TIME ZONE"),
+]
+
+def apply_schema_updates(engine):
+    with engine.begin() as conn:
+        for table, column, column_type in ADDED_COLUMNS:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}"))
+    logger.info(f"Schema updates applied: {len(ADDED_COLUMNS)} columns checked")
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import platform
 import time
@@ -6,18 +7,26 @@ import shutil
 import threading
 from datetime import datetime, timezone
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from core.config import settings
+from core import timing, metrics
 from api.router import router as api_router
-from utils.elasticsearch_utils import create_reelearn_index, replace_all_fragments
+from utils.elasticsearch_utils import close_async_elasticsearch
+from services.indexing_service import rebuild_search_index, outbox_lag, drain_search_outbox_until_empty
 from utils.s3_utils import ensure_bucket_exists, get_s3_client
-from db.base import engine, Base, SessionLocal
+from db.base import engine, async_engine, Base, SessionLocal
+from db.schema_updates import apply_schema_updates
 from db.models.fragment import Fragment
+from db.models.search_outbox import SearchOutbox
+from db.models.keyword_stats import TermDocumentFrequency, CorpusDocumentCount
+from db.models.upload_session import UploadSession, UploadChunk
 from sqlalchemy.sql import text
+from sqlalchemy.orm import joinedload
 from core.logger import logger
-from api.endpoints.upload import VideoUploader
+from utils.temp_storage import temp_storage
+from utils.media_cache import get_media_cache
 
 start_time = datetime.now(timezone.utc)
 app = FastAPI(
@@ -38,9 +47,20 @@ app.add_middleware(
 class TimeoutMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
         start = time.time()
-        response = await call_next(request)
+        timings, token = timing.start_request()
+        try:
+            response = await call_next(request)
+        finally:
+            timing.finish_request(token)
         process_time = time.time() - start
         response.headers["X-Process-Time"] = str(process_time)
+        if settings.SERVER_TIMING_ENABLED:
+            if timings.handler_done_at is not None:
+                timings.record("serialize", (time.perf_counter() - timings.handler_done_at) * 1000)
+            timings.record("total", process_time * 1000)
+            response.headers["Server-Timing"] = timings.header_value()
+            # Без этого заголовка браузер не покажет замеры для запросов с другого origin
+            response.headers["Timing-Allow-Origin"] = "*"
         return response
 
 app.add_middleware(TimeoutMiddleware)
@@ -49,6 +69,7 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 # Глобальная переменная для контроля фоновой очистки
 cleanup_thread = None
 stop_cleanup_thread = False
+outbox_thread = None
 
 def periodic_cleanup():
     """Периодическая очистка временных файлов"""
@@ -56,37 +77,8 @@ def periodic_cleanup():
     
     while not stop_cleanup_thread:
         try:
-            # Проверяем свободное место
-            if os.path.exists(settings.TEMP_UPLOAD_DIR):
-                disk_usage = shutil.disk_usage(settings.TEMP_UPLOAD_DIR)
-                free_mb = disk_usage.free / (1024 * 1024)
-                free_percent = disk_usage.free * 100 / disk_usage.total
-                
-                if free_mb < settings.CRITICAL_FREE_SPACE_MB or free_percent < settings.MIN_FREE_SPACE_PERCENTAGE:
-                    logger.warning(f"Критически мало свободного места: {free_mb:.1f} МБ ({free_percent:.1f}%). "
-                                 f"Запускаем экстренную очистку...")
-                    
-                    # Запускаем агрессивную очистку старых файлов
-                    uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
-                    
-                    # Сначала пробуем удалить файлы старше 1 часа
-                    freed = uploader.clean_old_temp_files(max_age_hours=1)
-                    if freed == 0 or free_mb < settings.CRITICAL_FREE_SPACE_MB:
-                        # Если не помогло, удаляем все временные файлы
-                        logger.warning("Экстренная очистка! Удаление всех временных файлов из-за нехватки места")
-                        for file_path in os.listdir(settings.TEMP_UPLOAD_DIR):
-                            try:
-                                full_path = os.path.join(settings.TEMP_UPLOAD_DIR, file_path)
-                                if os.path.isfile(full_path):
-                                    size = os.path.getsize(full_path)
-                                    os.remove(full_path)
-                                    logger.info(f"Экстренно удален файл: {file_path}, размер: {size/1024/1024:.1f} МБ")
-                            except Exception as e:
-                                logger.error(f"Ошибка при экстренном удалении файла {file_path}: {str(e)}")
-                else:
-                    # Обычная регулярная очистка старых файлов
-                    uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
-                    uploader.clean_old_temp_files(max_age_hours=settings.TEMP_FILES_MAX_AGE_HOURS)
+            # Неиспользуемые файлы старше срока хранения; при критической нехватке места — все неиспользуемые
+            temp_storage.cleanup()
         except Exception as e:
             logger.error(f"Ошибка в фоновом процессе очистки: {str(e)}", exc_info=True)
         
@@ -96,6 +88,28 @@ def periodic_cleanup():
                 break
             time.sleep(1)
 
+def periodic_outbox_drain():
+    """Разбор outbox поискового индекса в процессе API, если отдельный индексатор не запущен"""
+    while not stop_cleanup_thread:
+        try:
+            drain_search_outbox_until_empty()
+        except Exception as e:
+            logger.error(f"Ошибка при разборе outbox поискового индекса: {str(e)}", exc_info=True)
+        time.sleep(settings.SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    try:
+        with SessionLocal() as db:
+            outbox_lag(db)
+    except Exception as e:
+        logger.error(f"Error collecting search outbox metrics: {str(e)}")
+    try:
+        temp_storage.usage()
+    except Exception as e:
+        logger.error(f"Error collecting temp storage metrics: {str(e)}")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def healthcheck():
     # Проверка свободного места на диске
@@ -136,6 +150,7 @@ async def healthcheck():
             }
         }, 
         "database": {"status": "disconnected"}, 
+        "search_outbox": {}, 
         "s3_storage": {"status": "disconnected"}, 
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "disk_space_warning": free_percent < settings.MIN_FREE_SPACE_PERCENTAGE
@@ -147,6 +162,7 @@ async def healthcheck():
         db_version = db.execute(text("SELECT version()")).scalar()
         status["database"]["status"] = "connected"
         status["database"]["version"] = db_version
+        status["search_outbox"] = outbox_lag(db)
         db.close()
     except Exception as e:
         status["database"]["error"] = str(e)
@@ -160,22 +176,22 @@ async def healthcheck():
     except Exception as e:
         status["s3_storage"]["error"] = str(e)
     
-    # Подсчет количества временных файлов
-    temp_files_count = 0
-    temp_files_size = 0
-    
-    if os.path.exists(settings.TEMP_UPLOAD_DIR):
-        for file_path in os.listdir(settings.TEMP_UPLOAD_DIR):
-            full_path = os.path.join(settings.TEMP_UPLOAD_DIR, file_path)
-            if os.path.isfile(full_path):
-                temp_files_count += 1
-                temp_files_size += os.path.getsize(full_path)
+    # Занятость временного хранилища
+    try:
+        usage = await asyncio.to_thread(temp_storage.usage)
+        status["temp_files"] = {
+            "count": usage["files"],
+            "total_size_mb": usage["used_bytes"] / (1024*1024),
+            "leased_jobs": usage["leased_jobs"],
+            "reserved_mb": usage["reserved_bytes"] / (1024*1024),
+            "available_mb": usage["available_bytes"] / (1024*1024),
+            "directory": settings.TEMP_UPLOAD_DIR
+        }
+    except Exception as e:
+        status["temp_files"] = {"error": str(e), "directory": settings.TEMP_UPLOAD_DIR}
     
-    status["temp_files"] = {
-        "count": temp_files_count,
-        "total_size_mb": temp_files_size / (1024*1024),
-        "directory": settings.TEMP_UPLOAD_DIR
-    }
+    if settings.FRAGMENT_MEDIA_DELIVERY == "cache":
+        status["media_cache"] = get_media_cache().stats()
     
     if status["database"]["status"] == "connected" and status["s3_storage"]["status"] == "connected":
         if free_percent < settings.MIN_FREE_SPACE_PERCENTAGE:
@@ -193,7 +209,7 @@ async def catch_all(path_name: str, request: Request):
 
 @app.on_event("startup")
 def startup_event():
-    global cleanup_thread, stop_cleanup_thread
+    global cleanup_thread, stop_cleanup_thread, outbox_thread
     
     # Проверяем и создаем директорию для временных файлов, если она не существует
     if not os.path.exists(settings.TEMP_UPLOAD_DIR):
@@ -209,8 +225,7 @@ def startup_event():
         
         if free_mb < settings.CRITICAL_FREE_SPACE_MB or free_percent < settings.MIN_FREE_SPACE_PERCENTAGE:
             logger.warning(f"Критически мало свободного места при запуске! Запускаем очистку...")
-            uploader = VideoUploader(settings.TEMP_UPLOAD_DIR)
-            freed = uploader.clean_old_temp_files(max_age_hours=1)  # Агрессивная очистка при запуске
+            freed = temp_storage.cleanup(max_age_hours=1)  # Агрессивная очистка при запуске
             logger.info(f"Начальная очистка освободила {freed / (1024*1024):.1f} МБ")
     except Exception as e:
         logger.error(f"Ошибка при проверке места на диске при запуске: {str(e)}")
@@ -219,15 +234,14 @@ def startup_event():
     db.execute(text("SELECT 1"))
     Base.metadata.create_all(engine)
     db.close()
+    apply_schema_updates(engine)
     
     ensure_bucket_exists()
-    create_reelearn_index()
     
-    db = SessionLocal()
-    fragments = db.query(Fragment).all()
-    if fragments:
-        replace_all_fragments(fragments)
-    db.close()
+    def load_fragments():
+        with SessionLocal() as db:
+            return db.query(Fragment).options(joinedload(Fragment.video)).all()
+    rebuild_search_index(load_fragments)
     
     # Запуск фонового потока для периодической очистки
     if settings.AUTO_CLEANUP_TEMP_FILES:
@@ -235,15 +249,26 @@ def startup_event():
         cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
         cleanup_thread.start()
         logger.info("Запущен фоновый процесс очистки временных файлов")
+    
+    if settings.SEARCH_OUTBOX_DRAIN_IN_API:
+        stop_cleanup_thread = False
+        outbox_thread = threading.Thread(target=periodic_outbox_drain, daemon=True)
+        outbox_thread.start()
+        logger.info("Запущен разбор outbox поискового индекса в процессе API")
 
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     global cleanup_thread, stop_cleanup_thread
     
-    # Останавливаем фоновый поток очистки
+    # Останавливаем фоновые потоки; join ждется в пуле потоков, чтобы не блокировать цикл событий
     if cleanup_thread:
         stop_cleanup_thread = True
-        cleanup_thread.join(timeout=5.0)
+        await asyncio.to_thread(cleanup_thread.join, 5.0)
         logger.info("Остановлен фоновый процесс очистки временных файлов")
+    if outbox_thread:
+        stop_cleanup_thread = True
+        await asyncio.to_thread(outbox_thread.join, settings.SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS + 5.0)
     
+    await close_async_elasticsearch()
+    await async_engine.dispose()
     logger.info("Shutting down")
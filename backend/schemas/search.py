@@ -1,6 +1,7 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 from enum import Enum
+from core.config import settings
 
 class SearchStatus(str, Enum):
     pending = "pending"
@@ -14,6 +15,8 @@ class SearchFragment(BaseModel):
     timecode_start: float
     timecode_end: float
     s3_url: str
+    thumbnail_url: Optional[str] = None  # Подписанная ссылка на кадр из середины фрагмента
+    renditions: Dict[str, str] = {}  # Ссылки на варианты файла: имя варианта (1080p, 480p, audio) -> URL
     score: float
 
 class VideoInfo(BaseModel):
@@ -30,4 +33,27 @@ class SearchResult(BaseModel):
 class SearchResultResponse(BaseModel):
     status: SearchStatus
     results: List[SearchResult]
+    total_videos: Optional[int] = None
+    next_cursor: Optional[str] = None
     error: Optional[str] = None
+    partial: bool = False  # Часть этапов не уложилась в бюджет задержки
+    profile: Optional[Dict[str, Any]] = None  # Только при ?profile=true
+
+class SuggestResponse(BaseModel):
+    prefix: str
+    language: str
+    suggestions: List[str]
+
+class SearchQuery(BaseModel):
+    query: str
+    exact: bool = False
+    tags: Optional[List[str]] = None
+    max_fragments_per_video: int = Field(3, ge=1, le=settings.SEARCH_MAX_FRAGMENTS_PER_VIDEO)
+    max_videos: int = Field(5, ge=1, le=settings.SEARCH_MAX_VIDEOS_PER_PAGE)
+    cursor: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery] = Field(..., min_length=1, max_length=settings.SEARCH_BATCH_MAX_QUERIES)
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResultResponse]
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from enum import Enum
 
 class UploadStatus(str, Enum):
@@ -11,3 +12,41 @@ class UploadResponse(BaseModel):
     video_id: str
     task_id: str
     status: UploadStatus
+
+class ResumableUploadCreate(BaseModel):
+    name: str
+    filename: str
+    size: int = Field(..., gt=0)
+    description: Optional[str] = None
+
+class ByteRange(BaseModel):
+    start: int
+    end: int  # Не включается
+
+class PresignedPart(BaseModel):
+    part_number: int
+    url: str
+
+class DirectUploadSession(BaseModel):
+    upload_id: str
+    key: str
+    part_size: int  # Все части, кроме последней, ровно этого размера
+    expires_in: int
+    parts: List[PresignedPart]
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class DirectUploadComplete(BaseModel):
+    parts: Optional[List[UploadedPart]] = None  # ETag частей для сверки с хранилищем
+
+class ResumableUploadStatus(BaseModel):
+    upload_id: str
+    status: str
+    size: int
+    chunk_size: int  # Рекомендуемый размер куска
+    received_bytes: int
+    received: List[ByteRange]
+    video_id: Optional[str] = None
+    task_id: Optional[str] = None
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class FragmentInfo(BaseModel):
     id: int
@@ -7,13 +7,25 @@ class FragmentInfo(BaseModel):
     timecode_end: float
     text: str
     s3_url: str
+    thumbnail_url: Optional[str] = None
+    renditions: Dict[str, str] = {}
     tags: List[str]
 
+class SpriteInfo(BaseModel):
+    """Лист спрайта перемотки: кадр времени t — номер int(t / interval) в сетке columns x rows слева направо"""
+    url: str
+    interval: float
+    columns: int
+    rows: int
+    tile_width: int
+    tile_height: int
+
 class VideoFragmentsResponse(BaseModel):
     video_id: int
     title: str
     description: Optional[str]
     video_url: Optional[str] = None
+    sprite: Optional[SpriteInfo] = None
     fragments: List[FragmentInfo]
 
 class VideoInfo(BaseModel):
@@ -0,0 +1,108 @@
+import hashlib
+import math
+import re
+import threading
+from typing import List, Optional
+from core.config import settings
+from core.logger import logger
+from utils.cache import TTLCache
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+class Embedder:
+    """Векторизатор текста на CPU; векторы нормированы для косинусной близости"""
+    dim: int
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+class HashingEmbedder(Embedder):
+    """
+    Детерминированный векторизатор без модели: хеширование слов и символьных триграмм.
+    Не понимает перефразировок, но стабилен между процессами, что удобно для тестов.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.EMBEDDING_DIM
+
+    def _features(self, text: str):
+        for token in TOKEN_RE.findall(text.lower()):
+            yield token, 1.0
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dim
+            for feature, weight in self._features(text or ""):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vector[bucket] += sign * weight
+            norm = math.sqrt(sum(v * v for v in vector))
+            if norm == 0:
+                # Нулевой вектор недопустим для cosine в dense_vector
+                vector[0] = 1.0
+                norm = 1.0
+            vectors.append([v / norm for v in vector])
+        return vectors
+
+class SentenceTransformerEmbedder(Embedder):
+    """Многоязычная модель sentence-transformers на CPU"""
+
+    def __init__(self, model_name: str = None):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name or settings.EMBEDDING_MODEL
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(texts, batch_size=settings.EMBEDDING_BATCH_SIZE,
+                                    normalize_embeddings=True, show_progress_bar=False)
+        return [vector.tolist() for vector in vectors]
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "sentence-transformers": SentenceTransformerEmbedder,
+}
+
+_embedder = None
+_embedder_lock = threading.Lock()
+query_embedding_cache = TTLCache(settings.EMBEDDING_QUERY_CACHE_SIZE, settings.EMBEDDING_QUERY_CACHE_TTL_SECONDS)
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                try:
+                    embedder_cls = EMBEDDERS[settings.EMBEDDING_BACKEND]
+                except KeyError:
+                    raise ValueError(f"Unknown embedding backend '{settings.EMBEDDING_BACKEND}', expected one of {sorted(EMBEDDERS)}")
+                _embedder = embedder_cls()
+                logger.info(f"Embedder {settings.EMBEDDING_BACKEND} initialized, dim={_embedder.dim}")
+    return _embedder
+
+def embed_in_batches(texts: List[str], batch_size: int = None) -> List[List[float]]:
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    embedder = get_embedder()
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embedder.embed(texts[start:start + batch_size]))
+    return vectors
+
+def fragment_embeddings(fragments) -> List[Optional[List[float]]]:
+    """Векторы фрагментов пачками; при выключенном векторном поиске — None для каждого"""
+    if not settings.SEARCH_VECTOR_ENABLED:
+        return [None] * len(fragments)
+    return embed_in_batches([frag.text or "" for frag in fragments])
+
+def embed_query(query: str) -> List[float]:
+    key = " ".join(query.lower().split())
+    vector = query_embedding_cache.get(key)
+    if vector is None:
+        vector = get_embedder().embed([key])[0]
+        query_embedding_cache.set(key, vector)
+    return vector
@@ -0,0 +1,172 @@
+"""
+Индексация фрагментов в выбранный поисковый бэкенд (SEARCH_BACKEND): Elasticsearch или встроенный движок.
+
+Изменения фрагментов попадают в индекс через outbox: репозиторий пишет строки search_outbox в той же
+транзакции, что и сами фрагменты, а индексатор (tasks/indexing_task.py) переносит их пачками.
+"""
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
+from core.config import settings
+from core.logger import logger
+from core import metrics
+from db.base import SessionLocal
+from db.models.fragment import Fragment
+from db.models.search_outbox import SearchOutbox, OutboxOperation
+from services.embedding_service import fragment_embeddings
+from utils.elasticsearch_utils import (
+    index_fragments_bulk, convert_fragment, delete_fragment_by_id, create_reelearn_index, replace_all_fragments
+)
+
+SEARCH_BACKENDS = ("elasticsearch", "local")
+
+def get_search_backend():
+    if settings.SEARCH_BACKEND not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown search backend '{settings.SEARCH_BACKEND}', expected one of {list(SEARCH_BACKENDS)}")
+    return settings.SEARCH_BACKEND
+
+def is_local_backend():
+    return get_search_backend() == "local"
+
+def local_engine():
+    from services.local_search_engine import get_local_engine
+    return get_local_engine()
+
+def index_fragments(fragments):
+    """Индексирует (или переиндексирует) фрагменты; возвращает id фрагментов, которые не удалось проиндексировать"""
+    if not fragments:
+        return set()
+    if is_local_backend():
+        local_engine().index_documents([convert_fragment(frag)["_source"] for frag in fragments])
+        return set()
+    # Векторы считаются пачками для всех фрагментов сразу, документы уходят одним bulk
+    try:
+        embeddings = fragment_embeddings(fragments)
+    except Exception as e:
+        logger.error(f"Error embedding fragments: {e}")
+        embeddings = [None] * len(fragments)
+    report = index_fragments_bulk(fragments, embeddings)
+    return {int(item["_id"]) for item in report.failed if item.get("_id") is not None}
+
+def delete_fragments(fragment_ids):
+    if not fragment_ids:
+        return
+    if is_local_backend():
+        local_engine().delete_documents(fragment_ids)
+        return
+    for fragment_id in fragment_ids:
+        delete_fragment_by_id(fragment_id)
+
+def rebuild_search_index(load_fragments):
+    """
+    Подготовка индекса при старте приложения.
+    load_fragments — функция, возвращающая все фрагменты из БД; встроенный движок вызывает ее,
+    только если индекс на диске пуст, Elasticsearch пересобирается всегда.
+    """
+    if is_local_backend():
+        engine = local_engine()
+        if engine.is_empty():
+            fragments = load_fragments()
+            engine.rebuild([convert_fragment(frag)["_source"] for frag in fragments])
+            logger.info(f"Local search index rebuilt from database: {len(fragments)} fragments")
+        return
+    create_reelearn_index()
+    fragments = load_fragments()
+    if fragments:
+        replace_all_fragments(fragments)
+
+def enqueue_outbox(db, fragment_ids, operation):
+    """Добавляет изменения в outbox текущей транзакции; в индекс они попадут после commit"""
+    for fragment_id in fragment_ids:
+        db.add(SearchOutbox(fragment_id=fragment_id, operation=operation, attempts=0))
+
+def drain_search_outbox(batch_size=None):
+    """
+    Переносит одну пачку outbox в поисковый индекс. Строки блокируются FOR UPDATE SKIP LOCKED,
+    поэтому несколько индексаторов делят очередь без двойной обработки.
+    Возвращает число обработанных строк.
+    """
+    batch_size = batch_size or settings.SEARCH_OUTBOX_BATCH_SIZE
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(SearchOutbox)
+            .where(SearchOutbox.attempts < settings.SEARCH_OUTBOX_MAX_ATTEMPTS)
+            .order_by(SearchOutbox.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not rows:
+            return 0
+
+        # По каждому фрагменту важна только последняя операция
+        latest = {}
+        for row in rows:
+            latest[row.fragment_id] = row.operation
+        upsert_ids = [fid for fid, operation in latest.items() if operation == OutboxOperation.upsert]
+        fragments = db.execute(
+            select(Fragment).options(joinedload(Fragment.video)).where(Fragment.id.in_(upsert_ids))
+        ).scalars().all() if upsert_ids else []
+        found = {frag.id for frag in fragments}
+        # Фрагмент мог быть удален раньше, чем индексатор дошел до его вставки
+        delete_ids = [fid for fid, operation in latest.items() if operation == OutboxOperation.delete or fid not in found]
+
+        errors = {}
+        try:
+            for fragment_id in index_fragments(fragments):
+                errors[fragment_id] = "bulk indexing failed"
+        except Exception as e:
+            logger.error(f"Search outbox: indexing failed: {e}")
+            errors.update({fragment_id: str(e) for fragment_id in found})
+        try:
+            delete_fragments(delete_ids)
+        except Exception as e:
+            logger.error(f"Search outbox: deleting failed: {e}")
+            errors.update({fragment_id: str(e) for fragment_id in delete_ids})
+
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            if row.fragment_id in errors:
+                row.attempts += 1
+                row.last_error = errors[row.fragment_id]
+                row.failed_at = func.now()
+            else:
+                metrics.observe("search_outbox_lag_seconds", (now - row.created_at).total_seconds(),
+                                "Time from a fragment change to its arrival in the search index")
+                db.delete(row)
+        db.commit()
+
+    metrics.inc("search_outbox_processed_total", len(rows) - sum(row.fragment_id in errors for row in rows),
+                "Outbox rows applied to the search index")
+    metrics.inc("search_outbox_failed_total", sum(row.fragment_id in errors for row in rows),
+                "Outbox rows that failed and will be retried")
+    logger.info(f"Search outbox: drained {len(rows)} rows ({len(latest)} fragments, {len(errors)} failed) "
+                f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return len(rows)
+
+def drain_search_outbox_until_empty(max_seconds=None):
+    """Разбирает outbox пачками, пока он не опустеет или не истечет время"""
+    deadline = time.monotonic() + (max_seconds or settings.SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS * 10)
+    total = 0
+    while time.monotonic() < deadline:
+        drained = drain_search_outbox()
+        total += drained
+        if drained < settings.SEARCH_OUTBOX_BATCH_SIZE:
+            break
+    return total
+
+def outbox_lag(db):
+    """Глубина outbox и возраст самой старой строки; обновляет гауги метрик"""
+    pending, oldest = db.execute(
+        select(func.count(SearchOutbox.id), func.min(SearchOutbox.created_at))
+        .where(SearchOutbox.attempts < settings.SEARCH_OUTBOX_MAX_ATTEMPTS)
+    ).one()
+    dead = db.execute(
+        select(func.count(SearchOutbox.id)).where(SearchOutbox.attempts >= settings.SEARCH_OUTBOX_MAX_ATTEMPTS)
+    ).scalar()
+    oldest_age = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+    metrics.set_gauge("search_outbox_pending", pending, "Outbox rows waiting to be indexed")
+    metrics.set_gauge("search_outbox_oldest_age_seconds", oldest_age, "Age of the oldest pending outbox row")
+    metrics.set_gauge("search_outbox_dead", dead, "Outbox rows that exhausted SEARCH_OUTBOX_MAX_ATTEMPTS")
+    return {"pending": pending, "oldest_age_seconds": oldest_age, "dead": dead}
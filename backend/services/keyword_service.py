@@ -0,0 +1,200 @@
+"""
+Ключевые слова фрагментов для поля tags.
+
+Частоты слов по корпусу (в скольких фрагментах встречается слово) хранятся в term_document_frequencies
+и обновляются инкрементально в той же транзакции, что и сами фрагменты. Теги фрагмента — top-k слов
+по TF-IDF: матрица TF пачки фрагментов строится разреженной (scipy.sparse) и умножается на вектор IDF.
+IDF старых фрагментов меняется по мере роста корпуса, поэтому tasks/tagging_task.py периодически
+пересчитывает частоты и перетегирует весь корпус; измененные фрагменты уходят в индекс через outbox.
+"""
+import math
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select, delete, text
+from sqlalchemy.dialects.postgresql import insert
+from core.config import settings
+from core.logger import logger
+from core import metrics
+from db.base import SessionLocal
+from db.models.fragment import Fragment
+from db.models.keyword_stats import TermDocumentFrequency, CorpusDocumentCount
+from db.models.search_outbox import OutboxOperation
+from services.indexing_service import enqueue_outbox
+from utils.text_analysis import tokenize, STEMMER_LANGUAGES
+
+# Строк в одном INSERT ... ON CONFLICT и слов в одном IN (...)
+SQL_BATCH_SIZE = 1000
+
+def keyword_language(language):
+    return language if language in STEMMER_LANGUAGES else settings.VIDEO_DEFAULT_LANGUAGE
+
+@lru_cache(maxsize=None)
+def get_stopwords(language):
+    from nltk.corpus import stopwords
+    try:
+        return frozenset(stopwords.words(STEMMER_LANGUAGES[language]))
+    except LookupError:
+        logger.warning(f"NLTK stopwords for '{language}' are not installed, keywords will include stopwords")
+        return frozenset()
+
+def keyword_terms(text, language):
+    """Слова-кандидаты в теги: без стоп-слов, чисел и слов короче KEYWORD_MIN_TERM_LENGTH"""
+    stopwords = get_stopwords(language)
+    return [token for token in tokenize(text)
+            if len(token) >= settings.KEYWORD_MIN_TERM_LENGTH and not token.isdigit() and token not in stopwords]
+
+def _batches(items, size=SQL_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def update_document_frequencies(db, fragments, sign=1):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) фрагменты из частот корпуса.
+    fragments — объекты с полями text и language. Строки обновляются в порядке (язык, слово),
+    чтобы параллельные транзакции брали блокировки в одном порядке и не упирались в deadlock.
+    """
+    documents = Counter()
+    frequencies = Counter()
+    for frag in fragments:
+        language = keyword_language(frag.language)
+        documents[language] += 1
+        frequencies.update((language, term) for term in set(keyword_terms(frag.text, language)))
+    if not documents:
+        return
+
+    counts = [{"language": language, "documents": sign * count} for language, count in sorted(documents.items())]
+    stmt = insert(CorpusDocumentCount).values(counts)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["language"], set_={"documents": CorpusDocumentCount.documents + stmt.excluded.documents}))
+
+    rows = [{"language": language, "term": term, "df": sign * count}
+            for (language, term), count in sorted(frequencies.items())]
+    for batch in _batches(rows):
+        stmt = insert(TermDocumentFrequency).values(batch)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["language", "term"], set_={"df": TermDocumentFrequency.df + stmt.excluded.df}))
+
+def recompute_document_frequencies(db):
+    """
+    Пересчитывает частоты по всему корпусу, исправляя накопленное расхождение инкрементальных обновлений.
+    Таблицы частот блокируются до commit вызывающей стороны: SHARE ROW EXCLUSIVE конфликтует с записью,
+    поэтому параллельные save_fragments и delete_video ждут пересчета, а их инкременты применяются
+    поверх него, а не теряются при DELETE. Фрагменты читаются уже под блокировкой.
+    """
+    db.execute(text(f"LOCK TABLE {TermDocumentFrequency.__tablename__}, {CorpusDocumentCount.__tablename__} "
+                    f"IN SHARE ROW EXCLUSIVE MODE"))
+    documents = Counter()
+    frequencies = Counter()
+    rows = db.execute(select(Fragment.text, Fragment.language).execution_options(yield_per=SQL_BATCH_SIZE))
+    for frag in rows:
+        language = keyword_language(frag.language)
+        documents[language] += 1
+        frequencies.update((language, term) for term in set(keyword_terms(frag.text, language)))
+
+    db.execute(delete(TermDocumentFrequency))
+    db.execute(delete(CorpusDocumentCount))
+    if documents:
+        db.execute(insert(CorpusDocumentCount).values(
+            [{"language": language, "documents": count} for language, count in documents.items()]))
+    values = [{"language": language, "term": term, "df": count} for (language, term), count in frequencies.items()]
+    for batch in _batches(values):
+        db.execute(insert(TermDocumentFrequency).values(batch))
+    return sum(documents.values()), len(frequencies)
+
+def idf_vector(db, vocabulary):
+    """
+    IDF для словаря {(язык, слово): столбец}. Слова реже KEYWORD_MIN_DOCUMENT_FREQUENCY или чаще
+    KEYWORD_MAX_DOCUMENT_RATIO корпуса получают 0 и в теги не попадают.
+    """
+    documents = dict(db.execute(select(CorpusDocumentCount.language, CorpusDocumentCount.documents)).all())
+    terms_by_language = defaultdict(list)
+    for language, term in vocabulary:
+        terms_by_language[language].append(term)
+
+    idf = np.zeros(len(vocabulary), dtype=np.float32)
+    for language, terms in terms_by_language.items():
+        total = max(documents.get(language, 0), 1)
+        frequencies = {}
+        for batch in _batches(terms):
+            frequencies.update(db.execute(
+                select(TermDocumentFrequency.term, TermDocumentFrequency.df)
+                .where(TermDocumentFrequency.language == language, TermDocumentFrequency.term.in_(batch))
+            ).all())
+        for term in terms:
+            df = frequencies.get(term, 0)
+            if df < settings.KEYWORD_MIN_DOCUMENT_FREQUENCY or df > total * settings.KEYWORD_MAX_DOCUMENT_RATIO:
+                continue
+            idf[vocabulary[(language, term)]] = math.log((1 + total) / (1 + df)) + 1
+    return idf
+
+def compute_tags(db, fragments, top_k=None):
+    """Top-k слов каждого фрагмента по TF-IDF (сублинейный TF); списки тегов в порядке fragments"""
+    top_k = top_k or settings.KEYWORD_TAGS_PER_FRAGMENT
+    vocabulary = {}
+    rows, cols, data = [], [], []
+    for i, frag in enumerate(fragments):
+        language = keyword_language(frag.language)
+        for term, count in Counter(keyword_terms(frag.text, language)).items():
+            rows.append(i)
+            cols.append(vocabulary.setdefault((language, term), len(vocabulary)))
+            data.append(count)
+    if not vocabulary:
+        return [[] for _ in fragments]
+
+    tf = sparse.csr_matrix((np.log1p(np.asarray(data, dtype=np.float32)), (rows, cols)),
+                           shape=(len(fragments), len(vocabulary)))
+    # Умножение на диагональную матрицу IDF масштабирует столбцы, не уплотняя матрицу
+    scores = sparse.csr_matrix(tf @ sparse.diags(idf_vector(db, vocabulary)))
+    scores.eliminate_zeros()
+    terms = [term for (_, term), _ in sorted(vocabulary.items(), key=lambda item: item[1])]
+
+    tags = []
+    for i in range(len(fragments)):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        row_scores, row_cols = scores.data[start:end], scores.indices[start:end]
+        # При равном score порядок детерминирован по слову
+        order = sorted(range(len(row_cols)), key=lambda j: (-row_scores[j], terms[row_cols[j]]))[:top_k]
+        tags.append([terms[row_cols[j]] for j in order])
+    return tags
+
+def tag_fragments(db, fragments):
+    """Назначает фрагментам теги; возвращает фрагменты, у которых теги изменились"""
+    changed = []
+    for frag, tags in zip(fragments, compute_tags(db, fragments)):
+        if list(frag.tags or []) != tags:
+            frag.tags = tags
+            changed.append(frag)
+    return changed
+
+def retag_corpus(batch_size=None):
+    """Пересчитывает частоты и теги всего корпуса пачками; измененные фрагменты попадают в outbox"""
+    if not settings.KEYWORD_TAGGING_ENABLED:
+        return 0
+    batch_size = batch_size or settings.KEYWORD_RETAG_BATCH_SIZE
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        documents, terms = recompute_document_frequencies(db)
+        db.commit()
+
+    last_id = 0
+    retagged = 0
+    while True:
+        with SessionLocal() as db:
+            fragments = db.execute(
+                select(Fragment).where(Fragment.id > last_id).order_by(Fragment.id).limit(batch_size)
+            ).scalars().all()
+            if not fragments:
+                break
+            last_id = fragments[-1].id
+            changed = tag_fragments(db, fragments)
+            enqueue_outbox(db, [frag.id for frag in changed], OutboxOperation.upsert)
+            db.commit()
+        retagged += len(changed)
+
+    metrics.inc("keyword_fragments_retagged_total", retagged, "Fragments whose tags changed during corpus re-tagging")
+    logger.info(f"Keyword tagging: {documents} fragments, {terms} terms, {retagged} fragments retagged "
+                f"in {time.perf_counter() - start:.1f}s")
+    return retagged
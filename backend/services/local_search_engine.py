@@ -0,0 +1,425 @@
+"""
+Встроенный поисковый движок для небольших установок, CI и edge-серверов.
+
+Инвертированный индекс с BM25, стеммингом Snowball (en/ru) и нечетким поиском по расстоянию Левенштейна.
+Индекс состоит из неизменяемых сегментов:
+    seg_<gen>.terms.json  — термин -> [смещение, число записей] в файле постингов
+    seg_<gen>.postings    — пары uint32 (порядковый номер документа, tf), читаются через mmap
+    seg_<gen>.docs.json   — хранимые поля документов
+Каждая пачка изменений пишет новый сегмент; удаления хранятся как надгробия в deletes.json.
+manifest.json переписывается последним, по его mtime читатели в других процессах видят изменения.
+"""
+import bisect
+import fcntl
+import json
+import math
+import mmap
+import os
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from core.config import settings
+from core.logger import logger
+from utils.text_analysis import tokenize, stem
+
+K1 = 1.2
+B = 0.75
+RAW_PREFIX = "="  # Нестеммированные слова хранятся в отдельном пространстве терминов
+STEM_WEIGHT = 3.0
+RAW_WEIGHT = 1.0
+FUZZY_WEIGHT = 0.5
+STORED_FIELDS = ("fragment_id", "video_id", "text", "language", "timecode_start", "timecode_end",
+                 "tags", "s3_url", "thumbnail_url", "renditions", "speech_confidence", "no_speech_prob",
+                 "video_name", "video_description", "video_s3_url")
+
+def index_terms(text, language):
+    tokens = tokenize(text)
+    terms = []
+    for token in tokens:
+        terms.append(RAW_PREFIX + token)
+        terms.append(stem(token, language))
+    return tokens, terms
+
+def fuzzy_distance(token):
+    # Аналог fuzziness: AUTO в Elasticsearch
+    if len(token) < 3:
+        return 0
+    return 1 if len(token) <= 5 else 2
+
+def within_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+def contains_phrase(tokens, phrase):
+    if not phrase:
+        return False
+    first = phrase[0]
+    for i in range(len(tokens) - len(phrase) + 1):
+        if tokens[i] == first and tokens[i:i + len(phrase)] == phrase:
+            return True
+    return False
+
+class Segment:
+    def __init__(self, directory, name, generation):
+        self.name = name
+        self.generation = generation
+        base = os.path.join(directory, name)
+        with open(f"{base}.terms.json", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        with open(f"{base}.docs.json", encoding="utf-8") as f:
+            self.docs = json.load(f)
+        self._file = open(f"{base}.postings", "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.postings = memoryview(self._mmap).cast("I")
+        else:
+            self._mmap = None
+            self.postings = memoryview(array("I"))
+
+    def postings_for(self, term):
+        entry = self.terms.get(term)
+        if not entry:
+            return ()
+        offset, count = entry
+        view = self.postings[offset * 2:(offset + count) * 2]
+        return zip(view[0::2], view[1::2])
+
+    def close(self):
+        self.postings.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+class LocalSearchEngine:
+    def __init__(self, directory=None):
+        self.directory = directory or settings.LOCAL_SEARCH_INDEX_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._manifest_mtime = None
+        self.segments = []
+        self.tombstones = {}
+        self._vocabulary = {}
+        self._suggestions = {}
+        self.doc_count = 0
+        self.avg_length = 1.0
+        self._reload()
+
+    # ---------- чтение ----------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_json(self, name, default):
+        try:
+            with open(self._path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def _manifest_stamp(self):
+        try:
+            return os.stat(self._path("manifest.json")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        with self._lock:
+            start = time.perf_counter()
+            stamp = self._manifest_stamp()
+            manifest = self._read_json("manifest.json", {"generation": 0, "segments": []})
+            tombstones = {int(k): v for k, v in self._read_json("deletes.json", {}).items()}
+
+            opened = {segment.name: segment for segment in self.segments}
+            segments = []
+            for entry in manifest["segments"]:
+                segment = opened.pop(entry["name"], None) or Segment(self.directory, entry["name"], entry["generation"])
+                segments.append(segment)
+            for segment in opened.values():
+                segment.close()
+
+            self.segments = segments
+            self.tombstones = tombstones
+            self._manifest_mtime = stamp
+            self._vocabulary = {}
+            self._suggestions = {}
+
+            live_lengths = [doc["length"] for segment in segments for doc in segment.docs if self._is_live(segment, doc)]
+            self.doc_count = len(live_lengths)
+            self.avg_length = (sum(live_lengths) / len(live_lengths)) if live_lengths else 1.0
+            logger.info(f"Local search index loaded: {len(segments)} segments, {self.doc_count} docs "
+                        f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def _maybe_reload(self):
+        if self._manifest_stamp() != self._manifest_mtime:
+            self._reload()
+
+    def _is_live(self, segment, doc):
+        return self.tombstones.get(doc["fragment_id"], -1) < segment.generation
+
+    def _fuzzy_candidates(self, token, max_distance):
+        if not self._vocabulary:
+            by_length = defaultdict(set)
+            for segment in self.segments:
+                for term in segment.terms:
+                    if term.startswith(RAW_PREFIX):
+                        by_length[len(term) - 1].add(term[1:])
+            self._vocabulary = by_length
+        candidates = []
+        for length in range(len(token) - max_distance, len(token) + max_distance + 1):
+            for candidate in self._vocabulary.get(length, ()):
+                if candidate != token and within_distance(token, candidate, max_distance):
+                    candidates.append(candidate)
+                    if len(candidates) >= settings.LOCAL_SEARCH_MAX_EXPANSIONS:
+                        return candidates
+        return candidates
+
+    def _query_groups(self, tokens, language, exact):
+        """Для каждого слова запроса — альтернативные термины с весами; слова объединяются по AND"""
+        groups = []
+        for token in tokens:
+            alternatives = [(RAW_PREFIX + token, RAW_WEIGHT)]
+            if not exact:
+                alternatives.append((stem(token, language), STEM_WEIGHT))
+                distance = fuzzy_distance(token)
+                if distance:
+                    alternatives.extend((RAW_PREFIX + candidate, FUZZY_WEIGHT)
+                                        for candidate in self._fuzzy_candidates(token, distance))
+            groups.append(alternatives)
+        return groups
+
+    def _score(self, groups):
+        scores = None
+        for alternatives in groups:
+            group_scores = {}
+            for term, weight in alternatives:
+                # df только по живым документам: удаленные и замененные версии остаются в постингах
+                # старых сегментов, и с ними df превысил бы doc_count, а IDF ушел бы в минус
+                live = [(seg_idx, ordinal, tf)
+                        for seg_idx, segment in enumerate(self.segments)
+                        for ordinal, tf in segment.postings_for(term)
+                        if self._is_live(segment, segment.docs[ordinal])]
+                if not live:
+                    continue
+                df = len(live)
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                for seg_idx, ordinal, tf in live:
+                    doc = self.segments[seg_idx].docs[ordinal]
+                    norm = tf + K1 * (1 - B + B * doc["length"] / self.avg_length)
+                    value = weight * idf * tf * (K1 + 1) / norm
+                    key = (seg_idx, ordinal)
+                    if value > group_scores.get(key, 0.0):
+                        group_scores[key] = value
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {key: score + group_scores[key] for key, score in scores.items() if key in group_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def search(self, query, language, exact=False, tags=None, min_score=1.0, size=100):
+        """Попадания в форме ответа Elasticsearch: [{"_score": ..., "_source": {...}}]"""
+        with self._lock:
+            self._maybe_reload()
+            tokens = tokenize(query)
+            if not tokens or not self.doc_count:
+                return []
+            scores = self._score(self._query_groups(tokens, language, exact))
+            tag_filter = set(tags) if tags else None
+            hits = []
+            for (seg_idx, ordinal), score in scores.items():
+                if score < min_score:
+                    continue
+                doc = self.segments[seg_idx].docs[ordinal]
+                if tag_filter and not tag_filter.intersection(doc.get("tags") or []):
+                    continue
+                if exact and not contains_phrase(tokenize(doc["text"]), tokens):
+                    continue
+                source = {field: doc.get(field) for field in STORED_FIELDS}
+                hits.append({"_id": str(doc["fragment_id"]), "_score": score, "_source": source})
+        hits.sort(key=lambda hit: (-hit["_score"], hit["_source"]["fragment_id"]))
+        return hits[:size] if size else hits
+
+    def search_collapsed(self, query, language, exact=False, tags=None, min_score=1.0,
+                         max_videos=5, max_fragments_per_video=3, offset=0):
+        """Аналог запроса со сворачиванием по video_id, ответ в той же форме"""
+        start = time.perf_counter()
+        by_video = OrderedDict()
+        for hit in self.search(query, language, exact, tags, min_score, size=None):
+            by_video.setdefault(hit["_source"]["video_id"], []).append(hit)
+        videos = sorted(by_video.items(), key=lambda item: (-item[1][0]["_score"], item[0]))
+        video_hits = [{
+            "_score": hits[0]["_score"],
+            "_source": hits[0]["_source"],
+            "inner_hits": {"top_fragments": {"hits": {"hits": hits[:max_fragments_per_video]}}}
+        } for _, hits in videos[offset:offset + max_videos]]
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {"hits": video_hits},
+            "aggregations": {"videos_total": {"value": len(videos)}}
+        }
+
+    def suggest(self, prefix, language, size=5):
+        from utils.elasticsearch_utils import suggestion_phrases
+        with self._lock:
+            self._maybe_reload()
+            phrases = self._suggestions.get(language)
+            if phrases is None:
+                unique = {}
+                for segment in self.segments:
+                    for doc in segment.docs:
+                        if doc.get("language") == language and self._is_live(segment, doc):
+                            for phrase in suggestion_phrases(doc["text"]):
+                                unique.setdefault(phrase.lower(), phrase)
+                phrases = sorted(unique.items())
+                self._suggestions[language] = phrases
+        needle = " ".join(prefix.lower().split())
+        result = []
+        for key, phrase in phrases[bisect.bisect_left(phrases, (needle, "")):]:
+            if not key.startswith(needle) or len(result) >= size:
+                break
+            result.append(phrase)
+        return result
+
+    # ---------- запись ----------
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._path(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_json(self, name, data):
+        tmp = self._path(f"{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self._path(name))
+
+    def _write_segment(self, generation, docs):
+        name = f"seg_{generation:06d}"
+        postings = defaultdict(list)
+        stored = []
+        for ordinal, doc in enumerate(docs):
+            tokens, terms = index_terms(doc.get("text"), doc.get("language"))
+            for term, tf in Counter(terms).items():
+                postings[term].append((ordinal, tf))
+            entry = {field: doc.get(field) for field in STORED_FIELDS}
+            entry["length"] = len(tokens) or 1
+            stored.append(entry)
+
+        terms = {}
+        data = array("I")
+        for term in sorted(postings):
+            entries = postings[term]
+            terms[term] = [len(data) // 2, len(entries)]
+            for ordinal, tf in entries:
+                data.append(ordinal)
+                data.append(tf)
+
+        tmp = self._path(f"{name}.postings.tmp")
+        with open(tmp, "wb") as f:
+            data.tofile(f)
+        os.replace(tmp, self._path(f"{name}.postings"))
+        self._write_json(f"{name}.terms.json", terms)
+        self._write_json(f"{name}.docs.json", stored)
+        return {"name": name, "generation": generation}
+
+    def _remove_segment_files(self, name):
+        for suffix in (".terms.json", ".docs.json", ".postings"):
+            try:
+                os.remove(self._path(name + suffix))
+            except FileNotFoundError:
+                pass
+
+    def _commit(self, manifest, tombstones):
+        self._write_json("deletes.json", {str(k): v for k, v in tombstones.items()})
+        self._write_json("manifest.json", manifest)
+
+    def _merge(self, manifest, tombstones):
+        """Сливает все сегменты в один, отбрасывая удаленные и замененные документы"""
+        latest = {}
+        for entry in manifest["segments"]:
+            with open(self._path(f"{entry['name']}.docs.json"), encoding="utf-8") as f:
+                for doc in json.load(f):
+                    if tombstones.get(doc["fragment_id"], -1) < entry["generation"]:
+                        latest[doc["fragment_id"]] = doc
+        old = [entry["name"] for entry in manifest["segments"]]
+        manifest["generation"] += 1
+        manifest["segments"] = [self._write_segment(manifest["generation"], list(latest.values()))]
+        return old
+
+    def index_documents(self, docs):
+        """Добавляет или заменяет документы (поля как в _source Elasticsearch)"""
+        if not docs:
+            return
+        with self._write_lock():
+            manifest = self._read_json("manifest.json", {"generation": 0, "segments": []})
+            tombstones = {int(k): v for k, v in self._read_json("deletes.json", {}).items()}
+            for doc in docs:
+                tombstones[doc["fragment_id"]] = manifest["generation"]
+            manifest["generation"] += 1
+            manifest["segments"].append(self._write_segment(manifest["generation"], docs))
+            obsolete = []
+            if len(manifest["segments"]) > settings.LOCAL_SEARCH_MAX_SEGMENTS:
+                obsolete = self._merge(manifest, tombstones)
+                tombstones = {}
+            self._commit(manifest, tombstones)
+            for name in obsolete:
+                self._remove_segment_files(name)
+        self._reload()
+
+    def delete_documents(self, fragment_ids):
+        if not fragment_ids:
+            return
+        with self._write_lock():
+            manifest = self._read_json("manifest.json", {"generation": 0, "segments": []})
+            tombstones = {int(k): v for k, v in self._read_json("deletes.json", {}).items()}
+            for fragment_id in fragment_ids:
+                tombstones[int(fragment_id)] = manifest["generation"]
+            self._commit(manifest, tombstones)
+        self._reload()
+
+    def rebuild(self, docs):
+        """Полная пересборка индекса в один сегмент"""
+        with self._write_lock():
+            manifest = self._read_json("manifest.json", {"generation": 0, "segments": []})
+            old = [entry["name"] for entry in manifest["segments"]]
+            manifest["generation"] += 1
+            manifest["segments"] = [self._write_segment(manifest["generation"], docs)]
+            self._commit(manifest, {})
+            for name in old:
+                self._remove_segment_files(name)
+        self._reload()
+
+    def is_empty(self):
+        with self._lock:
+            self._maybe_reload()
+            return not self.segments
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_local_engine() -> LocalSearchEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LocalSearchEngine()
+    return _engine
@@ -3,11 +3,14 @@ import os
 import uuid
 import shutil
 from utils.s3_utils import upload_file_to_s3
+from utils.hls import hls_prefix, playlist_key, PLAYLIST_NAME, MEDIA_NAME
+from utils.renditions import configured_renditions, primary_rendition, rendition_extension, build_rendition_command
+from utils.previews import previews_prefix, thumbnail_time, sprite_layout, build_preview_filter, THUMBNAIL_PATTERN, SPRITE_NAME
 from db.models.video_fragment import VideoFragment
 from core.config import settings
 from core.logger import logger
 from whisper import load_model
-from typing import Optional
+from typing import List, Optional
 import torch
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -120,33 +123,144 @@ class VideoProcessor:
             fragments.append(frag)
         return self.optimize_fragments(fragments)
     
-    def cut_video_segment(self, video_path: str, output_path: str, start_time: float, end_time: float) -> bool:
-        cmd = ["ffmpeg", "-i", video_path, "-ss", str(start_time), "-t", str(end_time - start_time), "-c:v", "libx264", "-c:a", "aac", "-y", output_path]
+    def has_audio(self, video_path: str) -> bool:
+        """Есть ли в видео звуковая дорожка (по выводу ffmpeg -i, как и длительность)"""
+        proc = subprocess.run(["ffmpeg", "-i", video_path], capture_output=True, text=True)
+        return any("Stream #" in line and "Audio:" in line for line in proc.stderr.splitlines())
+
+    def fragment_renditions(self, video_path: str) -> List[str]:
+        """Варианты файлов фрагментов для видео; audio пропускается, если звука нет"""
+        return configured_renditions(has_audio=self.has_audio(video_path))
+
+    def cut_video_segment(self, video_path: str, outputs, start_time: float, end_time: float) -> bool:
+        """Нарезает отрезок во все варианты outputs [(имя варианта, путь)] за одно декодирование"""
+        cmd = build_rendition_command(video_path, start_time, end_time, outputs)
         logger.info(f"Выполняется команда: {cmd}")
         proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            logger.error(f"Ошибка ffmpeg при нарезке фрагмента: {proc.stderr[-2000:]}")
         return proc.returncode == 0
 
-    def process_and_upload_fragment(self, video_path: str, temp_dir: str, fragment: VideoFragment) -> Optional[str]:
+    def transcode_to_hls(self, video_path: str, output_dir: str) -> str:
+        """
+        Один проход ffmpeg: fragmented MP4 одним файлом с ключевыми кадрами на границах сегментов
+        и VOD-плейлист, адресующий сегменты байтовыми диапазонами. Возвращает путь к плейлисту.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        segment = settings.HLS_SEGMENT_SECONDS
+        playlist_path = os.path.join(output_dir, PLAYLIST_NAME)
+        cmd = [
+            "ffmpeg", "-i", video_path,
+            "-c:v", "libx264", "-preset", settings.FFMPEG_PRESET, "-crf", str(settings.FFMPEG_CRF),
+            "-threads", str(settings.FFMPEG_THREADS), "-c:a", "aac",
+            "-force_key_frames", f"expr:gte(t,n_forced*{segment})",
+            "-f", "hls", "-hls_time", str(segment), "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4", "-hls_flags", "single_file+independent_segments",
+            "-hls_segment_filename", os.path.join(output_dir, MEDIA_NAME),
+            "-y", playlist_path
+        ]
+        logger.info(f"Выполняется команда: {cmd}")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr)
+        return playlist_path
+
+    def transcode_and_upload_hls(self, video_path: str, temp_dir: str, video_id: int) -> str:
+        """Транскодирует видео в HLS, загружает файлы в hls/<video_id>/ и возвращает ключ плейлиста"""
+        output_dir = os.path.join(temp_dir, f"hls_{uuid.uuid4()}")
         try:
-            fragment_filename = f"fragment_{uuid.uuid4()}.mp4"
-            fragment_path = os.path.join(temp_dir, fragment_filename)
-            logger.info(f"Начинается нарезка видео: [{fragment.start_time} - {fragment.end_time}] в файл {fragment_path}")
+            self.transcode_to_hls(video_path, output_dir)
+            # Плейлист загружается последним: пока его нет, транскод не виден
+            upload_file_to_s3(os.path.join(output_dir, MEDIA_NAME), hls_prefix(video_id) + MEDIA_NAME)
+            key = upload_file_to_s3(os.path.join(output_dir, PLAYLIST_NAME), playlist_key(video_id))
+            logger.info(f"HLS-транскод видео {video_id} загружен в S3 с ключом: {key}")
+            return key
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def generate_previews(self, video_path: str, output_dir: str, thumb_times: List[float], duration: float):
+        """
+        Один проход ffmpeg: миниатюры на заданные моменты и лист спрайта перемотки.
+        Возвращает (пути миниатюр по порядку thumb_times, геометрия спрайта).
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        layout = sprite_layout(duration, settings.PREVIEW_SPRITE_COLUMNS, settings.PREVIEW_SPRITE_MAX_FRAMES,
+                               settings.PREVIEW_SPRITE_MIN_INTERVAL, settings.PREVIEW_SPRITE_TILE_WIDTH,
+                               settings.PREVIEW_SPRITE_TILE_HEIGHT)
+        cmd = [
+            "ffmpeg", "-i", video_path, "-threads", str(settings.FFMPEG_THREADS),
+            "-filter_complex", build_preview_filter(thumb_times, layout, settings.PREVIEW_THUMBNAIL_WIDTH),
+            "-map", "[thumbs]", "-vsync", "vfr", "-q:v", "3", os.path.join(output_dir, THUMBNAIL_PATTERN),
+            "-map", "[sprite]", "-frames:v", "1", "-q:v", "5", os.path.join(output_dir, SPRITE_NAME),
+            "-y"
+        ]
+        logger.info(f"Выполняется команда: {cmd}")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr)
+        thumbnails = sorted(name for name in os.listdir(output_dir) if name.startswith("thumb_"))
+        return [os.path.join(output_dir, name) for name in thumbnails], layout
+
+    def generate_and_upload_previews(self, video_path: str, temp_dir: str, video_id: int,
+                                     fragments: List[VideoFragment], duration: float) -> Optional[dict]:
+        """
+        Миниатюры фрагментов и спрайт видео в fragments/previews/<video_id>/.
+        Проставляет фрагментам thumbnail_url и возвращает описание спрайта для записи видео.
+        """
+        times = sorted({thumbnail_time(frag.start_time, frag.end_time) for frag in fragments})
+        if not times:
+            return None
+        output_dir = os.path.join(temp_dir, f"previews_{uuid.uuid4()}")
+        prefix = previews_prefix(video_id)
+        try:
+            thumbnails, layout = self.generate_previews(video_path, output_dir, times, duration)
+            if len(thumbnails) == len(times):
+                keys = {t: upload_file_to_s3(path, prefix + os.path.basename(path), use_multipart=False)
+                        for t, path in zip(times, thumbnails)}
+                for frag in fragments:
+                    frag.thumbnail_url = keys[thumbnail_time(frag.start_time, frag.end_time)]
+            else:
+                # Кадры не сопоставить с фрагментами (например, два момента попали в один кадр)
+                logger.warning(f"Получено {len(thumbnails)} миниатюр вместо {len(times)} для видео {video_id}, миниатюры пропущены")
+            sprite_key = upload_file_to_s3(os.path.join(output_dir, SPRITE_NAME), prefix + SPRITE_NAME, use_multipart=False)
+            logger.info(f"Превью видео {video_id} загружены в S3 с префиксом: {prefix}")
+            return {"s3_url": sprite_key, **layout}
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def process_and_upload_fragment(self, video_path: str, temp_dir: str, fragment: VideoFragment,
+                                    renditions: List[str] = None) -> Optional[dict]:
+        """
+        Нарезает фрагмент во все варианты и загружает их в S3.
+        Возвращает {имя варианта: ключ S3} или None при ошибке; основной вариант под ключом fragment_<uuid>.mp4.
+        """
+        renditions = renditions or configured_renditions()
+        primary = primary_rendition(renditions)
+        fragment_id = uuid.uuid4()
+        outputs = [
+            (name, os.path.join(temp_dir, f"fragment_{fragment_id}{'' if name == primary else '_' + name}{rendition_extension(name)}"))
+            for name in renditions
+        ]
+        try:
+            logger.info(f"Начинается нарезка видео: [{fragment.start_time} - {fragment.end_time}] в варианты {renditions}")
             
-            if not self.cut_video_segment(video_path, fragment_path, fragment.start_time, fragment.end_time):
+            if not self.cut_video_segment(video_path, outputs, fragment.start_time, fragment.end_time):
                 logger.error(f"Не удалось нарезать видео для фрагмента [{fragment.start_time} - {fragment.end_time}]")
                 return None
-            logger.info(f"Успешно нарезан фрагмент: {fragment_path}")
-            
-            s3_key = upload_file_to_s3(fragment_path, f"fragments/{fragment_filename}")
-            logger.info(f"Фрагмент загружен в S3 с ключом: {s3_key}")
-            
-            try:
-                os.remove(fragment_path)
-                logger.info(f"Временный файл успешно удалён: {fragment_path}")
-            except Exception as e:
-                logger.warning(f"Ошибка при удалении временного файла {fragment_path}: {e}")
+            logger.info(f"Успешно нарезан фрагмент: {outputs[0][1]}")
             
-            return s3_key
+            keys = {}
+            for name, path in outputs:
+                keys[name] = upload_file_to_s3(path, f"fragments/{os.path.basename(path)}")
+            logger.info(f"Фрагмент загружен в S3 с ключами: {keys}")
+            return keys
         except Exception as e:
             logger.error(f"Ошибка при обработке фрагмента: {e}", exc_info=True)
             return None
+        finally:
+            for _, path in outputs:
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except Exception as e:
+                    logger.warning(f"Ошибка при удалении временного файла {path}: {e}")
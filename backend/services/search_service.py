@@ -1,70 +1,761 @@
+import asyncio
+import base64
+import json
+import re
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from db.base import SessionLocal
 from db.models.fragment import Fragment
-from utils.elasticsearch_utils import get_elasticsearch
+from db.models.video import Video
+from elasticsearch import ConnectionTimeout
+from utils.elasticsearch_utils import get_elasticsearch, get_async_elasticsearch
+from utils.index_profiles import get_index_profile, get_index_layout, search_fields, suggest_field, language_index
+from utils.cache import TTLCache
+from services.embedding_service import embed_query
+from services.indexing_service import is_local_backend, local_engine
+from utils.s3_utils import generate_presigned_url
+from utils.hls import is_hls_key
+from utils.media_cache import fragment_media_url, fragment_rendition_urls
 from core.config import settings
+from core import timing, metrics
 from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 from core.logger import logger
-from core.exceptions import DatabaseError, ElasticsearchException
+from core.exceptions import ElasticsearchException
+from schemas.search import SearchResult, SearchFragment, VideoInfo
 from utils.video_processing import SmartVideoFragmenter
 
-def search_in_elasticsearch(query, exact=False, tags=None, min_score=1.0):
-    index_name = settings.ELASTICSEARCH_INDEX_NAME
-    try:
-        # Определяем язык запроса с помощью статического метода
-        detected_lang = SmartVideoFragmenter.detect_language(query)
-        if detected_lang == "ru":
-            fields = ["text.ru_fuzzy^3", "text.ngram^2", "text"]
-        else:
-            fields = ["text.en_fuzzy^3", "text.ngram^2", "text"]
+CYRILLIC_RE = re.compile("[а-яё]", re.IGNORECASE)
 
-        logger.info(f"Incoming query: '{query}'; Detected language: {detected_lang}; Searching in fields: {fields}")
+suggest_cache = TTLCache(settings.SUGGEST_CACHE_SIZE, settings.SUGGEST_CACHE_TTL_SECONDS)
 
-        if exact:
-            query_clause = {
-                "match_phrase": {
-                    fields[2]: {
-                        "query": query,
-                        "slop": 0
-                    }
-                }
-            }
-        else:
-            query_clause = {
-                "multi_match": {
+# database — фрагменты и видео дочитываются из Postgres; source — все поля выдачи берутся из _source документов
+HYDRATION_MODES = ("database", "source")
+ID_SOURCE_FIELDS = ["fragment_id", "video_id"]
+# Денормализованные поля видео обновляются через outbox вместе с документом, поэтому видео берутся из них в обоих режимах
+VIDEO_SOURCE_FIELDS = ["video_name", "video_description", "video_s3_url"]
+RESULT_SOURCE_FIELDS = ID_SOURCE_FIELDS + [
+    "text", "timecode_start", "timecode_end", "s3_url", "thumbnail_url", "renditions"
+] + VIDEO_SOURCE_FIELDS
+
+def detect_query_language(query):
+    with timing.span("lang"):
+        # Кириллица однозначно указывает на русский даже в коротком префиксе, где langdetect ошибается
+        if CYRILLIC_RE.search(query) and "ru" in settings.VIDEO_SUPPORTED_LANGUAGES:
+            return "ru"
+        return SmartVideoFragmenter.detect_language(query)
+
+def record_es_timing(res, started_at):
+    """Время запроса к Elasticsearch со стороны клиента и собственное время поиска (took)"""
+    timing.record("es", (time.perf_counter() - started_at) * 1000)
+    if "took" in res:
+        timing.record("es_took", float(res["took"]))
+
+# Стадии планировщика от дешевой к дорогой: term — фраза и точные (стеммированные) слова,
+# fuzzy — multi_match с fuzziness по стеммированному полю и n-граммам
+QUERY_STAGES = ("term", "fuzzy")
+
+def build_query_clause(query, exact=False, tags=None, profile=None, stage="fuzzy", language=None):
+    detected_lang = language or detect_query_language(query)
+    fields = search_fields(profile or get_index_profile(), detected_lang)
+
+    logger.info(f"Incoming query: '{query}'; Detected language: {detected_lang}; Stage: {stage}; Searching in fields: {fields}")
+
+    if exact:
+        query_clause = {
+            "match_phrase": {
+                fields[2]: {
                     "query": query,
-                    "fields": fields,
-                    "operator": "and",
-                    "fuzziness": "AUTO"
+                    "slop": 0
                 }
             }
-
-        if tags:
-            tag_clause = {"terms": {"tags": tags}}
-        else:
-            tag_clause = None
-
-        bool_query = {"must": [query_clause]}
-        if tag_clause:
-            bool_query["must"].append(tag_clause)
-
-        search_body = {
-            "query": {
-                "bool": bool_query
-            },
-            "min_score": min_score,
-            "size": 100
         }
+    elif stage == "term":
+        query_clause = {
+            "bool": {
+                "should": [
+                    {"match_phrase": {fields[2]: {"query": query, "boost": 2}}},
+                    {"multi_match": {"query": query, "fields": [fields[0], fields[2]], "operator": "and"}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    else:
+        query_clause = {
+            "multi_match": {
+                "query": query,
+                "fields": fields,
+                "operator": "and",
+                "fuzziness": "AUTO"
+            }
+        }
+
+    bool_query = {"must": [query_clause]}
+    if tags:
+        bool_query["must"].append({"terms": {"tags": tags}})
+    return {"bool": bool_query}
+
+def plan_stages(exact=False, stage=None):
+    """Стадии, которые нужно пройти: стадия из курсора фиксируется, точный поиск выполняется одной стадией"""
+    if stage:
+        return [stage]
+    if exact or not settings.SEARCH_PLANNER_ENABLED:
+        return ["fuzzy"]
+    return list(QUERY_STAGES)
+
+def stage_hit_counts(res):
+    """(число попаданий-фрагментов, число видео) в ответе стадии"""
+    total = res.get("hits", {}).get("total", {})
+    hits = total.get("value", 0) if isinstance(total, dict) else (total or 0)
+    videos = res.get("aggregations", {}).get("videos_total", {}).get("value", hits)
+    return hits, videos
+
+def finish_stage(query, stage, res, started_at, is_last, needed=0):
+    """
+    Логирует стадию и решает, достаточно ли ее результатов: видео должно быть не меньше
+    SEARCH_PLANNER_MIN_HITS и не меньше needed (чтобы заполнить запрошенную страницу).
+    """
+    latency_ms = (time.perf_counter() - started_at) * 1000
+    hits, videos = stage_hit_counts(res)
+    enough = is_last or videos >= max(settings.SEARCH_PLANNER_MIN_HITS, needed)
+    timing.record(f"stage_{stage}", latency_ms, f"hits={hits}")
+    metrics.inc("search_planner_stage_total", help_text="Query planner stages executed", stage=stage)
+    if enough:
+        metrics.inc("search_planner_final_stage_total", help_text="Stage that produced the returned results", stage=stage)
+    logger.info(f"Query planner: '{query}' stage={stage} hits={hits} videos={videos} "
+                f"latency={latency_ms:.1f}ms took={res.get('took')}ms {'accepted' if enough else 'expanding'}")
+    return enough
+
+def new_search_budget(budget_ms=None):
+    return timing.LatencyBudget(budget_ms or settings.SEARCH_LATENCY_BUDGET_MS, settings.SEARCH_BUDGET_MIN_STEP_MS)
 
+def apply_search_limits(body, budget=None):
+    """
+    Ограничения стоимости запроса: timeout из бюджета (шарды, не успевшие к сроку, дают частичный ответ),
+    предел подсчета total hits и, если задан, terminate_after.
+    """
+    if budget is not None:
+        body["timeout"] = budget.es_timeout()
+    body["track_total_hits"] = settings.SEARCH_TRACK_TOTAL_HITS
+    if settings.SEARCH_TERMINATE_AFTER:
+        body["terminate_after"] = settings.SEARCH_TERMINATE_AFTER
+    return body
+
+def with_budget(client, budget=None):
+    """Клиент с таймаутом HTTP чуть больше бюджета: Elasticsearch сам вернет частичный ответ к сроку"""
+    if budget is None:
+        return client
+    return client.options(request_timeout=budget.remaining_seconds() + settings.SEARCH_BUDGET_GRACE_SECONDS)
+
+def is_partial_response(res):
+    return bool(res.get("timed_out") or res.get("terminated_early"))
+
+def count_overrun(stage):
+    metrics.inc("search_budget_overruns_total", help_text="Search stages cut short by the latency budget", stage=stage)
+
+def apply_language_boost(body, language):
+    """При индексах по языкам поднимает score документов из индекса языка запроса"""
+    if get_index_layout() == "per_language":
+        body["indices_boost"] = [{language_index(language): settings.SEARCH_LANGUAGE_BOOST}]
+    return body
+
+def search_in_elasticsearch(query, exact=False, tags=None, min_score=1.0, budget=None, needed=0):
+    """
+    Попадания по фрагментам без сворачивания. needed — сколько видео нужно вызывающему,
+    стадия планировщика принимается, только если их набралось не меньше.
+    """
+    index_name = settings.ELASTICSEARCH_INDEX_NAME
+    budget = budget or new_search_budget()
+    try:
         es = get_elasticsearch()
-        res = es.search(index=index_name, body=search_body)
-        return res["hits"]["hits"]
+        language = detect_query_language(query)
+        stages = plan_stages(exact)
+        for i, stage in enumerate(stages):
+            search_body = apply_search_limits(apply_language_boost({
+                "query": build_query_clause(query, exact, tags, stage=stage, language=language),
+                "min_score": min_score,
+                "size": 100,
+                # Планировщик считает видео, как и в поиске со сворачиванием
+                "aggs": {"videos_total": {"cardinality": {"field": "video_id"}}}
+            }, language), budget)
+            started_at = time.perf_counter()
+            res = with_budget(es, budget).search(index=index_name, body=search_body)
+            record_es_timing(res, started_at)
+            if stage_outcome(query, stage, res, started_at, i == len(stages) - 1, needed, budget) is not None:
+                return res["hits"]["hits"]
     except Exception as e:
         logger.error(f"Error in search_in_elasticsearch: {e}", exc_info=True)
         raise e
 
+def search_fragments(query, exact=False, tags=None, min_score=1.0, needed=0):
+    """Попадания по фрагментам из выбранного поискового бэкенда"""
+    if is_local_backend():
+        return local_engine().search(query, detect_query_language(query), exact, tags, min_score)
+    return search_in_elasticsearch(query, exact, tags, min_score, needed=needed)
+
+def suggest_phrases(prefix, size=5):
+    """Подсказки фраз по префиксу из completion-поля языка запроса"""
+    prefix = " ".join(prefix.split())
+    language = detect_query_language(prefix)
+    cache_key = (language, prefix.lower(), size)
+    cached = suggest_cache.get(cache_key)
+    if cached is not None:
+        return language, cached
+
+    if is_local_backend():
+        suggestions = local_engine().suggest(prefix, language, size)
+        suggest_cache.set(cache_key, suggestions)
+        return language, suggestions
+
+    completion = {
+        "field": suggest_field(language),
+        "size": size,
+        "skip_duplicates": True
+    }
+    if len(prefix) >= 4:
+        completion["fuzzy"] = {"fuzziness": 1, "prefix_length": 2}
+    body = {
+        "suggest": {"phrases": {"prefix": prefix, "completion": completion}},
+        "_source": False
+    }
+    try:
+        es = get_elasticsearch().options(request_timeout=settings.SUGGEST_TIMEOUT_SECONDS)
+        # При индексах по языкам completion-поле языка есть только в его индексе
+        index = language_index(language) if get_index_layout() == "per_language" else settings.ELASTICSEARCH_INDEX_NAME
+        res = es.search(index=index, body=body)
+    except Exception as e:
+        logger.error(f"Error in suggest_phrases: {e}", exc_info=True)
+        raise e
+    options = res.get("suggest", {}).get("phrases", [{}])[0].get("options", [])
+    suggestions = [option["text"] for option in options]
+    suggest_cache.set(cache_key, suggestions)
+    return language, suggestions
+
+def encode_cursor(offset, stage=None):
+    """Непрозрачный курсор следующей страницы; стадия планировщика сохраняется, чтобы страницы были согласованы"""
+    state = {"offset": offset}
+    if stage:
+        state["stage"] = stage
+    raw = json.dumps(state).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor_state(cursor):
+    """(offset, stage) из курсора; stage — None для первой страницы и старых курсоров"""
+    if not cursor:
+        return 0, None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded))
+        offset = int(state["offset"])
+        stage = state.get("stage")
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if offset < 0 or (stage is not None and stage not in QUERY_STAGES):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset, stage
+
+def decode_cursor(cursor):
+    return decode_cursor_state(cursor)[0]
+
+def build_collapsed_search_body(query, exact=False, tags=None, min_score=1.0,
+                                max_videos=5, max_fragments_per_video=3, offset=0, profile=False,
+                                stage="fuzzy", language=None, budget=None):
+    """
+    Тело запроса со сворачиванием по video_id: одно попадание на видео,
+    лучшие фрагменты видео приходят в inner_hits.
+    """
+    language = language or detect_query_language(query)
+    body = {
+        "query": build_query_clause(query, exact, tags, stage=stage, language=language),
+        "min_score": min_score,
+        "from": offset,
+        "size": max_videos,
+        # video_id как второй ключ делает порядок при равных score детерминированным
+        "sort": [{"_score": "desc"}, {"video_id": "asc"}],
+        "collapse": {
+            "field": "video_id",
+            "inner_hits": {
+                "name": "top_fragments",
+                "size": max_fragments_per_video,
+                "sort": [{"_score": "desc"}, {"fragment_id": "asc"}],
+                "_source": fragment_source_fields()
+            }
+        },
+        "_source": ["fragment_id", "video_id"],
+        "aggs": {
+            "videos_total": {"cardinality": {"field": "video_id"}}
+        }
+    }
+    if profile:
+        body["profile"] = True
+    return apply_search_limits(apply_language_boost(body, language), budget)
+
+def parse_collapsed_response(res, offset, max_videos, stage=None, partial=False):
+    video_hits = res["hits"]["hits"]
+    total_videos = res.get("aggregations", {}).get("videos_total", {}).get("value", len(video_hits))
+    next_offset = offset + len(video_hits)
+    next_cursor = encode_cursor(next_offset, stage) if len(video_hits) == max_videos and next_offset < total_videos else None
+    return {"video_hits": video_hits, "total_videos": total_videos, "next_cursor": next_cursor,
+            "profile": res.get("profile"), "stage": stage, "partial": partial or is_partial_response(res)}
+
+def empty_partial_page():
+    """Страница, когда Elasticsearch не ответил в пределах бюджета"""
+    return {"video_hits": [], "total_videos": 0, "next_cursor": None, "profile": None, "stage": None, "partial": True}
+
+def stage_outcome(query, stage, res, started_at, is_last, needed, budget):
+    """
+    Итог стадии планировщика: None — нужна следующая стадия, иначе признак частичного результата
+    (стадию пришлось принять, потому что кончился бюджет)
+    """
+    if is_partial_response(res):
+        count_overrun("es")
+    if finish_stage(query, stage, res, started_at, is_last, needed):
+        return False
+    if budget is not None and budget.expired:
+        # На расширение запроса времени не осталось: отдаем то, что нашла дешевая стадия
+        count_overrun("planner")
+        return True
+    return None
+
+def accept_stage(query, stage, res, started_at, is_last, offset, max_videos, budget):
+    """Страница результатов, если стадию можно принять (хватило попаданий или кончился бюджет), иначе None"""
+    partial = stage_outcome(query, stage, res, started_at, is_last, offset + max_videos, budget)
+    if partial is None:
+        return None
+    return parse_collapsed_response(res, offset, max_videos, stage, partial=partial)
+
+def local_search_videos_collapsed(query, exact=False, tags=None, min_score=1.0,
+                                  max_videos=5, max_fragments_per_video=3, offset=0):
+    language = detect_query_language(query)
+    with timing.span("local_search"):
+        res = local_engine().search_collapsed(query, language, exact, tags, min_score,
+                                              max_videos, max_fragments_per_video, offset)
+    return parse_collapsed_response(res, offset, max_videos)
+
+def search_videos_collapsed(query, exact=False, tags=None, min_score=1.0,
+                            max_videos=5, max_fragments_per_video=3, cursor=None, budget=None):
+    offset, cursor_stage = decode_cursor_state(cursor)
+    budget = budget or new_search_budget()
+    if is_local_backend():
+        return local_search_videos_collapsed(query, exact, tags, min_score,
+                                             max_videos, max_fragments_per_video, offset)
+    try:
+        es = get_elasticsearch()
+        language = detect_query_language(query)
+        stages = plan_stages(exact, cursor_stage)
+        for i, stage in enumerate(stages):
+            search_body = build_collapsed_search_body(query, exact, tags, min_score,
+                                                      max_videos, max_fragments_per_video, offset,
+                                                      stage=stage, language=language, budget=budget)
+            started_at = time.perf_counter()
+            res = with_budget(es, budget).search(index=settings.ELASTICSEARCH_INDEX_NAME, body=search_body)
+            record_es_timing(res, started_at)
+            page = accept_stage(query, stage, res, started_at, i == len(stages) - 1, offset, max_videos, budget)
+            if page is not None:
+                return page
+    except ConnectionTimeout:
+        count_overrun("es")
+        logger.warning(f"Search '{query}' exceeded its latency budget waiting for Elasticsearch")
+        return empty_partial_page()
+    except Exception as e:
+        logger.error(f"Error in search_videos_collapsed: {e}", exc_info=True)
+        raise e
+
+def multi_search_videos_collapsed(queries, min_score=1.0, budget=None):
+    """
+    Несколько поисков одним запросом _msearch.
+    queries: объекты с полями query, exact, tags, max_videos, max_fragments_per_video, cursor.
+    Возвращает страницы в порядке запросов; для упавшего запроса — {"error": ...}.
+    """
+    offsets = [decode_cursor(q.cursor) for q in queries]
+    if is_local_backend():
+        pages = []
+        for q, offset in zip(queries, offsets):
+            try:
+                pages.append(local_search_videos_collapsed(q.query, q.exact, q.tags, min_score,
+                                                           q.max_videos, q.max_fragments_per_video, offset))
+            except Exception as e:
+                logger.error(f"Batch search query '{q.query}' failed: {e}")
+                pages.append({"error": str(e)})
+        return pages
+
+    # Каждая стадия планировщика — один _msearch; на следующую стадию идут только запросы,
+    # которым не хватило попаданий
+    plans = [plan_stages(q.exact, decode_cursor_state(q.cursor)[1]) for q in queries]
+    languages = [detect_query_language(q.query) for q in queries]
+    pages = [None] * len(queries)
+    pending = list(range(len(queries)))
+    level = 0
+    budget = budget or new_search_budget(settings.SEARCH_BATCH_LATENCY_BUDGET_MS)
+    while pending:
+        searches = []
+        for i in pending:
+            q = queries[i]
+            searches.append({"index": settings.ELASTICSEARCH_INDEX_NAME})
+            searches.append(build_collapsed_search_body(q.query, q.exact, q.tags, min_score,
+                                                        q.max_videos, q.max_fragments_per_video, offsets[i],
+                                                        stage=plans[i][level], language=languages[i],
+                                                        budget=budget))
+        try:
+            started_at = time.perf_counter()
+            res = with_budget(get_elasticsearch(), budget).msearch(searches=searches)
+            record_es_timing(res, started_at)
+        except ConnectionTimeout:
+            count_overrun("es")
+            logger.warning("Batch search exceeded its latency budget waiting for Elasticsearch")
+            for i in pending:
+                pages[i] = empty_partial_page()
+            break
+        except Exception as e:
+            logger.error(f"Error in multi_search_videos_collapsed: {e}", exc_info=True)
+            raise e
+
+        next_pending = []
+        for i, response in zip(pending, res["responses"]):
+            q = queries[i]
+            stage = plans[i][level]
+            if "error" in response:
+                reason = response["error"].get("reason", str(response["error"])) if isinstance(response["error"], dict) else str(response["error"])
+                logger.error(f"Batch search query '{q.query}' failed: {reason}")
+                pages[i] = {"error": reason}
+            else:
+                page = accept_stage(q.query, stage, response, started_at, level == len(plans[i]) - 1,
+                                    offsets[i], q.max_videos, budget)
+                if page is None:
+                    next_pending.append(i)
+                else:
+                    pages[i] = page
+        pending = next_pending
+        level += 1
+    return pages
+
+def collapsed_fragment_hits(video_hit):
+    return video_hit.get("inner_hits", {}).get("top_fragments", {}).get("hits", {}).get("hits", [])
+
+def collapsed_fragment_ids(video_hits):
+    return [hit["_source"]["fragment_id"] for video_hit in video_hits for hit in collapsed_fragment_hits(video_hit)]
+
+def get_hydration_mode():
+    if settings.SEARCH_HYDRATION not in HYDRATION_MODES:
+        raise ValueError(f"Unknown search hydration '{settings.SEARCH_HYDRATION}', expected one of {list(HYDRATION_MODES)}")
+    return settings.SEARCH_HYDRATION
+
+def fragment_source_fields():
+    """Поля _source фрагментов в ответе поиска: при гидратации из индекса — все поля выдачи, иначе id и поля видео"""
+    return RESULT_SOURCE_FIELDS if get_hydration_mode() == "source" else ID_SOURCE_FIELDS + VIDEO_SOURCE_FIELDS
+
+def videos_from_source(video_hits):
+    """
+    Видео из денормализованных полей _source попаданий. Документы, проиндексированные до появления
+    этих полей, видео не дают — такие видео дочитываются из БД.
+    """
+    videos_by_id = {}
+    for video_hit in video_hits:
+        for hit in collapsed_fragment_hits(video_hit):
+            source = hit["_source"]
+            if "video_name" not in source or source["video_id"] in videos_by_id:
+                continue
+            videos_by_id[source["video_id"]] = SimpleNamespace(
+                id=source["video_id"],
+                name=source.get("video_name") or "",
+                description=source.get("video_description"),
+                s3_url=source.get("video_s3_url")
+            )
+    return videos_by_id
+
+def hydrate_from_source(video_hits):
+    """
+    Фрагменты и видео из _source попаданий, без обращения к БД.
+    Возвращает (fragments_by_id, videos_by_id) в той же форме, что и гидратация из БД.
+    """
+    fragments_by_id = {}
+    videos_by_id = videos_from_source(video_hits)
+    for video_hit in video_hits:
+        for hit in collapsed_fragment_hits(video_hit):
+            source = hit["_source"]
+            fragments_by_id[source["fragment_id"]] = SimpleNamespace(
+                id=source["fragment_id"],
+                video_id=source["video_id"],
+                text=source.get("text") or "",
+                timecode_start=source.get("timecode_start"),
+                timecode_end=source.get("timecode_end"),
+                s3_url=source.get("s3_url"),
+                thumbnail_url=source.get("thumbnail_url"),
+                renditions=source.get("renditions")
+            )
+    return fragments_by_id, videos_by_id
+
 def get_fragments_with_videos(db, fragment_ids):
-    fragments = db.execute(select(Fragment).where(Fragment.id.in_(fragment_ids))).scalars().all()
+    fragments = db.execute(
+        select(Fragment).options(joinedload(Fragment.video)).where(Fragment.id.in_(fragment_ids))
+    ).scalars().all()
     return fragments
 
+def fragment_media_keys(fragments):
+    """Ключи S3 файлов, вариантов и миниатюр фрагментов, которые нужно подписать для выдачи"""
+    return [key for frag in fragments
+            for key in (frag.s3_url, frag.thumbnail_url, *(frag.renditions or {}).values())]
+
+def sign_urls(s3_keys, expiration=3600):
+    """Подписывает каждый уникальный ключ один раз; плейлисты HLS отдаются через API и не подписываются"""
+    return {key: generate_presigned_url(key, expiration=expiration)
+            for key in set(s3_keys) if key and not is_hls_key(key)}
+
+def hydrate_fragments(fragment_ids):
+    """
+    Фрагменты вместе с видео одним запросом к БД и подписанные ссылки на их файлы.
+    Возвращает (fragments_by_id, videos_by_id, signed_urls).
+    """
+    if not fragment_ids:
+        return {}, {}, {}
+    metrics.inc("search_db_hydrations_total", help_text="Search result hydrations that queried the database")
+    with timing.span("db"), SessionLocal() as db:
+        fragments = get_fragments_with_videos(db, list(set(fragment_ids)))
+    fragments_by_id = {frag.id: frag for frag in fragments}
+    videos_by_id = {frag.video.id: frag.video for frag in fragments if frag.video}
+    keys = fragment_media_keys(fragments) + [video.s3_url for video in videos_by_id.values()]
+    with timing.span("sign"):
+        signed_urls = sign_urls(keys)
+    return fragments_by_id, videos_by_id, signed_urls
+
+SEARCH_MODES = ("lexical", "hybrid")
+
+def resolve_search_mode(mode=None):
+    mode = mode or settings.SEARCH_DEFAULT_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}', expected one of {list(SEARCH_MODES)}")
+    if mode == "hybrid" and not settings.SEARCH_VECTOR_ENABLED:
+        raise ValueError("Hybrid search requires SEARCH_VECTOR_ENABLED")
+    if mode == "hybrid" and is_local_backend():
+        raise ValueError("Hybrid search is not supported by the local search backend")
+    return mode
+
+def build_knn_search_body(query_vector, tags=None):
+    knn = {
+        "field": "embedding",
+        "query_vector": query_vector,
+        "k": settings.SEARCH_KNN_K,
+        "num_candidates": settings.SEARCH_KNN_NUM_CANDIDATES,
+        # Аналог min_score лексической части: далекие по смыслу фрагменты не попадают в слияние
+        "similarity": settings.SEARCH_KNN_MIN_SIMILARITY
+    }
+    if tags:
+        knn["filter"] = {"terms": {"tags": tags}}
+    return {"knn": knn, "size": settings.SEARCH_KNN_K, "_source": fragment_source_fields()}
+
+def fuse_hybrid(lexical_video_hits, knn_hits, max_fragments_per_video, rrf_k=None):
+    """
+    Reciprocal rank fusion BM25 и kNN: видео и фрагменты внутри видео получают сумму 1 / (k + ранг)
+    по обоим ранжированиям. Результат в той же форме, что и ответ со сворачиванием.
+    """
+    rrf_k = rrf_k or settings.SEARCH_RRF_K
+    video_scores = defaultdict(float)
+    fragment_scores = defaultdict(lambda: defaultdict(float))
+    sources = {}
+
+    for rank, video_hit in enumerate(lexical_video_hits, start=1):
+        video_id = video_hit["_source"]["video_id"]
+        video_scores[video_id] += 1 / (rrf_k + rank)
+        for frag_rank, hit in enumerate(collapsed_fragment_hits(video_hit), start=1):
+            fragment_scores[video_id][hit["_source"]["fragment_id"]] += 1 / (rrf_k + frag_rank)
+            sources[hit["_source"]["fragment_id"]] = hit["_source"]
+
+    # kNN возвращает фрагменты: ранг видео — по первому его фрагменту, ранг фрагмента — внутри видео
+    video_ranks = {}
+    frag_ranks = defaultdict(int)
+    for hit in knn_hits:
+        video_id = hit["_source"]["video_id"]
+        if video_id not in video_ranks:
+            video_ranks[video_id] = len(video_ranks) + 1
+            video_scores[video_id] += 1 / (rrf_k + video_ranks[video_id])
+        frag_ranks[video_id] += 1
+        fragment_scores[video_id][hit["_source"]["fragment_id"]] += 1 / (rrf_k + frag_ranks[video_id])
+        sources.setdefault(hit["_source"]["fragment_id"], hit["_source"])
+
+    fused = []
+    for video_id in sorted(video_scores, key=lambda vid: (-video_scores[vid], vid)):
+        top = sorted(fragment_scores[video_id].items(), key=lambda item: (-item[1], item[0]))[:max_fragments_per_video]
+        inner = [{"_score": score, "_source": sources[fragment_id]} for fragment_id, score in top]
+        fused.append({
+            "_score": video_scores[video_id],
+            "_source": {"fragment_id": top[0][0], "video_id": video_id},
+            "inner_hits": {"top_fragments": {"hits": {"hits": inner}}}
+        })
+    return fused
+
+async def async_hybrid_search_videos(query, exact=False, tags=None, min_score=1.0,
+                                     max_videos=5, max_fragments_per_video=3, cursor=None, profile=False,
+                                     budget=None):
+    """
+    Гибридный поиск: BM25 со сворачиванием и kNN по векторам фрагментов одним _msearch,
+    затем слияние рангов. Страницы нарезаются из первых SEARCH_HYBRID_WINDOW видео.
+    """
+    offset = decode_cursor(cursor)
+    index = settings.ELASTICSEARCH_INDEX_NAME
+    budget = budget or new_search_budget()
+    try:
+        with timing.span("embed"):
+            query_vector = await asyncio.to_thread(embed_query, query)
+        knn_body = apply_search_limits(build_knn_search_body(query_vector, tags), budget)
+        if profile:
+            knn_body["profile"] = True
+        searches = [
+            {"index": index},
+            build_collapsed_search_body(query, exact, tags, min_score,
+                                        settings.SEARCH_HYBRID_WINDOW, max_fragments_per_video, 0, profile,
+                                        budget=budget),
+            {"index": index},
+            knn_body
+        ]
+        started_at = time.perf_counter()
+        res = await with_budget(get_async_elasticsearch(), budget).msearch(searches=searches)
+        record_es_timing(res, started_at)
+        lexical, knn = res["responses"]
+        for response in (lexical, knn):
+            if "error" in response:
+                raise ElasticsearchException(str(response["error"]))
+        fused = fuse_hybrid(lexical["hits"]["hits"], knn["hits"]["hits"], max_fragments_per_video)
+        partial = is_partial_response(lexical) or is_partial_response(knn)
+        if partial:
+            count_overrun("es")
+    except ConnectionTimeout:
+        count_overrun("es")
+        logger.warning(f"Hybrid search '{query}' exceeded its latency budget waiting for Elasticsearch")
+        return empty_partial_page()
+    except Exception as e:
+        logger.error(f"Error in async_hybrid_search_videos: {e}", exc_info=True)
+        raise e
+
+    video_hits = fused[offset:offset + max_videos]
+    next_offset = offset + len(video_hits)
+    return {
+        "video_hits": video_hits,
+        "total_videos": len(fused),
+        "next_cursor": encode_cursor(next_offset) if next_offset < len(fused) else None,
+        "profile": {"lexical": lexical.get("profile"), "knn": knn.get("profile")} if profile else None,
+        "stage": None,
+        "partial": partial
+    }
+
+async def async_search_videos_collapsed(query, exact=False, tags=None, min_score=1.0,
+                                        max_videos=5, max_fragments_per_video=3, cursor=None, mode=None,
+                                        profile=False, budget=None):
+    # Точный поиск — только совпадение фразы, перефразы из kNN в него не подмешиваются
+    if resolve_search_mode(mode) == "hybrid" and not exact:
+        return await async_hybrid_search_videos(query, exact, tags, min_score,
+                                                max_videos, max_fragments_per_video, cursor, profile, budget)
+    offset, cursor_stage = decode_cursor_state(cursor)
+    budget = budget or new_search_budget()
+    if is_local_backend():
+        # Встроенный движок работает в процессе и блокирует, поэтому выносится в пул потоков
+        return await asyncio.to_thread(local_search_videos_collapsed, query, exact, tags, min_score,
+                                       max_videos, max_fragments_per_video, offset)
+    try:
+        language = detect_query_language(query)
+        stages = plan_stages(exact, cursor_stage)
+        for i, stage in enumerate(stages):
+            search_body = build_collapsed_search_body(query, exact, tags, min_score,
+                                                      max_videos, max_fragments_per_video, offset, profile,
+                                                      stage=stage, language=language, budget=budget)
+            started_at = time.perf_counter()
+            res = await with_budget(get_async_elasticsearch(), budget).search(
+                index=settings.ELASTICSEARCH_INDEX_NAME, body=search_body)
+            record_es_timing(res, started_at)
+            page = accept_stage(query, stage, res, started_at, i == len(stages) - 1, offset, max_videos, budget)
+            if page is not None:
+                return page
+    except ConnectionTimeout:
+        count_overrun("es")
+        logger.warning(f"Search '{query}' exceeded its latency budget waiting for Elasticsearch")
+        return empty_partial_page()
+    except Exception as e:
+        logger.error(f"Error in async_search_videos_collapsed: {e}", exc_info=True)
+        raise e
+
+VIDEO_COLUMNS = (Video.id, Video.name, Video.description, Video.s3_url)
+
+async def async_hydrate_fragments(db, video_hits):
+    """
+    Асинхронная гидратация: фрагменты одним запросом к БД, видео из _source попаданий;
+    из БД дочитываются только видео, которых нет в _source
+    """
+    fragment_ids = collapsed_fragment_ids(video_hits)
+    if not fragment_ids:
+        return {}, {}
+    metrics.inc("search_db_hydrations_total", help_text="Search result hydrations that queried the database")
+    with timing.span("db"):
+        return await _async_hydrate_fragments(db, fragment_ids, videos_from_source(video_hits))
+
+async def _async_hydrate_fragments(db, fragment_ids, videos_by_id):
+    rows = (await db.execute(
+        select(Fragment.id, Fragment.video_id, Fragment.text, Fragment.timecode_start,
+               Fragment.timecode_end, Fragment.s3_url, Fragment.thumbnail_url, Fragment.renditions).where(Fragment.id.in_(list(set(fragment_ids))))
+    )).all()
+    fragments_by_id = {row.id: row for row in rows}
+
+    missing = [video_id for video_id in {row.video_id for row in rows} if video_id not in videos_by_id]
+    if missing:
+        for row in (await db.execute(select(*VIDEO_COLUMNS).where(Video.id.in_(missing)))).all():
+            videos_by_id[row.id] = row
+    return fragments_by_id, videos_by_id
+
+async def async_sign_urls(s3_keys, expiration=3600, timeout=None):
+    """
+    Подписывает уникальные ключи параллельно в пуле потоков.
+    С timeout возвращает только ключи, подписанные к сроку.
+    """
+    keys = [key for key in set(s3_keys) if key and not is_hls_key(key)]
+    if not keys:
+        return {}
+    with timing.span("sign"):
+        tasks = {asyncio.ensure_future(asyncio.to_thread(generate_presigned_url, key, expiration)): key for key in keys}
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    signed = {}
+    for task in done:
+        if task.exception():
+            logger.error(f"Error signing {tasks[task]}: {task.exception()}")
+        else:
+            signed[tasks[task]] = task.result()
+    return signed
+
+def assemble_collapsed_results(video_hits, fragments_by_id, videos_by_id, signed_urls):
+    """Собирает SearchResult в порядке, который вернул Elasticsearch"""
+    results = []
+    for video_hit in video_hits:
+        fragments = []
+        video = None
+        for hit in collapsed_fragment_hits(video_hit):
+            frag = fragments_by_id.get(hit["_source"]["fragment_id"])
+            if not frag or frag.video_id not in videos_by_id:
+                continue
+            video = videos_by_id[frag.video_id]
+            fragments.append(SearchFragment(
+                fragment_id=str(frag.id),
+                text=frag.text,
+                timecode_start=frag.timecode_start,
+                timecode_end=frag.timecode_end,
+                s3_url=fragment_media_url(frag.id, frag.s3_url, signed_urls),
+                thumbnail_url=signed_urls.get(frag.thumbnail_url),
+                renditions=fragment_rendition_urls(frag.id, frag.renditions, signed_urls),
+                score=hit["_score"]
+            ))
+        if not fragments:
+            continue
+        results.append(SearchResult(
+            video=VideoInfo(
+                video_id=str(video.id),
+                name=video.name,
+                description=video.description,
+                s3_url=signed_urls.get(video.s3_url, "")
+            ),
+            fragments=fragments,
+            fragments_count=len(fragments)
+        ))
+    return results
+
 def assemble_search_results(hits, fragments, results_per_video=2):
     frag_dict = {str(f.id): f for f in fragments}
     videos = {}
@@ -0,0 +1,12 @@
+from worker.celery_app import celery_app
+from services.indexing_service import drain_search_outbox_until_empty
+from core.logger import logger
+
+@celery_app.task(name="tasks.indexing_task.drain_search_outbox_task", ignore_result=True)
+def drain_search_outbox_task():
+    """Переносит накопившиеся изменения фрагментов из outbox в поисковый индекс"""
+    try:
+        return drain_search_outbox_until_empty()
+    except Exception as e:
+        logger.error(f"Search outbox drain failed: {e}", exc_info=True)
+        raise e
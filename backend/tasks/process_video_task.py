@@ -1,46 +1,82 @@
+from celery import states
+from celery.exceptions import Ignore
 from worker.celery_app import celery_app
 from core.logger import logger
 from db.base import SessionLocal
 from db.repositories.video_repository import VideoRepository
 from schemas.upload import UploadStatus
 from utils.video_processing import SmartVideoFragmenter
-from utils.s3_utils import upload_file_to_s3
+from utils.s3_utils import upload_file_to_s3, download_file_from_s3
+from core.config import settings
 from utils.retry_utils import retry_task
+from utils.temp_storage import temp_storage
+from utils.renditions import primary_rendition
 import os
-import shutil
 import time
 from services.processing_service import VideoProcessor
+from tasks.indexing_task import drain_search_outbox_task
 
-@celery_app.task(name="tasks.process_video_task.process_video_task", bind=True, soft_time_limit=21600, time_limit=43200)
-def process_video_task(self, video_id: int, temp_file_path: str, original_filename: str):
+def original_video_key(original_filename: str) -> str:
+    """Ключ оригинала видео в S3"""
+    return f"videos/{os.path.splitext(original_filename)[0]}"
+
+PROCESSING_SOFT_TIME_LIMIT = 21600
+
+@celery_app.task(name="tasks.process_video_task.process_video_task", bind=True,
+                 soft_time_limit=PROCESSING_SOFT_TIME_LIMIT, time_limit=43200)
+def process_video_task(self, video_id: int, temp_file_path: str, original_filename: str, s3_key: str = None):
     """
     Обработка видео с увеличенным лимитом времени выполнения.
     soft_time_limit: 6 часов
     time_limit: 12 часов
+    s3_key: оригинал уже загружен в S3 при приеме запроса, этап загрузки пропускается;
+    без temp_file_path (загрузка клиентом прямо в S3) или если временный файл потерян, оригинал скачивается.
+    Все временные файлы задачи лежат в ее каталоге временного хранилища; каталог арендован на время обработки.
     """
+    job_id = temp_file_path and temp_storage.job_of(temp_file_path)
     try:
         logger.info("Начало обработки видео задачи")
+        if not job_id:
+            job_id = temp_storage.new_job_id()
+        # Аренда на весь срок задачи: очистка не удалит файлы, пока идет обработка
+        temp_storage.acquire(job_id, lease_seconds=PROCESSING_SOFT_TIME_LIMIT)
+        if s3_key and not (temp_file_path and os.path.exists(temp_file_path)):
+            temp_file_path = temp_storage.job_path(job_id, original_filename)
+            self.update_state(state='PROGRESS', meta={'progress': 5, 'current_operation': 'Скачивание оригинального видео'})
+            logger.info(f"Скачивание оригинального видео из S3 с ключом: {s3_key}")
+            download_file_from_s3(s3_key, temp_file_path)
         # Проверяем наличие файла
         if not os.path.exists(temp_file_path):
-            logger.error(f"Файл {temp_file_path} не найден")
-            raise FileNotFoundError(f"Файл {temp_file_path} не найден")
+            # Оригинала в S3 нет, восстановить файл неоткуда: повтор задачи не поможет
+            error = (f"Входной файл {temp_file_path} не найден и оригинала в S3 нет; "
+                     f"видео нужно загрузить заново")
+            logger.error(error)
+            with SessionLocal() as session:
+                VideoRepository(session).update_video_status(video_id, UploadStatus.failed)
+                session.commit()
+            temp_storage.release(job_id, delete=True)
+            self.update_state(state=states.FAILURE, meta={
+                "exc_type": "FileNotFoundError", "exc_module": "builtins", "exc_message": [error]})
+            raise Ignore()
             
         # Проверяем размер файла
         file_size = os.path.getsize(temp_file_path)
         logger.info(f"Размер файла для обработки: {file_size / (1024*1024):.2f} МБ")
         
-        video_name = os.path.splitext(original_filename)[0]
-        s3_key = f"videos/{video_name}"
-        
-        # Обновление состояния: загрузка видео
-        self.update_state(state='PROGRESS', meta={'progress': 5, 'current_operation': 'Загрузка оригинального видео'})
-        logger.info(f"Загрузка оригинального видео в S3 с ключом: {s3_key}")
-        
-        # Используем многопоточную загрузку для больших файлов
-        start_time = time.time()
-        s3_url = upload_file_to_s3(temp_file_path, s3_key, use_multipart=True)
-        upload_time = time.time() - start_time
-        logger.info(f"Загрузка в S3 завершена за {upload_time:.2f} секунд")
+        if s3_key:
+            logger.info(f"Оригинальное видео уже загружено в S3 с ключом: {s3_key}")
+        else:
+            s3_key = original_video_key(original_filename)
+            
+            # Обновление состояния: загрузка видео
+            self.update_state(state='PROGRESS', meta={'progress': 5, 'current_operation': 'Загрузка оригинального видео'})
+            logger.info(f"Загрузка оригинального видео в S3 с ключом: {s3_key}")
+            
+            # Используем многопоточную загрузку для больших файлов
+            start_time = time.time()
+            upload_file_to_s3(temp_file_path, s3_key, use_multipart=True)
+            upload_time = time.time() - start_time
+            logger.info(f"Загрузка в S3 завершена за {upload_time:.2f} секунд")
 
         # Обновление базы данных
         with SessionLocal() as session:
@@ -56,36 +92,8 @@ def process_video_task(self, video_id: int, temp_file_path: str, original_filena
         self.update_state(state='PROGRESS', meta={'progress': 10, 'current_operation': 'Разбиение видео на фрагменты'})
         logger.info("Начинается извлечение субтитров")
         
-        # Проверяем свободное место перед обработкой
-        disk_usage = shutil.disk_usage(os.path.dirname(temp_file_path))
-        free_space = disk_usage.free
-        required_space = file_size * 1.5  # 150% от размера файла для безопасной обработки
-        
-        if free_space < required_space:
-            logger.warning(f"Недостаточно места на диске. Доступно: {free_space}, требуется: {required_space}")
-            # Попробуем освободить место, удалив временные файлы
-            temp_dir = os.path.dirname(temp_file_path)
-            for f in os.listdir(temp_dir):
-                if f != os.path.basename(temp_file_path):  # Не удаляем текущий файл
-                    try:
-                        file_path = os.path.join(temp_dir, f)
-                        if os.path.isfile(file_path):
-                            os.remove(file_path)
-                            logger.info(f"Удален временный файл для освобождения места: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при удалении временного файла {f}: {str(e)}")
-            
-            # Проверяем еще раз после очистки
-            disk_usage = shutil.disk_usage(os.path.dirname(temp_file_path))
-            free_space = disk_usage.free
-            
-            if free_space < required_space:
-                logger.error("Недостаточно места на диске даже после очистки временных файлов")
-                with SessionLocal() as session:
-                    repo = VideoRepository(session)
-                    repo.update_video_status(video_id, UploadStatus.failed)
-                    session.commit()
-                raise OSError("Недостаточно места на диске для обработки видео")
+        # Резерв места под промежуточные файлы; при нехватке удаляются только неиспользуемые файлы других задач
+        temp_storage.reserve(job_id, file_size, lease_seconds=PROCESSING_SOFT_TIME_LIMIT)
         
         fragmenter = SmartVideoFragmenter()
         fragments = fragmenter.process_video(self, temp_file_path)
@@ -102,71 +110,91 @@ def process_video_task(self, video_id: int, temp_file_path: str, original_filena
             frag.end_time += time_margin
 
         total = len(fragments)
-        temp_dir = os.path.dirname(temp_file_path)
+        temp_dir = temp_storage.job_dir(job_id)
         video_processor = VideoProcessor()
         
-        # Обработка фрагментов с промежуточной очисткой диска
+        # Обработка фрагментов
         processed_fragments = []
-        for idx, frag in enumerate(fragments, start=1):
-            prog = 65 + int((idx / total) * 34)
-            self.update_state(state='PROGRESS', meta={'progress': prog, 'current_operation': f'Обработка фрагмента {idx}/{total}'})
-            logger.info(
-                f"Фрагмент {idx}: start={frag.start_time}, end={frag.end_time}, "
-                f"text (начало)='{frag.text[:30]}...'"
-            )
-            
-            # При обработке каждого 5-го фрагмента проверяем место на диске
-            if idx % 5 == 0:
-                free_space = shutil.disk_usage(temp_dir).free
-                if free_space < 1024 * 1024 * 1024:  # Если места меньше 1 ГБ
-                    logger.warning("Низкий уровень свободного места, очистка временных файлов...")
-                    # Очищаем временные файлы (кроме текущего обрабатываемого)
-                    for f in os.listdir(temp_dir):
-                        if f != os.path.basename(temp_file_path):
-                            try:
-                                file_path = os.path.join(temp_dir, f)
-                                if os.path.isfile(file_path) and not file_path.endswith(".processing"):
-                                    os.remove(file_path)
-                            except Exception as e:
-                                logger.error(f"Ошибка при удалении временного файла {f}: {str(e)}")
+        if settings.FRAGMENT_OUTPUT_MODE == "hls":
+            # Один транскод на все видео, фрагмент — отрезок общего плейлиста
+            self.update_state(state='PROGRESS', meta={'progress': 65, 'current_operation': 'Транскодирование видео в HLS'})
+            playlist = retry_task(lambda: video_processor.transcode_and_upload_hls(temp_file_path, temp_dir, video_id), retries=3)
+            for frag in fragments:
+                frag.s3_url = playlist
+            processed_fragments = fragments
+        else:
+            # Варианты нарезаются из одного декодирования отрезка; основной вариант — s3_url фрагмента
+            renditions = video_processor.fragment_renditions(temp_file_path)
+            primary = primary_rendition(renditions)
+            logger.info(f"Варианты фрагментов: {renditions}")
+            for idx, frag in enumerate(fragments, start=1):
+                prog = 65 + int((idx / total) * 34)
+                self.update_state(state='PROGRESS', meta={'progress': prog, 'current_operation': f'Обработка фрагмента {idx}/{total}'})
+                logger.info(
+                    f"Фрагмент {idx}: start={frag.start_time}, end={frag.end_time}, "
+                    f"text (начало)='{frag.text[:30]}...'"
+                )
             
+                try:
+                    keys = retry_task(lambda: video_processor.process_and_upload_fragment(temp_file_path, temp_dir, frag, renditions), retries=3)
+                    if not keys:
+                        logger.error(f"Фрагмент {idx} пропущен: файлы не созданы")
+                        continue
+                    frag.s3_url = keys[primary]
+                    frag.renditions = keys
+                    processed_fragments.append(frag)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке фрагмента {idx}: {str(e)}")
+                    # Продолжаем с другими фрагментами, если один не удался
+                    continue
+
+        # Миниатюры фрагментов и спрайт перемотки одним проходом ffmpeg; без них видео все равно доступно
+        sprite = None
+        if settings.PREVIEWS_ENABLED and processed_fragments:
+            self.update_state(state='PROGRESS', meta={'progress': 99, 'current_operation': 'Генерация превью'})
             try:
-                s3_url = retry_task(lambda: video_processor.process_and_upload_fragment(temp_file_path, temp_dir, frag), retries=3)
-                frag.s3_url = s3_url
-                processed_fragments.append(frag)
+                duration = fragmenter.get_video_duration(temp_file_path)
+                sprite = video_processor.generate_and_upload_previews(temp_file_path, temp_dir, video_id,
+                                                                      processed_fragments, duration)
             except Exception as e:
-                logger.error(f"Ошибка при обработке фрагмента {idx}: {str(e)}")
-                # Продолжаем с другими фрагментами, если один не удался
-                continue
+                logger.error(f"Ошибка при генерации превью видео {video_id}: {str(e)}")
 
         # Сохранение фрагментов в базу данных
         with SessionLocal() as session:
             repo = VideoRepository(session)
             repo.save_fragments(video_id, processed_fragments)
+            if sprite:
+                repo.update_video(video_id, sprite=sprite)
             repo.update_video_status(video_id, UploadStatus.completed)
             session.commit()
+        # Не ждем планового запуска индексатора: фрагменты уже в outbox
+        drain_search_outbox_task.delay()
 
-        # Очистка временного файла после успешной обработки
+        # Очистка каталога задачи после успешной обработки
         try:
-            if os.path.exists(temp_file_path):
+            temp_storage.release(job_id, delete=True)
+            if temp_storage.job_of(temp_file_path) != job_id and os.path.exists(temp_file_path):
+                # Файл, принятый до перехода на каталоги задач
                 os.remove(temp_file_path)
-                logger.info(f"Удален временный файл: {temp_file_path}")
+            logger.info(f"Удалены временные файлы задачи {job_id}")
         except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла {temp_file_path}: {str(e)}")
+            logger.error(f"Ошибка при удалении временных файлов задачи {job_id}: {str(e)}")
 
         logger.info("Обработка видео завершена успешно")
         return {"status": "success", "video_id": video_id}
 
+    except Ignore:
+        raise
     except Exception as e:
         logger.error(f"Ошибка обработки видео: {e}", exc_info=True)
         with SessionLocal() as session:
             repo = VideoRepository(session)
             repo.update_video_status(video_id, UploadStatus.failed)
             session.commit()
-        # Очистка при ошибке
+        # Входной файл остается для повторного запуска, пока его не вытеснит очистка
         try:
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-        except:
-            pass
+            if job_id:
+                temp_storage.release(job_id)
+        except Exception as release_error:
+            logger.error(f"Ошибка при снятии аренды временных файлов задачи {job_id}: {str(release_error)}")
         raise e
@@ -1,11 +1,11 @@
 from worker.celery_app import celery_app
-from services.search_service import search_in_elasticsearch, assemble_search_results, get_fragments_with_videos
+from services.search_service import search_fragments, assemble_search_results, get_fragments_with_videos
 from db.base import SessionLocal
 from core.logger import logger
 from core.exceptions import DatabaseError, ElasticsearchException
 
 def _search(query, exact=False, tags=None, results_per_video=2, min_score=1.0):
-    hits = search_in_elasticsearch(query, exact, tags, min_score)
+    hits = search_fragments(query, exact, tags, min_score)
     if not hits:
         return {"status": "success", "results": []}
     fragment_ids = [hit["_source"]["fragment_id"] for hit in hits]
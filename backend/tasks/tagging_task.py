@@ -0,0 +1,12 @@
+from worker.celery_app import celery_app
+from services.keyword_service import retag_corpus
+from core.logger import logger
+
+@celery_app.task(name="tasks.tagging_task.retag_fragments_task", ignore_result=True)
+def retag_fragments_task():
+    """Пересчитывает частоты слов корпуса и теги всех фрагментов"""
+    try:
+        return retag_corpus()
+    except Exception as e:
+        logger.error(f"Fragment re-tagging failed: {e}", exc_info=True)
+        raise e
@@ -0,0 +1,49 @@
+import os
+from datetime import datetime, timedelta, timezone
+from worker.celery_app import celery_app
+from db.base import SessionLocal
+from db.models.upload_session import UploadSessionStatus, UploadSessionMode
+from db.repositories.upload_repository import UploadSessionRepository
+from utils.s3_utils import abort_multipart_upload
+from utils.temp_storage import temp_storage
+from core.config import settings
+from core.logger import logger
+
+def release_session_storage(session):
+    """Освобождает хранилище отмененной сессии: multipart-загрузку S3 или каталог временного файла"""
+    if session.mode == UploadSessionMode.direct:
+        abort_multipart_upload(session.s3_key, session.s3_upload_id)
+    elif session.temp_path and temp_storage.job_of(session.temp_path):
+        temp_storage.release(temp_storage.job_of(session.temp_path), delete=True)
+    elif session.temp_path and os.path.exists(session.temp_path):
+        os.remove(session.temp_path)
+
+@celery_app.task(name="tasks.upload_cleanup_task.expire_upload_sessions_task", ignore_result=True)
+def expire_upload_sessions_task():
+    """
+    Отменяет брошенные сессии загрузки: без новых кусков дольше UPLOAD_SESSION_TTL_SECONDS.
+    Незавершенные multipart-загрузки S3 иначе хранят части бессрочно, а куски — место на временном диске.
+    Завершенные и отмененные сессии старше того же срока удаляются из БД.
+    """
+    before = datetime.now(timezone.utc) - timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+    expired = 0
+    with SessionLocal() as db:
+        repo = UploadSessionRepository(db)
+        for upload_id in repo.get_expired_session_ids(before):
+            session = repo.get_session(upload_id, for_update=True)
+            # Клиент мог прислать кусок или завершить загрузку после выборки
+            if not session or session.status != UploadSessionStatus.open or session.updated_at >= before:
+                db.commit()
+                continue
+            session.status = UploadSessionStatus.aborted
+            db.commit()
+            try:
+                release_session_storage(session)
+            except Exception as e:
+                logger.error(f"Не удалось освободить хранилище сессии загрузки {upload_id}: {str(e)}")
+            expired += 1
+        deleted = repo.delete_closed_sessions(before)
+        db.commit()
+    if expired or deleted:
+        logger.info(f"Сессии загрузки: отменено брошенных {expired}, удалено закрытых {deleted}")
+    return {"expired": expired, "deleted": deleted}
@@ -0,0 +1,83 @@
+import pytest
+from core.config import settings
+from utils import bulk_indexer
+from utils.bulk_indexer import bulk_index
+
+def action(doc_id):
+    return {"_index": "fragments", "_id": doc_id, "_source": {"fragment_id": doc_id}}
+
+class FakeBulk:
+    """streaming_bulk, отвечающий по статусам: {_id: [статус первой попытки, второй, ...]}, по умолчанию 201"""
+
+    def __init__(self, statuses=None, error=None):
+        self.statuses = {doc_id: list(codes) for doc_id, codes in (statuses or {}).items()}
+        self.error = error
+        self.batches = []
+
+    def __call__(self, es, actions, **kwargs):
+        self.batches.append([a["_id"] for a in actions])
+        if self.error:
+            raise self.error
+        for a in actions:
+            codes = self.statuses.get(a["_id"])
+            status = codes.pop(0) if codes else 201
+            yield status < 300, {"index": {"_id": a["_id"], "status": status}}
+
+class FakeIndices:
+    def __init__(self):
+        self.settings = {"fragments_v1": {"refresh_interval": "5s", "number_of_replicas": "2"}}
+        self.refreshed = []
+
+    def get_settings(self, index):
+        return {name: {"settings": {"index": dict(values)}} for name, values in self.settings.items()}
+
+    def put_settings(self, index, body):
+        self.settings[index].update(body["index"])
+
+    def refresh(self, index):
+        self.refreshed.append(index)
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.indices = FakeIndices()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(bulk_indexer.time, "sleep", delays.append)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_BULK_THREADS", 1)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_BULK_INITIAL_BACKOFF", 1.0)
+    return delays
+
+def install(monkeypatch, fake):
+    monkeypatch.setattr(bulk_indexer.helpers, "streaming_bulk", fake)
+    return fake
+
+def test_rejected_and_server_errors_are_retried_with_backoff(monkeypatch, sleeps):
+    fake = install(monkeypatch, FakeBulk({1: [429, 503], 2: [500]}))
+    report = bulk_index(FakeElasticsearch(), [action(1), action(2), action(3)], large_load=False, max_retries=3)
+    assert fake.batches == [[1, 2, 3], [1, 2], [1]]
+    assert sleeps == [1.0, 2.0]
+    assert (report.indexed, report.retried, report.failed) == (3, 3, [])
+
+def test_client_errors_fail_without_retry(monkeypatch, sleeps):
+    fake = install(monkeypatch, FakeBulk({1: [400], 2: [404]}))
+    report = bulk_index(FakeElasticsearch(), [action(1), action(2), action(3)], large_load=False)
+    assert fake.batches == [[1, 2, 3]]
+    assert sleeps == []
+    assert report.indexed == 1
+    assert [(item["_id"], item["status"]) for item in report.failed] == [(1, 400), (2, 404)]
+
+def test_exhausted_retries_are_reported(monkeypatch, sleeps):
+    install(monkeypatch, FakeBulk({1: [503, 503, 503]}))
+    report = bulk_index(FakeElasticsearch(), [action(1)], large_load=False, max_retries=2)
+    assert report.failed == [{"_id": 1, "error": "retries exhausted"}]
+    assert sleeps == [1.0, 2.0]
+
+def test_index_settings_restored_when_bulk_raises(monkeypatch, sleeps):
+    install(monkeypatch, FakeBulk(error=RuntimeError("connection lost")))
+    es = FakeElasticsearch()
+    with pytest.raises(RuntimeError):
+        bulk_index(es, [action(1)], large_load=True)
+    assert es.indices.settings["fragments_v1"] == {"refresh_interval": "5s", "number_of_replicas": "2"}
+    assert es.indices.refreshed == ["fragments"]
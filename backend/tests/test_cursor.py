@@ -0,0 +1,25 @@
+import pytest
+from services.search_service import encode_cursor, decode_cursor, decode_cursor_state
+
+def test_round_trip_keeps_offset_and_stage():
+    assert decode_cursor_state(encode_cursor(10, "term")) == (10, "term")
+    assert decode_cursor_state(encode_cursor(5)) == (5, None)
+    assert decode_cursor(encode_cursor(20, "fuzzy")) == 20
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor(123456, "fuzzy")
+    assert "=" not in cursor
+    assert all(c.isalnum() or c in "-_" for c in cursor)
+
+def test_empty_cursor_is_first_page():
+    assert decode_cursor_state(None) == (0, None)
+    assert decode_cursor_state("") == (0, None)
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    encode_cursor(-1),
+    encode_cursor(0, "unknown-stage"),
+])
+def test_invalid_cursor_raises(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor_state(cursor)
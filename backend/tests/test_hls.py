@@ -0,0 +1,55 @@
+from utils.hls import parse_media_playlist, build_fragment_playlist, segments_for_range, resolve_uri, is_hls_key
+
+PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:0
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXT-X-INDEPENDENT-SEGMENTS
+#EXT-X-MAP:URI="video.mp4",BYTERANGE="800@0"
+#EXTINF:6.000000,
+#EXT-X-BYTERANGE:1000@800
+video.mp4
+#EXTINF:6.000000,
+#EXT-X-BYTERANGE:1200
+video.mp4
+#EXTINF:3.500000,
+#EXT-X-BYTERANGE:500
+video.mp4
+#EXT-X-ENDLIST
+"""
+
+def test_parse_resolves_implicit_byterange_offsets():
+    playlist = parse_media_playlist(PLAYLIST)
+    assert playlist.header == ["#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:6", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    assert (playlist.map_uri, playlist.map_byterange) == ("video.mp4", "800@0")
+    assert [(s.start, s.duration, s.byterange) for s in playlist.segments] == [
+        (0.0, 6.0, "1000@800"), (6.0, 6.0, "1200@1800"), (12.0, 3.5, "500@3000")]
+
+def test_segments_for_range_selects_overlapping_segments():
+    playlist = parse_media_playlist(PLAYLIST)
+    assert [s.start for s in segments_for_range(playlist, 7.0, 13.0)] == [6.0, 12.0]
+    assert [s.start for s in segments_for_range(playlist, 6.0, 12.0)] == [6.0]
+
+def test_fragment_playlist_contains_only_its_segments():
+    playlist = parse_media_playlist(PLAYLIST)
+    text = build_fragment_playlist(playlist, 7.5, 11.0, lambda uri: f"https://s3/{uri}?sig")
+    lines = text.splitlines()
+    assert lines[0] == "#EXTM3U"
+    assert "#EXT-X-PLAYLIST-TYPE:VOD" in lines
+    assert "#EXT-X-START:TIME-OFFSET=1.500,PRECISE=YES" in lines
+    assert '#EXT-X-MAP:URI="https://s3/video.mp4?sig",BYTERANGE="800@0"' in lines
+    assert lines.count("#EXTINF:6.000000,") == 1
+    assert "#EXT-X-BYTERANGE:1200@1800" in lines
+    assert lines[-1] == "#EXT-X-ENDLIST"
+
+def test_fragment_playlist_round_trips_through_parser():
+    playlist = parse_media_playlist(PLAYLIST)
+    rebuilt = parse_media_playlist(build_fragment_playlist(playlist, 0.0, 20.0, lambda uri: uri))
+    assert rebuilt.segments == playlist.segments
+
+def test_keys():
+    assert is_hls_key("hls/5/index.m3u8")
+    assert not is_hls_key("fragments/5.mp4")
+    assert not is_hls_key(None)
+    assert resolve_uri("hls/5/index.m3u8", "video.mp4") == "hls/5/video.mp4"
@@ -0,0 +1,44 @@
+import pytest
+from services.search_service import fuse_hybrid
+
+RRF_K = 60
+
+def fragment(fragment_id, video_id):
+    return {"_source": {"fragment_id": fragment_id, "video_id": video_id}}
+
+def collapsed(video_id, fragment_ids):
+    return {
+        "_source": {"fragment_id": fragment_ids[0], "video_id": video_id},
+        "inner_hits": {"top_fragments": {"hits": {"hits": [fragment(fid, video_id) for fid in fragment_ids]}}},
+    }
+
+def fused_fragment_ids(video_hit):
+    return [hit["_source"]["fragment_id"] for hit in video_hit["inner_hits"]["top_fragments"]["hits"]["hits"]]
+
+def test_lexical_only_keeps_order_and_shape():
+    fused = fuse_hybrid([collapsed(1, [10, 11]), collapsed(2, [20])], [], max_fragments_per_video=3, rrf_k=RRF_K)
+    assert [hit["_source"]["video_id"] for hit in fused] == [1, 2]
+    assert fused[0]["_score"] == pytest.approx(1 / (RRF_K + 1))
+    assert fused_fragment_ids(fused[0]) == [10, 11]
+    assert fused[0]["_source"]["fragment_id"] == 10
+
+def test_video_found_by_both_rankings_wins():
+    lexical = [collapsed(1, [10]), collapsed(2, [20])]
+    knn = [fragment(21, 2), fragment(30, 3)]
+    fused = fuse_hybrid(lexical, knn, max_fragments_per_video=3, rrf_k=RRF_K)
+    assert [hit["_source"]["video_id"] for hit in fused] == [2, 1, 3]
+    assert fused[0]["_score"] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+
+def test_fragment_scores_add_up_within_video():
+    lexical = [collapsed(1, [10, 11])]
+    knn = [fragment(11, 1), fragment(12, 1)]
+    fused = fuse_hybrid(lexical, knn, max_fragments_per_video=2, rrf_k=RRF_K)
+    assert fused_fragment_ids(fused[0]) == [11, 10]
+    scores = [hit["_score"] for hit in fused[0]["inner_hits"]["top_fragments"]["hits"]["hits"]]
+    assert scores[0] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+
+def test_ties_break_by_id():
+    fused = fuse_hybrid([], [fragment(50, 5), fragment(40, 4)], max_fragments_per_video=1, rrf_k=RRF_K)
+    assert [hit["_source"]["video_id"] for hit in fused] == [5, 4]
+    fused = fuse_hybrid([collapsed(4, [40])], [fragment(50, 5)], max_fragments_per_video=1, rrf_k=RRF_K)
+    assert [hit["_source"]["video_id"] for hit in fused] == [4, 5]
@@ -0,0 +1,130 @@
+import datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from core.config import settings
+from db.models.search_outbox import SearchOutbox
+from utils import index_migration
+from utils.index_migration import language_filter, migrate_to_language_indices, replay_outbox
+from utils.index_profiles import INDEX_PROFILES, build_index_body, search_fields
+
+@pytest.fixture(autouse=True)
+def defaults(monkeypatch):
+    monkeypatch.setattr(settings, "VIDEO_DEFAULT_LANGUAGE", "en")
+    monkeypatch.setattr(settings, "SEARCH_VECTOR_ENABLED", False)
+
+def test_language_filter_default_language_takes_unknown():
+    assert language_filter("ru") == {"term": {"language": "ru"}}
+    # Язык по умолчанию забирает все, что не попало в другие языковые индексы
+    assert language_filter("en") == {"bool": {"must_not": [{"terms": {"language": ["ru"]}}]}}
+
+def test_language_index_body_has_single_stemmed_subfield():
+    properties = build_index_body(INDEX_PROFILES["compact"], "ru")["mappings"]["properties"]
+    fields = properties["text"]["fields"]
+    assert fields["stemmed"]["analyzer"] == "ru_fuzzy"
+    assert "en_fuzzy" not in fields and "ru_fuzzy" not in fields
+    assert "suggest_ru" in properties and "suggest_en" not in properties
+    assert search_fields(INDEX_PROFILES["compact"], "ru", "per_language")[0] == "text.stemmed^3"
+
+class FakeIndices:
+    def __init__(self, calls, counts):
+        self.calls = calls
+        self.counts = counts
+
+    def exists_alias(self, name):
+        return False
+
+    def exists(self, index):
+        return index == "fragments"
+
+    def put_settings(self, index, body):
+        self.calls.append(("write_block", index, body["index"]["blocks"]["write"]))
+
+    def create(self, index, body):
+        self.calls.append(("create", index))
+
+    def clone(self, index, target):
+        self.calls.append(("clone", index, target))
+
+    def update_aliases(self, body):
+        self.calls.append(("aliases", body["actions"]))
+
+class FakeElasticsearch:
+    def __init__(self, counts):
+        self.calls = []
+        self.counts = counts
+        self.indices = FakeIndices(self.calls, counts)
+
+    def reindex(self, body, **kwargs):
+        self.calls.append(("reindex", body["dest"]["index"], body["source"]["query"]))
+        return {"created": self.counts[body["dest"]["index"]]}
+
+    def count(self, index):
+        return {"count": self.counts[index]}
+
+@pytest.fixture
+def migration(monkeypatch):
+    """Запускает миграцию на FakeElasticsearch; возвращает (run, clients, replays)"""
+    clients, replays = [], []
+    monkeypatch.setattr(index_migration, "db_now", lambda: "blocked-at")
+    monkeypatch.setattr(index_migration, "replay_outbox", lambda since: replays.append(since) or 0)
+
+    def run(counts, **kwargs):
+        clients.append(FakeElasticsearch(counts))
+        monkeypatch.setattr(index_migration, "get_elasticsearch", lambda: clients[-1])
+        migrate_to_language_indices("fragments", INDEX_PROFILES["compact"], **kwargs)
+        return clients[-1].calls
+    return run, clients, replays
+
+def test_migration_blocks_writes_then_swaps_alias(migration):
+    run, _, replays = migration
+    calls = run({"fragments": 5, "fragments_en": 3, "fragments_ru": 2})
+
+    assert calls[0] == ("write_block", "fragments", True)
+    assert [call[:2] for call in calls[1:5]] == [("create", "fragments_en"), ("reindex", "fragments_en"),
+                                                 ("create", "fragments_ru"), ("reindex", "fragments_ru")]
+    assert calls[-1] == ("aliases", [{"remove_index": {"index": "fragments"}},
+                                     {"add": {"index": "fragments_en", "alias": "fragments"}},
+                                     {"add": {"index": "fragments_ru", "alias": "fragments"}}])
+    # Сбрасываются только записи, упавшие после начала блокировки
+    assert replays == ["blocked-at"]
+
+def test_migration_keeps_old_index_as_clone(migration):
+    run, _, _ = migration
+    calls = run({"fragments": 1, "fragments_en": 1, "fragments_ru": 0}, delete_old=False)
+    assert calls[-2] == ("clone", "fragments", "fragments_single")
+    assert calls[-1][1][0] == {"remove_index": {"index": "fragments"}}
+
+def test_migration_count_mismatch_releases_write_block(migration):
+    run, clients, replays = migration
+    with pytest.raises(RuntimeError):
+        run({"fragments": 5, "fragments_en": 3, "fragments_ru": 1})
+    calls = clients[-1].calls
+    assert calls[-1] == ("write_block", "fragments", False)
+    assert not any(call[0] == "aliases" for call in calls)
+    assert replays == []
+
+def test_replay_outbox_resets_only_rows_failed_since_block(monkeypatch):
+    engine = create_engine("sqlite://")
+    SearchOutbox.__table__.create(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(index_migration, "SessionLocal", Session)
+    blocked_at = datetime.datetime(2024, 1, 1, 12, 0)
+    with Session() as db:
+        db.add_all([
+            # Исчерпала попытки до миграции
+            SearchOutbox(id=1, fragment_id=1, operation="upsert", attempts=5, last_error="old",
+                         failed_at=blocked_at - datetime.timedelta(hours=1)),
+            # Упала на заблокированном индексе
+            SearchOutbox(id=2, fragment_id=2, operation="upsert", attempts=3, last_error="blocked",
+                         failed_at=blocked_at + datetime.timedelta(minutes=1)),
+            # Еще не обрабатывалась
+            SearchOutbox(id=3, fragment_id=3, operation="delete", attempts=0),
+        ])
+        db.commit()
+
+    assert replay_outbox(blocked_at) == 1
+
+    with Session() as db:
+        rows = {row.id: (row.attempts, row.last_error) for row in db.query(SearchOutbox)}
+    assert rows == {1: (5, "old"), 2: (0, None), 3: (0, None)}
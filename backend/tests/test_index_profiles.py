@@ -0,0 +1,44 @@
+import pytest
+from core.config import settings
+from utils.index_profiles import (INDEX_PROFILES, build_index_body, get_index_profile, language_field_values,
+                                  search_fields)
+
+@pytest.fixture(autouse=True)
+def no_vectors(monkeypatch):
+    # Без векторного поля маппинг не требует модели эмбеддингов
+    monkeypatch.setattr(settings, "SEARCH_VECTOR_ENABLED", False)
+
+def test_profile_sets_ngram_tokenizer():
+    body = build_index_body(INDEX_PROFILES["compact"])
+    tokenizer = body["settings"]["analysis"]["tokenizer"]["ngram_tokenizer"]
+    assert (tokenizer["type"], tokenizer["min_gram"], tokenizer["max_gram"]) == ("ngram", 3, 5)
+    assert body["settings"]["index.max_ngram_diff"] == 2
+
+def test_edge_profile_has_no_ngram_diff():
+    body = build_index_body(INDEX_PROFILES["edge"])
+    assert body["settings"]["analysis"]["tokenizer"]["ngram_tokenizer"]["type"] == "edge_ngram"
+    assert "index.max_ngram_diff" not in body["settings"]
+
+def test_full_profile_keeps_language_subfields():
+    properties = build_index_body(INDEX_PROFILES["full"])["mappings"]["properties"]
+    assert {"en_fuzzy", "ru_fuzzy", "ngram"} <= set(properties["text"]["fields"])
+    assert "text_en" not in properties
+    assert search_fields(INDEX_PROFILES["full"], "ru", "single") == ["text.ru_fuzzy^3", "text.ngram^2", "text"]
+
+def test_language_profile_uses_top_level_fields():
+    profile = INDEX_PROFILES["language"]
+    properties = build_index_body(profile)["mappings"]["properties"]
+    assert "en_fuzzy" not in properties["text"]["fields"]
+    assert properties["text_en"]["analyzer"] == "en_fuzzy"
+    assert properties["text_ru"]["analyzer"] == "ru_fuzzy"
+    assert search_fields(profile, "en", "single") == ["text_en^3", "text.ngram^2", "text"]
+    assert language_field_values(profile, "ru", "привет", "single") == {"text_ru": "привет"}
+    assert language_field_values(INDEX_PROFILES["full"], "ru", "привет", "single") == {}
+
+def test_unknown_language_falls_back_to_default(monkeypatch):
+    monkeypatch.setattr(settings, "VIDEO_DEFAULT_LANGUAGE", "en")
+    assert search_fields(INDEX_PROFILES["full"], "de", "single")[0] == "text.en_fuzzy^3"
+
+def test_unknown_profile_raises():
+    with pytest.raises(ValueError):
+        get_index_profile("missing")
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from core.config import settings
+from services import keyword_service
+from services.keyword_service import compute_tags, tag_fragments
+
+IDF = {"video": 0.0, "neuron": 3.0, "network": 2.0, "gradient": 2.0, "descent": 1.5, "layer": 1.0}
+
+@pytest.fixture(autouse=True)
+def corpus(monkeypatch):
+    """IDF задан словарем вместо таблиц частот; стоп-слова — без корпуса NLTK"""
+    def idf_vector(db, vocabulary):
+        idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for (_, term), column in vocabulary.items():
+            idf[column] = IDF.get(term, 0.0)
+        return idf
+    monkeypatch.setattr(keyword_service, "idf_vector", idf_vector)
+    monkeypatch.setattr(keyword_service, "get_stopwords", lambda language: frozenset({"the", "and"}))
+    monkeypatch.setattr(settings, "KEYWORD_MIN_TERM_LENGTH", 3)
+
+def fragment(text, tags=None):
+    return SimpleNamespace(text=text, language="en", tags=tags)
+
+def test_tags_rank_by_tf_idf():
+    tags = compute_tags(None, [fragment("neuron neuron network layer video")], top_k=3)
+    assert tags == [["neuron", "network", "layer"]]
+
+def test_zero_idf_stopwords_numbers_and_short_words_are_skipped():
+    tags = compute_tags(None, [fragment("the video and 2024 of layer")], top_k=5)
+    assert tags == [["layer"]]
+
+def test_equal_scores_break_by_word_and_rows_stay_aligned():
+    fragments = [fragment("network gradient"), fragment(""), fragment("descent layer")]
+    assert compute_tags(None, fragments, top_k=5) == [["gradient", "network"], [], ["descent", "layer"]]
+
+def test_tag_fragments_returns_only_changed():
+    unchanged = fragment("neuron", tags=["neuron"])
+    changed = fragment("network", tags=["old"])
+    assert tag_fragments(None, [unchanged, changed]) == [changed]
+    assert changed.tags == ["network"]
@@ -0,0 +1,49 @@
+import os
+import pytest
+from core.config import settings
+from services.local_search_engine import LocalSearchEngine
+
+def doc(fragment_id, text, video_id=1):
+    return {"fragment_id": fragment_id, "video_id": video_id, "text": text, "language": "en"}
+
+def found(engine, query):
+    return [hit["_source"]["fragment_id"] for hit in engine.search(query, "en", min_score=0)]
+
+@pytest.fixture
+def engine(tmp_path):
+    return LocalSearchEngine(str(tmp_path))
+
+def test_reindexed_document_replaces_previous_version(engine):
+    engine.index_documents([doc(1, "photosynthesis in green plants"), doc(2, "cellular respiration")])
+    engine.index_documents([doc(1, "mitochondria produce energy")])
+    assert found(engine, "photosynthesis") == []
+    assert found(engine, "mitochondria") == [1]
+    assert engine.doc_count == 2
+
+def test_deleted_documents_are_hidden_by_tombstones(engine):
+    engine.index_documents([doc(1, "quantum entanglement"), doc(2, "quantum tunnelling")])
+    engine.delete_documents([1])
+    assert found(engine, "quantum") == [2]
+    assert engine.doc_count == 1
+    assert len(engine.segments) == 1
+
+def test_segments_merge_and_drop_dead_documents(engine, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LOCAL_SEARCH_MAX_SEGMENTS", 2)
+    engine.index_documents([doc(1, "algebra basics"), doc(2, "geometry basics")])
+    engine.delete_documents([2])
+    engine.index_documents([doc(1, "linear algebra")])
+    assert len(engine.segments) == 2
+    engine.index_documents([doc(3, "calculus basics")])
+
+    assert len(engine.segments) == 1
+    assert engine.tombstones == {}
+    assert sorted(stored["fragment_id"] for stored in engine.segments[0].docs) == [1, 3]
+    assert found(engine, "linear") == [1]
+    assert found(engine, "geometry") == []
+    # Файлы слитых сегментов удалены
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".postings")) == ["seg_000004.postings"]
+
+def test_other_instances_see_committed_changes(engine, tmp_path):
+    reader = LocalSearchEngine(str(tmp_path))
+    engine.index_documents([doc(1, "thermodynamics lecture")])
+    assert found(reader, "thermodynamics") == [1]
@@ -0,0 +1,45 @@
+import os
+import pytest
+from utils import media_cache as media_cache_module
+from utils.media_cache import MediaCache
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Объекты «S3» — 100 байт на ключ; список скачанных ключей"""
+    fetched = []
+    def download_file_from_s3(key, path):
+        fetched.append(key)
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+    monkeypatch.setattr(media_cache_module, "download_file_from_s3", download_file_from_s3)
+    return fetched
+
+def test_hit_does_not_download_again(tmp_path, downloads):
+    cache = MediaCache(str(tmp_path), max_bytes=1000)
+    path = cache.get("fragments/1.mp4")
+    assert cache.get("fragments/1.mp4") == path
+    assert downloads == ["fragments/1.mp4"]
+    with cache.open_file("fragments/1.mp4") as f:
+        assert len(f.read()) == 100
+
+def test_limit_is_shared_by_processes_using_one_directory(tmp_path, downloads):
+    first = MediaCache(str(tmp_path), max_bytes=250)
+    second = MediaCache(str(tmp_path), max_bytes=250)
+    old = first.get("fragments/1.mp4")
+    os.utime(old, (1, 1))
+    recent = first.get("fragments/2.mp4")
+    second.get("fragments/3.mp4")
+    # Второй экземпляр видит файлы первого и вытесняет давно использованный
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert second.stats()["bytes"] == 200
+
+def test_fresh_part_files_of_other_processes_survive(tmp_path, downloads):
+    part = tmp_path / "ab" / "download.mp4.1.2.part"
+    part.parent.mkdir()
+    part.write_bytes(b"x")
+    MediaCache(str(tmp_path), max_bytes=1000)
+    assert part.exists()
+    os.utime(part, (1, 1))
+    MediaCache(str(tmp_path), max_bytes=1000)
+    assert not part.exists()
@@ -0,0 +1,41 @@
+import math
+import pytest
+from utils.previews import sprite_layout, build_preview_filter, thumbnail_time, previews_prefix
+
+def layout(duration, max_frames=100):
+    return sprite_layout(duration, columns=10, max_frames=max_frames, min_interval=2.0, tile_width=160, tile_height=90)
+
+def test_short_video_uses_min_interval():
+    assert layout(30) == {"interval": 2.0, "columns": 10, "rows": 2, "frames": 15, "tile_width": 160, "tile_height": 90}
+
+def test_long_video_fits_one_sheet():
+    result = layout(3600)
+    assert result["interval"] == 36.0
+    assert (result["frames"], result["columns"], result["rows"]) == (100, 10, 10)
+
+@pytest.mark.parametrize("duration, max_frames", [(1000, 300), (7777.7, 100), (123.4, 7)])
+def test_interval_rounds_up_so_frames_never_exceed_grid(duration, max_frames):
+    result = layout(duration, max_frames)
+    assert result["frames"] <= max_frames
+    assert result["frames"] <= result["columns"] * result["rows"]
+    # Кадров fps=1/interval за всю длительность тоже не больше сетки
+    assert math.ceil(duration / result["interval"]) <= result["columns"] * result["rows"]
+
+def test_tiny_video_gets_single_tile():
+    result = layout(0.5)
+    assert (result["frames"], result["columns"], result["rows"]) == (1, 1, 1)
+
+def test_filter_has_thumbnail_and_sprite_branches():
+    graph = build_preview_filter([1.5, 7.25], layout(30), thumb_width=320)
+    assert graph.startswith("[0:v]split=2[t][s];")
+    assert "gte(t,1.5)*(isnan(prev_selected_t)+lt(prev_selected_t,1.5))" in graph
+    assert "gte(t,7.25)*(isnan(prev_selected_t)+lt(prev_selected_t,7.25))" in graph
+    assert "scale=320:-2[thumbs]" in graph
+    assert "fps=1/2.0," in graph
+    assert "pad=160:90:(ow-iw)/2:(oh-ih)/2," in graph
+    assert graph.endswith("tile=10x2[sprite]")
+
+def test_thumbnail_time_and_prefix():
+    assert thumbnail_time(10.0, 15.5) == 12.75
+    assert thumbnail_time(0.1, 0.2) == 0.15
+    assert previews_prefix(42) == "fragments/previews/42/"
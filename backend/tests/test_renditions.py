@@ -0,0 +1,63 @@
+import pytest
+from core.config import settings
+from utils.renditions import (build_rendition_command, configured_renditions, primary_rendition,
+                              rendition_extension, rendition_media_type)
+
+def option_values(cmd, option):
+    return [cmd[i + 1] for i, arg in enumerate(cmd) if arg == option]
+
+@pytest.mark.parametrize("configured, has_audio, expected", [
+    (["720p", "360p", "audio"], True, ["720p", "360p", "audio"]),
+    # Без звука вариант audio пропускается
+    (["720p", "audio"], False, ["720p"]),
+    # Без видеовариантов основным становится source
+    (["audio"], True, ["source", "audio"]),
+    (["audio"], False, ["source"]),
+    # Повторы отбрасываются, порядок сохраняется
+    (["480p", "source", "480p"], True, ["480p", "source"]),
+])
+def test_configured_renditions(monkeypatch, configured, has_audio, expected):
+    monkeypatch.setattr(settings, "FRAGMENT_RENDITIONS", configured)
+    renditions = configured_renditions(has_audio)
+    assert renditions == expected
+    assert primary_rendition(renditions) == expected[0]
+
+def test_unknown_rendition_raises(monkeypatch):
+    monkeypatch.setattr(settings, "FRAGMENT_RENDITIONS", ["4k"])
+    with pytest.raises(ValueError):
+        configured_renditions()
+
+def test_audio_rendition_extension_and_type():
+    assert rendition_extension("audio") == ".m4a"
+    assert rendition_extension("720p") == ".mp4"
+    assert rendition_media_type("fragments/1/audio.m4a") == "audio/mp4"
+    assert rendition_media_type(None) == "video/mp4"
+
+def test_one_decode_split_into_video_renditions():
+    outputs = [("source", "/tmp/source.mp4"), ("720p", "/tmp/720p.mp4"), ("audio", "/tmp/audio.m4a")]
+    cmd = build_rendition_command("/tmp/video.mp4", 10.0, 12.5, outputs)
+
+    # Вход читается один раз, отрезок задан на входе
+    assert option_values(cmd, "-i") == ["/tmp/video.mp4"]
+    assert cmd.index("-ss") < cmd.index("-i")
+    assert option_values(cmd, "-ss") == ["10.000"] and option_values(cmd, "-t") == ["2.500"]
+    # Число веток split равно числу видеовариантов
+    graph = option_values(cmd, "-filter_complex")[0].split(";")
+    assert graph[0] == "[0:v]split=2[s0][s1]"
+    assert graph[1:] == ["[s0]null[v0]", "[s1]scale=-2:'min(720,ih)'[v1]"]
+    assert option_values(cmd, "-map") == ["[v0]", "0:a:0?", "[v1]", "0:a:0?", "0:a:0"]
+    assert [arg for arg in cmd if arg.startswith("/tmp/") and arg != "/tmp/video.mp4"] == [
+        "/tmp/source.mp4", "/tmp/720p.mp4", "/tmp/audio.m4a"]
+
+def test_audio_only_command_has_no_filter_graph():
+    cmd = build_rendition_command("/tmp/video.mp4", 0.0, 5.0, [("audio", "/tmp/audio.m4a")])
+    assert "-filter_complex" not in cmd
+    assert option_values(cmd, "-map") == ["0:a:0"]
+    assert "-vn" in cmd
+    assert cmd[-1] == "/tmp/audio.m4a"
+
+def test_video_without_audio_maps_optional_audio():
+    cmd = build_rendition_command("/tmp/video.mp4", 0.0, 5.0, [("480p", "/tmp/480p.mp4")])
+    assert option_values(cmd, "-filter_complex") == ["[0:v]split=1[s0];[s0]scale=-2:'min(480,ih)'[v0]"]
+    # Дорожка звука необязательна: у видео без звука ffmpeg не падает
+    assert option_values(cmd, "-map") == ["[v0]", "0:a:0?"]
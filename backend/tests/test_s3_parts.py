@@ -0,0 +1,110 @@
+import io
+import math
+import threading
+import pytest
+from core.config import settings
+from utils import s3_utils
+from utils.s3_utils import MAX_PARTS, MIN_PART_SIZE, PartReader, calculate_part_size
+
+MB = 1024 * 1024
+
+def test_part_size_never_below_s3_minimum(monkeypatch):
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 1 * MB)
+    assert calculate_part_size(0) == MIN_PART_SIZE
+    assert calculate_part_size(10 * MB) == MIN_PART_SIZE
+
+def test_part_size_uses_configured_size(monkeypatch):
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 16 * MB)
+    assert calculate_part_size(100 * MB) == 16 * MB
+
+@pytest.mark.parametrize("file_size", [
+    MAX_PARTS * 16 * MB,
+    MAX_PARTS * 16 * MB + 1,
+    200 * 1024 * MB + 12345,
+])
+def test_part_size_keeps_parts_within_limit(monkeypatch, file_size):
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 16 * MB)
+    part_size = calculate_part_size(file_size)
+    assert part_size % MB == 0
+    assert math.ceil(file_size / part_size) <= MAX_PARTS
+    # Часть растет не больше чем на округление до МБ
+    assert part_size - MB < max(16 * MB, math.ceil(file_size / MAX_PARTS))
+
+def test_part_reader_reads_and_seeks_within_slice():
+    data = bytes(range(20))
+    reader = PartReader(memoryview(data)[5:15])
+    assert len(reader) == 10
+    assert reader.read(4) == bytes(range(5, 9))
+    assert reader.tell() == 4
+    # Чтение не выходит за конец среза
+    assert reader.read(100) == bytes(range(9, 15))
+    assert reader.read(1) == b""
+    reader.seek(-3, io.SEEK_END)
+    assert reader.read() == bytes(range(12, 15))
+    # seek за границы прижимается к краям
+    assert reader.seek(100) == 10
+    assert reader.seek(-100, io.SEEK_CUR) == 0
+
+def test_part_reader_readinto_short_tail():
+    reader = PartReader(memoryview(b"abcdef")[4:])
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 2
+    assert buffer[:2] == b"ef"
+    assert reader.readinto(buffer) == 0
+
+class FakeMultipart:
+    """Подменяет вызовы S3 и запоминает тела частей"""
+
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(s3_utils, "create_multipart_upload", lambda key: "upload-1")
+        monkeypatch.setattr(s3_utils, "upload_part", self.upload_part)
+        monkeypatch.setattr(s3_utils, "complete_multipart_upload", self.complete)
+        monkeypatch.setattr(s3_utils, "abort_multipart_upload", self.abort)
+
+    def upload_part(self, key, upload_id, part_number, body):
+        if part_number == self.fail_part:
+            raise RuntimeError("part failed")
+        # Тело читается внутри вызова: после возврата срез mmap освобождается
+        data = body.read() if hasattr(body, "read") else bytes(body)
+        with self.lock:
+            self.parts[part_number] = data
+        return {"PartNumber": part_number, "ETag": f"etag-{part_number}"}
+
+    def complete(self, key, upload_id, parts):
+        self.completed = sorted(part["PartNumber"] for part in parts)
+
+    def abort(self, key, upload_id):
+        self.aborted = True
+
+def test_multipart_slices_file_at_part_boundaries(monkeypatch, tmp_path):
+    fake = FakeMultipart()
+    fake.install(monkeypatch)
+    monkeypatch.setattr(s3_utils, "calculate_part_size", lambda size: 4)
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"0123456789")
+
+    s3_utils._upload_multipart(str(path), "videos/video.mp4", 10)
+
+    assert fake.parts == {1: b"0123", 2: b"4567", 3: b"89"}
+    assert fake.completed == [1, 2, 3]
+    assert not fake.aborted
+
+def test_multipart_aborts_when_part_fails(monkeypatch, tmp_path):
+    fake = FakeMultipart(fail_part=2)
+    fake.install(monkeypatch)
+    monkeypatch.setattr(s3_utils, "calculate_part_size", lambda size: 4)
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"0123456789")
+
+    with pytest.raises(RuntimeError):
+        s3_utils._upload_multipart(str(path), "videos/video.mp4", 10)
+
+    assert fake.aborted
+    assert fake.completed is None
@@ -0,0 +1,85 @@
+import pytest
+from elasticsearch import ConnectionTimeout
+from core.config import settings
+from core.timing import LatencyBudget
+from services import search_service
+from services.search_service import apply_search_limits, search_videos_collapsed
+
+class FakeElasticsearch:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.bodies = []
+        self.request_timeout = None
+
+    def options(self, request_timeout=None):
+        self.request_timeout = request_timeout
+        return self
+
+    def search(self, index, body):
+        self.bodies.append(body)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def es_response(videos, timed_out=False):
+    return {
+        "took": 1,
+        "timed_out": timed_out,
+        "hits": {"total": {"value": videos}, "hits": [{"_source": {"video_id": i, "fragment_id": i}} for i in range(videos)]},
+        "aggregations": {"videos_total": {"value": videos}},
+    }
+
+@pytest.fixture
+def use_es(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "elasticsearch")
+    monkeypatch.setattr(settings, "SEARCH_PLANNER_ENABLED", True)
+    monkeypatch.setattr(settings, "SEARCH_PLANNER_MIN_HITS", 3)
+    monkeypatch.setattr(search_service, "detect_query_language", lambda query: "en")
+
+    def install(*responses):
+        es = FakeElasticsearch(*responses)
+        monkeypatch.setattr(search_service, "get_elasticsearch", lambda: es)
+        return es
+    return install
+
+def test_limits_come_from_budget_and_settings(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_TRACK_TOTAL_HITS", 500)
+    monkeypatch.setattr(settings, "SEARCH_TERMINATE_AFTER", 10000)
+    body = apply_search_limits({}, LatencyBudget(800))
+    assert body["track_total_hits"] == 500
+    assert body["terminate_after"] == 10000
+    assert 700 < int(body["timeout"][:-2]) <= 800
+    assert body["timeout"].endswith("ms")
+
+def test_no_budget_no_timeout_and_no_terminate_after_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_TERMINATE_AFTER", 0)
+    body = apply_search_limits({})
+    assert "timeout" not in body
+    assert "terminate_after" not in body
+
+def test_exhausted_budget_keeps_min_step():
+    budget = LatencyBudget(0, min_step_ms=50)
+    assert budget.expired
+    assert budget.es_timeout() == "50ms"
+
+def test_exhausted_budget_returns_partial_page_from_cheap_stage(use_es):
+    es = use_es(es_response(1))
+    page = search_videos_collapsed("neural networks", max_videos=3, budget=LatencyBudget(0, min_step_ms=50))
+    # Нечеткая стадия не запускается: времени на нее нет
+    assert len(es.bodies) == 1
+    assert page["partial"] is True
+    assert page["stage"] == "term"
+    assert len(page["video_hits"]) == 1
+    assert es.request_timeout == pytest.approx(0.05 + settings.SEARCH_BUDGET_GRACE_SECONDS)
+
+def test_shard_timeout_marks_page_partial(use_es):
+    use_es(es_response(3, timed_out=True))
+    page = search_videos_collapsed("neural networks", max_videos=3)
+    assert page["partial"] is True
+
+def test_client_timeout_gives_empty_partial_page(use_es):
+    use_es(ConnectionTimeout("timed out"))
+    page = search_videos_collapsed("neural networks")
+    assert page == {"video_hits": [], "total_videos": 0, "next_cursor": None, "profile": None,
+                    "stage": None, "partial": True}
@@ -0,0 +1,86 @@
+import pytest
+from core.config import settings
+from services import search_service
+from services.search_service import plan_stages, search_videos_collapsed, decode_cursor_state
+
+def es_response(videos, total=None):
+    """Ответ поиска со сворачиванием: videos попаданий-видео, всего total видео"""
+    total = videos if total is None else total
+    return {
+        "took": 1,
+        "hits": {"total": {"value": total}, "hits": [{"_source": {"video_id": i, "fragment_id": i}} for i in range(videos)]},
+        "aggregations": {"videos_total": {"value": total}},
+    }
+
+def stage_of(body):
+    clause = body["query"]["bool"]["must"][0]
+    return "fuzzy" if "fuzziness" in clause.get("multi_match", {}) else "term"
+
+class FakeElasticsearch:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def options(self, **kwargs):
+        return self
+
+    def search(self, index, body):
+        self.bodies.append(body)
+        return self.responses.pop(0)
+
+@pytest.fixture
+def use_es(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "elasticsearch")
+    monkeypatch.setattr(settings, "SEARCH_PLANNER_ENABLED", True)
+    monkeypatch.setattr(settings, "SEARCH_PLANNER_MIN_HITS", 3)
+    monkeypatch.setattr(search_service, "detect_query_language", lambda query: "en")
+
+    def install(*responses):
+        es = FakeElasticsearch(*responses)
+        monkeypatch.setattr(search_service, "get_elasticsearch", lambda: es)
+        return es
+    return install
+
+def test_plan_stages():
+    assert plan_stages() == ["term", "fuzzy"]
+    assert plan_stages(exact=True) == ["fuzzy"]
+    assert plan_stages(stage="term") == ["term"]
+
+def test_enough_term_hits_skip_the_fuzzy_stage(use_es):
+    es = use_es(es_response(3))
+    page = search_videos_collapsed("neural networks", max_videos=3)
+    assert [stage_of(body) for body in es.bodies] == ["term"]
+    assert page["stage"] == "term"
+    assert not page["partial"]
+
+def test_too_few_hits_fall_through_to_fuzzy(use_es):
+    es = use_es(es_response(1), es_response(3))
+    page = search_videos_collapsed("nueral netwroks", max_videos=3)
+    assert [stage_of(body) for body in es.bodies] == ["term", "fuzzy"]
+    assert page["stage"] == "fuzzy"
+    assert len(page["video_hits"]) == 3
+
+def test_page_size_counts_towards_needed_hits(use_es):
+    # Трех видео хватает планировщику, но не странице с offset 2 из 2 видео
+    es = use_es(es_response(2, total=3), es_response(2, total=6))
+    cursor = search_service.encode_cursor(2)
+    search_videos_collapsed("neural networks", max_videos=2, cursor=cursor)
+    assert [stage_of(body) for body in es.bodies] == ["term", "fuzzy"]
+
+def test_next_page_stays_on_the_stage_of_the_first(use_es):
+    es = use_es(es_response(1), es_response(2, total=5))
+    first = search_videos_collapsed("nueral", max_videos=2)
+    assert decode_cursor_state(first["next_cursor"]) == (2, "fuzzy")
+
+    es = use_es(es_response(2, total=5))
+    second = search_videos_collapsed("nueral", max_videos=2, cursor=first["next_cursor"])
+    assert [stage_of(body) for body in es.bodies] == ["fuzzy"]
+    assert es.bodies[0]["from"] == 2
+    assert second["stage"] == "fuzzy"
+
+def test_exact_search_runs_one_phrase_stage(use_es):
+    es = use_es(es_response(0))
+    page = search_videos_collapsed("neural networks", exact=True)
+    assert len(es.bodies) == 1
+    assert "match_phrase" in es.bodies[0]["query"]["bool"]["must"][0]
+    assert page["video_hits"] == []
@@ -0,0 +1,41 @@
+import threading
+from core import timing
+from core.timing import RequestTimings
+
+def test_header_value_format():
+    timings = RequestTimings()
+    timings.record("es", 12.345)
+    timings.record("db", 3.0, "hydrate")
+    assert timings.header_value() == 'es;dur=12.3, db;dur=3.0;desc="hydrate"'
+
+def test_header_value_sanitizes_names_and_descriptions():
+    timings = RequestTimings()
+    timings.record("es search", 1.0, 'stage "term"')
+    assert timings.header_value() == 'es_search;dur=1.0;desc="stage \\"term\\""'
+
+def test_empty_timings_give_empty_header():
+    assert RequestTimings().header_value() == ""
+
+def test_spans_recorded_only_inside_request():
+    # Вне запроса замеры игнорируются
+    with timing.span("outside"):
+        pass
+    timings, token = timing.start_request()
+    try:
+        with timing.span("es", "term"):
+            pass
+        timing.record("db", 2.0)
+    finally:
+        timing.finish_request(token)
+    assert timing.current() is None
+    assert [(name, description) for name, _, description in timings.spans] == [("es", "term"), ("db", None)]
+    assert timings.as_dict()[1] == {"name": "db", "duration_ms": 2.0, "description": None}
+
+def test_spans_from_threads_share_collector():
+    timings = RequestTimings()
+    threads = [threading.Thread(target=timings.record, args=(f"part{i}", float(i))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(name for name, _, _ in timings.spans) == [f"part{i}" for i in range(8)]
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+import pytest
+from core.config import settings
+from services.search_service import (RESULT_SOURCE_FIELDS, fragment_source_fields, hydrate_from_source,
+                                     videos_from_source)
+from utils.elasticsearch_utils import convert_fragment
+
+def make_fragment(fragment_id, video):
+    return SimpleNamespace(id=fragment_id, video_id=video.id, video=video, text=f"текст {fragment_id}",
+                           timecode_start=1.0, timecode_end=2.5, tags=["tag"], s3_url=f"fragments/{fragment_id}.mp4",
+                           thumbnail_url=f"thumbnails/{fragment_id}.jpg", renditions={"480p": f"r/{fragment_id}.mp4"},
+                           language="ru")
+
+def video_hit(*sources):
+    """Попадание свернутого поиска с фрагментами во inner_hits"""
+    return {"inner_hits": {"top_fragments": {"hits": {"hits": [{"_source": source} for source in sources]}}}}
+
+def test_hydration_from_indexed_document():
+    video = SimpleNamespace(id=7, name="Лекция", description="Описание", s3_url="videos/7.mp4")
+    sources = [convert_fragment(make_fragment(fid, video), index="fragments")["_source"] for fid in (1, 2)]
+
+    fragments_by_id, videos_by_id = hydrate_from_source([video_hit(*sources)])
+
+    assert set(fragments_by_id) == {1, 2}
+    fragment = fragments_by_id[1]
+    assert (fragment.video_id, fragment.text, fragment.timecode_start, fragment.timecode_end) == (7, "текст 1", 1.0, 2.5)
+    assert (fragment.s3_url, fragment.thumbnail_url) == ("fragments/1.mp4", "thumbnails/1.jpg")
+    assert fragment.renditions == {"480p": "r/1.mp4"}
+    video = videos_by_id[7]
+    assert (video.id, video.name, video.description, video.s3_url) == (7, "Лекция", "Описание", "videos/7.mp4")
+
+def test_documents_without_video_fields_give_no_video():
+    # Документ проиндексирован до денормализации: видео дочитывается из БД
+    old = {"fragment_id": 3, "video_id": 9, "text": "старый"}
+    fresh = {"fragment_id": 4, "video_id": 8, "text": "новый", "video_name": "", "video_description": None,
+             "video_s3_url": "videos/8.mp4"}
+
+    fragments_by_id, videos_by_id = hydrate_from_source([video_hit(old), video_hit(fresh)])
+
+    assert set(fragments_by_id) == {3, 4}
+    assert fragments_by_id[3].renditions is None
+    assert set(videos_by_id) == {8}
+    assert videos_from_source([video_hit(old)]) == {}
+
+@pytest.mark.parametrize("mode, expected", [
+    ("source", RESULT_SOURCE_FIELDS),
+    ("database", ["fragment_id", "video_id", "video_name", "video_description", "video_s3_url"]),
+])
+def test_source_fields_follow_hydration_mode(monkeypatch, mode, expected):
+    monkeypatch.setattr(settings, "SEARCH_HYDRATION", mode)
+    assert fragment_source_fields() == expected
+
+def test_unknown_hydration_mode_raises(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_HYDRATION", "cache")
+    with pytest.raises(ValueError):
+        fragment_source_fields()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from core.config import settings
+from utils import s3_utils
+from utils.s3_utils import MIN_PART_SIZE, StreamingMultipartUpload
+from api.endpoints import upload as upload_endpoint
+
+class FakeMultipart:
+    """Подменяет вызовы S3 и запоминает тела частей"""
+
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(s3_utils, "create_multipart_upload", lambda key: "upload-1")
+        monkeypatch.setattr(s3_utils, "upload_part", self.upload_part)
+        monkeypatch.setattr(s3_utils, "complete_multipart_upload", self.complete)
+        monkeypatch.setattr(s3_utils, "abort_multipart_upload", self.abort)
+
+    def upload_part(self, key, upload_id, part_number, body):
+        if part_number == self.fail_part:
+            raise RuntimeError("part failed")
+        with self.lock:
+            self.parts[part_number] = bytes(body)
+        return {"PartNumber": part_number, "ETag": f"etag-{part_number}"}
+
+    def complete(self, key, upload_id, parts):
+        self.completed = sorted(part["PartNumber"] for part in parts)
+
+    def abort(self, key, upload_id):
+        self.aborted = True
+
+class FakeStorage:
+    def __init__(self, root):
+        self.root = root
+
+    def job_path(self, job_id, filename):
+        return str(self.root / filename)
+
+class FakeRequest:
+    """Тело запроса кусками; error — исключение после всех кусков (обрыв клиента)"""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+def test_streaming_upload_splits_into_parts(monkeypatch):
+    fake = FakeMultipart()
+    fake.install(monkeypatch)
+    upload = StreamingMultipartUpload("videos/a.mp4", MIN_PART_SIZE)
+    upload.write(b"a" * (MIN_PART_SIZE - 1))
+    upload.write(b"b" * 2)
+    upload.write(b"c" * 10)
+    upload.complete()
+
+    assert fake.completed == [1, 2]
+    assert len(fake.parts[1]) == MIN_PART_SIZE
+    # Хвост меньше минимума уходит последней частью
+    assert fake.parts[2] == b"b" + b"c" * 10
+    assert not fake.aborted
+
+def test_streaming_upload_aborts_when_part_fails(monkeypatch):
+    fake = FakeMultipart(fail_part=1)
+    fake.install(monkeypatch)
+    upload = StreamingMultipartUpload("videos/a.mp4", MIN_PART_SIZE)
+    upload.write(b"a" * 100)
+
+    with pytest.raises(RuntimeError):
+        upload.complete()
+    assert fake.aborted
+    assert fake.completed is None
+
+def test_tee_writes_file_and_parts(monkeypatch, tmp_path):
+    fake = FakeMultipart()
+    fake.install(monkeypatch)
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 4)
+    uploader = upload_endpoint.VideoUploader(FakeStorage(tmp_path))
+    request = FakeRequest([b"0123", b"45", b"6789"])
+
+    temp_path, unique_filename, s3_key, size = asyncio.run(
+        uploader.save_stream_tee("job", request, "video.mp4", 10))
+
+    assert unique_filename == "job_video.mp4"
+    assert size == 10
+    assert open(temp_path, "rb").read() == b"0123456789"
+    assert fake.parts == {1: b"0123456789"}
+    assert fake.completed == [1]
+
+def test_tee_aborts_upload_and_removes_file_on_error(monkeypatch, tmp_path):
+    fake = FakeMultipart()
+    fake.install(monkeypatch)
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 4)
+    uploader = upload_endpoint.VideoUploader(FakeStorage(tmp_path))
+    request = FakeRequest([b"0123", b"4567"], error=ConnectionResetError("client gone"))
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(uploader.save_stream_tee("job", request, "video.mp4", 100))
+
+    assert fake.aborted
+    assert fake.completed is None
+    assert not (tmp_path / "job_video.mp4").exists()
+
+def test_tee_rejects_body_over_limit(monkeypatch, tmp_path):
+    fake = FakeMultipart()
+    fake.install(monkeypatch)
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE", 6)
+    uploader = upload_endpoint.VideoUploader(FakeStorage(tmp_path))
+    request = FakeRequest([b"0123", b"4567"])
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(uploader.save_stream_tee("job", request, "video.mp4", 0))
+
+    assert exc.value.status_code == 413
+    assert fake.aborted
+    assert not (tmp_path / "job_video.mp4").exists()
@@ -0,0 +1,86 @@
+import os
+from collections import namedtuple
+from types import SimpleNamespace
+import pytest
+from core.config import settings
+from utils import temp_storage as temp_storage_module
+from utils.temp_storage import TempStorageManager, InsufficientTempSpace
+
+MB = 1024 * 1024
+CAPACITY = 3 * MB
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(temp_storage_module, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch, clock):
+    """Диск емкостью CAPACITY, занятый ровно тем, что лежит во временном каталоге"""
+    def disk_usage(path):
+        used = directory_size(tmp_path)
+        return DiskUsage(CAPACITY, used, CAPACITY - used)
+    monkeypatch.setattr(temp_storage_module.shutil, "disk_usage", disk_usage)
+    monkeypatch.setattr(settings, "TEMP_RESERVATION_FACTOR", 1.0)
+    monkeypatch.setattr(settings, "CRITICAL_FREE_SPACE_MB", 0)
+    monkeypatch.setattr(settings, "TEMP_LEASE_SECONDS", 3600)
+    return TempStorageManager(str(tmp_path))
+
+def write_job(storage, job_id, size):
+    with open(storage.job_path(job_id, "video.mp4"), "wb") as f:
+        f.write(b"\0" * size)
+
+def test_reservations_count_against_free_space(storage):
+    assert storage.reserve("a", 2 * MB) == 2 * MB
+    with pytest.raises(InsufficientTempSpace) as error:
+        storage.reserve("b", 2 * MB)
+    assert error.value.required == 2 * MB
+    assert error.value.available < MB + 1
+    # Записанная часть резерва больше не вычитается дважды
+    write_job(storage, "a", MB)
+    assert storage.usage()["reserved_bytes"] == MB
+
+def test_eviction_removes_least_recently_used_unleased_jobs(storage, clock):
+    for job_id in ("old", "new"):
+        storage.acquire(job_id)
+        write_job(storage, job_id, MB)
+        storage.release(job_id)
+        clock.now += 100
+    storage.reserve("next", int(1.5 * MB))
+    assert not os.path.exists(os.path.join(storage.jobs_root, "old"))
+    assert os.path.exists(os.path.join(storage.jobs_root, "new"))
+
+def test_leased_jobs_are_never_evicted(storage, clock):
+    storage.acquire("running")
+    write_job(storage, "running", 2 * MB)
+    with pytest.raises(InsufficientTempSpace):
+        storage.reserve("next", int(1.5 * MB))
+    assert os.path.exists(os.path.join(storage.jobs_root, "running"))
+    # Аренда без продления истекает, и каталог упавшей задачи можно вытеснить
+    clock.now += 3601
+    assert storage.evict_all() == 2 * MB
+    assert not os.path.exists(os.path.join(storage.jobs_root, "running"))
+
+def test_usage_and_release(storage):
+    storage.reserve("a", MB)
+    write_job(storage, "a", MB // 2)
+    stats = storage.usage()
+    assert stats["jobs"] == 1
+    assert stats["leased_jobs"] == 1
+    assert stats["used_bytes"] == MB // 2
+    assert stats["leased_bytes"] == MB // 2
+    storage.release("a", delete=True)
+    stats = storage.usage()
+    assert (stats["jobs"], stats["leased_jobs"], stats["reserved_bytes"]) == (0, 0, 0)
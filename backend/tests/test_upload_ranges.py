@@ -0,0 +1,27 @@
+import pytest
+from db.repositories.upload_repository import merge_ranges
+
+@pytest.mark.parametrize("chunks, expected", [
+    ([], []),
+    ([(0, 10)], [(0, 10)]),
+    # Смежные куски сливаются
+    ([(0, 10), (10, 5)], [(0, 15)]),
+    # Порядок прихода не важен
+    ([(20, 5), (0, 10), (10, 10)], [(0, 25)]),
+    # Перекрытие
+    ([(0, 10), (5, 10)], [(0, 15)]),
+    # Кусок целиком внутри другого
+    ([(0, 100), (10, 5)], [(0, 100)]),
+    # Повтор того же куска
+    ([(0, 10), (0, 10)], [(0, 10)]),
+    # Дыры остаются видны
+    ([(0, 10), (20, 10), (40, 5)], [(0, 10), (20, 30), (40, 45)]),
+])
+def test_merge_ranges(chunks, expected):
+    assert merge_ranges(chunks) == expected
+
+def test_missing_bytes_from_ranges():
+    size = 100
+    ranges = merge_ranges([(90, 10), (0, 30), (30, 20)])
+    assert ranges == [(0, 50), (90, 100)]
+    assert size - sum(end - start for start, end in ranges) == 40
@@ -0,0 +1,119 @@
+"""
+Пакетная индексация в Elasticsearch.
+
+Документы отправляются через streaming_bulk (или parallel_bulk при ELASTICSEARCH_BULK_THREADS > 1)
+пачками по ELASTICSEARCH_BATCH_SIZE. Ошибки отдельных документов собираются и повторяются
+с экспоненциальной задержкой; окончательно упавшие документы попадают в отчет.
+На время больших загрузок у индекса отключаются refresh и реплики.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, List
+from elasticsearch import helpers
+from core.config import settings
+from core.logger import logger
+
+# Коды, при которых повтор бессмыслен: документ не пройдет маппинг и со второй попытки
+NON_RETRYABLE_STATUSES = {400, 404, 409}
+
+@dataclass
+class BulkIndexReport:
+    indexed: int = 0
+    retried: int = 0
+    failed: List[Dict] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.indexed / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f"indexed={self.indexed} failed={len(self.failed)} retried={self.retried} "
+                f"in {self.seconds:.2f}s ({self.docs_per_second:.0f} docs/s)")
+
+@contextmanager
+def bulk_load_settings(es, index):
+    """
+    Отключает refresh и реплики индекса на время загрузки и восстанавливает прежние значения.
+    index может быть алиасом: настройки меняются у каждого индекса за ним.
+    """
+    previous = {}
+    for concrete, data in es.indices.get_settings(index=index).items():
+        current = data["settings"]["index"]
+        previous[concrete] = {
+            "refresh_interval": current.get("refresh_interval", "1s"),
+            "number_of_replicas": current.get("number_of_replicas", "1")
+        }
+        es.indices.put_settings(index=concrete, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    logger.info(f"Bulk load on {index}: refresh and replicas disabled (were {previous})")
+    try:
+        yield
+    finally:
+        for concrete, values in previous.items():
+            es.indices.put_settings(index=concrete, body={"index": values})
+        es.indices.refresh(index=index)
+        logger.info(f"Bulk load on {index}: settings restored")
+
+def _bulk_items(es, actions, chunk_size, threads):
+    if threads > 1:
+        return helpers.parallel_bulk(es, actions, thread_count=threads, chunk_size=chunk_size,
+                                     raise_on_error=False, raise_on_exception=False)
+    # streaming_bulk сам повторяет пачки, отклоненные с 429
+    return helpers.streaming_bulk(es, actions, chunk_size=chunk_size,
+                                  raise_on_error=False, raise_on_exception=False,
+                                  max_retries=settings.ELASTICSEARCH_BULK_MAX_RETRIES,
+                                  initial_backoff=settings.ELASTICSEARCH_BULK_INITIAL_BACKOFF)
+
+def _send(es, actions, chunk_size, threads, report):
+    """Отправляет действия и возвращает упавшие, которые имеет смысл повторить"""
+    by_id = {action["_id"]: action for action in actions}
+    retry = []
+    for ok, item in _bulk_items(es, actions, chunk_size, threads):
+        if ok:
+            report.indexed += 1
+            continue
+        result = next(iter(item.values()))
+        action = by_id.get(result.get("_id"))
+        if action is not None and result.get("status") not in NON_RETRYABLE_STATUSES:
+            retry.append(action)
+        else:
+            report.failed.append(result)
+    return retry
+
+def bulk_index(es, actions, index=None, chunk_size=None, threads=None, large_load=None, max_retries=None):
+    """
+    Индексирует действия вида {"_index", "_id", "_source"} (см. convert_fragment).
+    large_load — отключить refresh и реплики на время загрузки; по умолчанию включается,
+    если документов не меньше ELASTICSEARCH_BULK_LARGE_LOAD_DOCS.
+    """
+    actions = list(actions)
+    report = BulkIndexReport()
+    if not actions:
+        return report
+    index = index or actions[0]["_index"]
+    chunk_size = chunk_size or settings.ELASTICSEARCH_BATCH_SIZE
+    threads = threads or settings.ELASTICSEARCH_BULK_THREADS
+    max_retries = settings.ELASTICSEARCH_BULK_MAX_RETRIES if max_retries is None else max_retries
+    if large_load is None:
+        large_load = len(actions) >= settings.ELASTICSEARCH_BULK_LARGE_LOAD_DOCS
+
+    start = time.perf_counter()
+    with (bulk_load_settings(es, index) if large_load else nullcontext()):
+        pending = _send(es, actions, chunk_size, threads, report)
+        for attempt in range(1, max_retries + 1):
+            if not pending:
+                break
+            delay = settings.ELASTICSEARCH_BULK_INITIAL_BACKOFF * 2 ** (attempt - 1)
+            logger.warning(f"Retrying {len(pending)} failed documents in {delay:.1f}s (attempt {attempt}/{max_retries})")
+            time.sleep(delay)
+            report.retried += len(pending)
+            pending = _send(es, pending, chunk_size, threads, report)
+        for action in pending:
+            report.failed.append({"_id": action["_id"], "error": "retries exhausted"})
+    report.seconds = time.perf_counter() - start
+
+    logger.info(f"Bulk indexing into {index}: {report}")
+    if report.failed:
+        logger.error(f"Bulk indexing into {index}: {len(report.failed)} documents failed, first: {report.failed[0]}")
+    return report
@@ -1,158 +1,173 @@
-from elasticsearch import Elasticsearch, helpers
+import os
+import re
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 from core.config import settings
 from core.logger import logger
+from utils.index_profiles import (
+    get_index_profile, get_index_layout, build_index_body, language_field_values, suggest_field,
+    language_index, language_indices, LANGUAGE_ANALYZERS
+)
+from services.embedding_service import fragment_embeddings
+from utils.bulk_indexer import bulk_index
 
 index_name = settings.ELASTICSEARCH_INDEX_NAME
 
+_es_client = None
+_es_client_pid = None
+
 def get_elasticsearch():
-    return Elasticsearch([{
-        'host': settings.ELASTICSEARCH_HOST,
-        'port': settings.ELASTICSEARCH_PORT,
-        'scheme': 'http'
-    }])
+    # Один клиент с пулом соединений на процесс; после fork (Celery) создается новый
+    global _es_client, _es_client_pid
+    if _es_client is None or _es_client_pid != os.getpid():
+        _es_client = Elasticsearch([{
+            'host': settings.ELASTICSEARCH_HOST,
+            'port': settings.ELASTICSEARCH_PORT,
+            'scheme': 'http'
+        }], request_timeout=settings.ELASTICSEARCH_TIMEOUT)
+        _es_client_pid = os.getpid()
+    return _es_client
+
+_async_es_client = None
+
+def get_async_elasticsearch():
+    # Асинхронный клиент привязан к циклу событий API, поэтому создается лениво
+    global _async_es_client
+    if _async_es_client is None:
+        _async_es_client = AsyncElasticsearch([{
+            'host': settings.ELASTICSEARCH_HOST,
+            'port': settings.ELASTICSEARCH_PORT,
+            'scheme': 'http'
+        }], request_timeout=settings.ELASTICSEARCH_TIMEOUT)
+    return _async_es_client
+
+async def close_async_elasticsearch():
+    global _async_es_client
+    if _async_es_client is not None:
+        await _async_es_client.close()
+        _async_es_client = None
+
+def delete_index_or_alias(es, name):
+    """Удаляет индекс, а если name — алиас, то все индексы за ним"""
+    if es.indices.exists_alias(name=name):
+        targets = list(es.indices.get_alias(name=name))
+        logger.info(f"Deleting indices {targets} behind alias {name}")
+        es.indices.delete(index=",".join(targets))
+    elif es.indices.exists(index=name):
+        logger.info(f"Deleting existing index {name}")
+        es.indices.delete(index=name)
 
-def create_reelearn_index(delete_if_exist=True):
+def create_reelearn_index(delete_if_exist=True, profile=None, index=None, layout=None):
+    """
+    Создает индекс фрагментов. При раскладке per_language создаются индексы <index>_<язык>
+    и алиас <index> на все них. Явно заданный index без layout создается одиночным (бенчмарки).
+    """
     es = get_elasticsearch()
+    layout = get_index_layout(layout or ("single" if index else None))
+    index = index or index_name
+    profile = profile or get_index_profile()
     try:
-        if es.indices.exists(index=index_name):
+        if es.indices.exists(index=index):
             if delete_if_exist:
-                logger.info(f"Deleting existing index {index_name}")
-                es.indices.delete(index=index_name)
+                delete_index_or_alias(es, index)
             else:
-                logger.info(f"Index {index_name} already exists.")
+                logger.info(f"Index {index} already exists.")
                 return
 
-        mapping = {
-            "settings": {
-                "index.max_ngram_diff": 18,  # Разрешаем разницу 18 (20-2)
-                "analysis": {
-                    "tokenizer": {
-                        "ngram_tokenizer": {
-                            "type": "ngram",
-                            "min_gram": 2,
-                            "max_gram": 20,
-                            "token_chars": ["letter", "digit"]
-                        }
-                    },
-                    "filter": {
-                        "english_stop": {
-                            "type": "stop",
-                            "stopwords": "_english_"
-                        },
-                        "english_stemmer": {
-                            "type": "stemmer",
-                            "language": "english"
-                        },
-                        "russian_stop": {
-                            "type": "stop",
-                            "stopwords": "_russian_"
-                        },
-                        "russian_stemmer": {
-                            "type": "stemmer",
-                            "language": "russian"
-                        },
-                        "my_phonetic": {
-                            "type": "phonetic",
-                            "encoder": "metaphone",
-                            "replace": False
-                        }
-                    },
-                    "analyzer": {
-                        "en_fuzzy": {
-                            "type": "custom",
-                            "tokenizer": "standard",
-                            "filter": ["lowercase", "english_stop", "english_stemmer", "my_phonetic"]
-                        },
-                        "ru_fuzzy": {
-                            "type": "custom",
-                            "tokenizer": "standard",
-                            "filter": ["lowercase", "russian_stop", "russian_stemmer", "my_phonetic"]
-                        },
-                        "ngram_analyzer": {
-                            "type": "custom",
-                            "tokenizer": "ngram_tokenizer",
-                            "filter": ["lowercase"]
-                        },
-                        "whitespace_lowercase": {
-                            "tokenizer": "whitespace",
-                            "filter": ["lowercase"]
-                        }
-                    }
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "fragment_id": {"type": "long"},
-                    "video_id": {"type": "long"},
-                    "text": {
-                        "type": "text",
-                        "analyzer": "standard",  # Основное поле индексируется стандартно
-                        "fields": {
-                            "en_fuzzy": {
-                                "type": "text",
-                                "analyzer": "en_fuzzy",
-                                "search_analyzer": "standard"
-                            },
-                            "ru_fuzzy": {
-                                "type": "text",
-                                "analyzer": "ru_fuzzy",
-                                "search_analyzer": "standard"
-                            },
-                            "ngram": {
-                                "type": "text",
-                                "analyzer": "ngram_analyzer",
-                                "search_analyzer": "whitespace_lowercase"
-                            },
-                            "keyword": {"type": "keyword", "ignore_above": 256}
-                        }
-                    },
-                    "language": {"type": "keyword"},
-                    "timecode_start": {"type": "float"},
-                    "timecode_end": {"type": "float"},
-                    "tags": {"type": "keyword"},
-                    "s3_url": {"type": "keyword"},
-                    "speech_confidence": {"type": "float"},
-                    "no_speech_prob": {"type": "float"}
-                }
-            }
-        }
-        
-        es.indices.create(index=index_name, body=mapping)
-        logger.info(f"Index {index_name} created successfully.")
+        if layout == "single":
+            es.indices.create(index=index, body=build_index_body(profile))
+            logger.info(f"Index {index} created successfully.")
+            return
+        for language in LANGUAGE_ANALYZERS:
+            target = language_index(language, index)
+            if es.indices.exists(index=target):
+                es.indices.delete(index=target)
+            body = build_index_body(profile, language)
+            body["aliases"] = {index: {}}
+            es.indices.create(index=target, body=body)
+        logger.info(f"Indices {language_indices(index)} created behind alias {index}.")
     except Exception as e:
         logger.error(f"Error creating index: {e}")
         raise e
 
-def convert_fragment(frag):
+def fragment_index(language, layout=None):
+    """Индекс, в который пишется документ фрагмента данного языка"""
+    if get_index_layout(layout) == "per_language":
+        return language_index(language)
+    return index_name
+
+PHRASE_SPLIT_RE = re.compile(r"[.!?;:,()\[\]\"«»…]+")
+
+def suggestion_phrases(text, max_words=None):
+    """
+    Входы completion-поля: каждая фраза фрагмента и ее хвосты с каждого слова,
+    чтобы подсказка находилась и по слову из середины фразы.
+    """
+    max_words = max_words or settings.SUGGEST_MAX_PHRASE_WORDS
+    inputs = {}
+    for phrase in PHRASE_SPLIT_RE.split(text or ""):
+        words = phrase.split()
+        for start in range(len(words)):
+            candidate = " ".join(words[start:start + max_words])
+            if len(candidate) >= 2:
+                inputs[candidate] = None
+    return list(inputs)
+
+def convert_fragment(frag, profile=None, index=None, embedding=None):
+    profile = profile or get_index_profile()
+    language = getattr(frag, "language", "unknown")
+    # Видео должно быть загружено вместе с фрагментом (joinedload), иначе поля видео пустые
+    video = getattr(frag, "video", None)
+    source = {
+        "fragment_id": frag.id,
+        "video_id": frag.video_id,
+        "text": frag.text,
+        "timecode_start": frag.timecode_start,
+        "timecode_end": frag.timecode_end,
+        "tags": frag.tags or [],
+        "s3_url": frag.s3_url,
+        "thumbnail_url": getattr(frag, "thumbnail_url", None),
+        "renditions": getattr(frag, "renditions", None),
+        "speech_confidence": getattr(frag, "speech_confidence", 1.0),
+        "no_speech_prob": getattr(frag, "no_speech_prob", 0.0),
+        "language": language,
+        "video_name": getattr(video, "name", None),
+        "video_description": getattr(video, "description", None),
+        "video_s3_url": getattr(video, "s3_url", None)
+    }
+    source.update(language_field_values(profile, language, frag.text, "single" if index else None))
+    phrases = suggestion_phrases(frag.text)
+    if phrases:
+        source[suggest_field(language)] = {"input": phrases}
+    if embedding is not None:
+        source["embedding"] = embedding
     return {
-        "_index": index_name,
+        "_index": index or fragment_index(language),
         "_id": str(frag.id),
-        "_source": {
-            "fragment_id": frag.id,
-            "video_id": frag.video_id,
-            "text": frag.text,
-            "timecode_start": frag.timecode_start,
-            "timecode_end": frag.timecode_end,
-            "tags": frag.tags or [],
-            "s3_url": frag.s3_url,
-            "speech_confidence": getattr(frag, "speech_confidence", 1.0),
-            "no_speech_prob": getattr(frag, "no_speech_prob", 0.0),
-            "language": getattr(frag, "language", "unknown")
-        }
+        "_source": source
     }
 
-def add_new_fragment(frag):
+def add_new_fragment(frag, embedding=None):
     es = get_elasticsearch()
-    doc = convert_fragment(frag)
-    es.index(index=index_name, id=doc["_id"], body=doc["_source"])
+    doc = convert_fragment(frag, embedding=embedding)
+    es.index(index=doc["_index"], id=doc["_id"], body=doc["_source"])
 
 def delete_fragment_by_id(fragment_id):
     es = get_elasticsearch()
-    es.delete(index=index_name, id=str(fragment_id), ignore=[404])
+    # Язык удаленного фрагмента уже неизвестен, поэтому удаляем из каждого языкового индекса
+    targets = language_indices() if get_index_layout() == "per_language" else [index_name]
+    for target in targets:
+        es.delete(index=target, id=str(fragment_id), ignore=[404])
 
 def replace_all_fragments(fragments):
     if not fragments:
         return
     create_reelearn_index(delete_if_exist=True)
-    actions = [convert_fragment(frag) for frag in fragments]
-    helpers.bulk(get_elasticsearch(), actions)
+    embeddings = fragment_embeddings(fragments)
+    actions = [convert_fragment(frag, embedding=embedding) for frag, embedding in zip(fragments, embeddings)]
+    return bulk_index(get_elasticsearch(), actions, index=index_name, large_load=True)
+
+def index_fragments_bulk(fragments, embeddings=None):
+    """Индексирует фрагменты пачками; возвращает отчет с ошибками по документам"""
+    embeddings = embeddings or [None] * len(fragments)
+    actions = [convert_fragment(frag, embedding=embedding) for frag, embedding in zip(fragments, embeddings)]
+    return bulk_index(get_elasticsearch(), actions, index=index_name)
@@ -0,0 +1,140 @@
+"""
+Воспроизведение фрагментов из одного HLS-транскода видео (FRAGMENT_OUTPUT_MODE=hls).
+
+Оригинал один раз перекодируется в fragmented MP4 одним файлом (hls/<video_id>/video.mp4) с плейлистом
+index.m3u8, где сегменты адресуются байтовыми диапазонами. Фрагмент поиска хранит ключ этого плейлиста
+и свой временной отрезок; плейлист фрагмента собирается на лету из сегментов, пересекающих отрезок,
+со ссылками на подписанный URL общего файла. Точность границ — длительность сегмента (HLS_SEGMENT_SECONDS),
+начало уточняется тегом EXT-X-START.
+"""
+import posixpath
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+from core.config import settings
+from utils.cache import TTLCache
+from utils.s3_utils import read_object_from_s3, generate_presigned_url
+
+HLS_PREFIX = "hls/"
+PLAYLIST_NAME = "index.m3u8"
+MEDIA_NAME = "video.mp4"
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+# Разобранные плейлисты видео: транскод неизменен, пока видео не удалено
+playlist_cache = TTLCache(settings.HLS_PLAYLIST_CACHE_SIZE, settings.HLS_PLAYLIST_CACHE_TTL_SECONDS)
+
+_URI_RE = re.compile(r'URI="([^"]*)"')
+_BYTERANGE_RE = re.compile(r'BYTERANGE="([^"]*)"')
+# Теги заголовка, которые переносятся в плейлист фрагмента как есть
+_HEADER_TAGS = ("#EXT-X-VERSION", "#EXT-X-TARGETDURATION", "#EXT-X-INDEPENDENT-SEGMENTS")
+
+@dataclass
+class HlsSegment:
+    start: float
+    duration: float
+    uri: str
+    byterange: Optional[str] = None  # "длина@смещение"
+
+@dataclass
+class MediaPlaylist:
+    header: List[str] = field(default_factory=list)
+    map_uri: Optional[str] = None
+    map_byterange: Optional[str] = None
+    segments: List[HlsSegment] = field(default_factory=list)
+
+def hls_prefix(video_id) -> str:
+    return f"{HLS_PREFIX}{video_id}/"
+
+def playlist_key(video_id) -> str:
+    return hls_prefix(video_id) + PLAYLIST_NAME
+
+def is_hls_key(key: Optional[str]) -> bool:
+    return bool(key) and key.startswith(HLS_PREFIX) and key.endswith(".m3u8")
+
+def fragment_playlist_url(fragment_id) -> str:
+    return f"{settings.PUBLIC_API_URL}{settings.API_V1_STR}/videos/fragments/{fragment_id}/playlist.m3u8"
+
+def parse_media_playlist(text: str) -> MediaPlaylist:
+    """
+    Разбирает медиаплейлист. Диапазоны EXT-X-BYTERANGE без смещения продолжают предыдущий
+    диапазон того же файла; при разборе смещения проставляются явно, чтобы сегменты можно было брать выборочно.
+    """
+    playlist = MediaPlaylist()
+    duration = None
+    byterange = None
+    next_offset = {}
+    start = 0.0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MAP:"):
+            uri = _URI_RE.search(line)
+            playlist.map_uri = uri.group(1) if uri else None
+            byterange_match = _BYTERANGE_RE.search(line)
+            playlist.map_byterange = byterange_match.group(1) if byterange_match else None
+        elif line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = line[len("#EXT-X-BYTERANGE:"):]
+        elif line.startswith(_HEADER_TAGS):
+            playlist.header.append(line)
+        elif not line.startswith("#"):
+            if byterange is not None:
+                length, _, offset = byterange.partition("@")
+                offset = int(offset) if offset else next_offset.get(line, 0)
+                next_offset[line] = offset + int(length)
+                byterange = f"{length}@{offset}"
+            playlist.segments.append(HlsSegment(start, duration or 0.0, line, byterange))
+            start += duration or 0.0
+            duration = None
+            byterange = None
+    return playlist
+
+def segments_for_range(playlist: MediaPlaylist, start: float, end: float) -> List[HlsSegment]:
+    return [segment for segment in playlist.segments
+            if segment.start < end and segment.start + segment.duration > start]
+
+def build_fragment_playlist(playlist: MediaPlaylist, start: float, end: float, url_for) -> str:
+    """
+    Плейлист VOD только из сегментов, пересекающих [start, end).
+    url_for — функция относительного URI сегмента в абсолютный (подписанный) URL.
+    """
+    segments = segments_for_range(playlist, start, end)
+    lines = ["#EXTM3U", *playlist.header, "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-MEDIA-SEQUENCE:0"]
+    if segments and start > segments[0].start:
+        lines.append(f"#EXT-X-START:TIME-OFFSET={start - segments[0].start:.3f},PRECISE=YES")
+    if playlist.map_uri:
+        tag = f'#EXT-X-MAP:URI="{url_for(playlist.map_uri)}"'
+        if playlist.map_byterange:
+            tag += f',BYTERANGE="{playlist.map_byterange}"'
+        lines.append(tag)
+    for segment in segments:
+        lines.append(f"#EXTINF:{segment.duration:.6f},")
+        if segment.byterange:
+            lines.append(f"#EXT-X-BYTERANGE:{segment.byterange}")
+        lines.append(url_for(segment.uri))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+def resolve_uri(playlist_key_value: str, uri: str) -> str:
+    """Ключ S3 для URI из плейлиста (URI в плейлисте относительны его каталога)"""
+    return posixpath.normpath(posixpath.join(posixpath.dirname(playlist_key_value), uri))
+
+def load_playlist(key: str) -> MediaPlaylist:
+    playlist = playlist_cache.get(key)
+    if playlist is None:
+        playlist = parse_media_playlist(read_object_from_s3(key).decode("utf-8"))
+        playlist_cache.set(key, playlist)
+    return playlist
+
+def render_fragment_playlist(key: str, start: float, end: float, expiration: int = 3600) -> str:
+    """Плейлист фрагмента с подписанными ссылками; каждый файл транскода подписывается один раз"""
+    signed = {}
+
+    def url_for(uri):
+        if uri not in signed:
+            signed[uri] = generate_presigned_url(resolve_uri(key, uri), expiration=expiration)
+        return signed[uri]
+
+    return build_fragment_playlist(load_playlist(key), start, end, url_for)
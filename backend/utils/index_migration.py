@@ -0,0 +1,136 @@
+"""
+Переход с одиночного индекса фрагментов на индексы по языкам (ELASTICSEARCH_INDEX_LAYOUT=per_language).
+
+Запуск из каталога backend:
+    python -m utils.index_migration
+    python -m utils.index_migration --keep-old
+
+Языковые индексы <имя>_<язык> заполняются через _reindex из старого индекса, затем одним
+атомарным update_aliases старый индекс удаляется, а имя <имя> становится алиасом языковых индексов,
+поэтому поиск не видит промежуточного состояния. На время переноса старый индекс закрыт для записи:
+изменения, которые индексатор не смог применить из-за блокировки, остаются в outbox, и после
+переключения алиаса счетчики попыток сбрасываются у записей, упавших после начала блокировки, чтобы они
+применились к новым индексам. Фрагменты с языком вне LANGUAGE_ANALYZERS попадают в индекс языка по умолчанию.
+"""
+import argparse
+from sqlalchemy import update, select, func
+from core.config import settings
+from db.base import SessionLocal
+from db.models.search_outbox import SearchOutbox
+from core.logger import logger
+from utils.elasticsearch_utils import get_elasticsearch
+from utils.index_profiles import (
+    get_index_profile, build_index_body, language_index, normalize_language, LANGUAGE_ANALYZERS
+)
+
+# Поля, которые в языковом индексе не нужны: text_<язык> профиля language и чужие completion-поля
+_STRIP_FIELDS_SCRIPT = """
+for (def language : params.languages) {
+    ctx._source.remove('text_' + language);
+    if (language != params.keep) {
+        ctx._source.remove('suggest_' + language);
+    }
+}
+"""
+
+def language_filter(language):
+    """Документы старого индекса, которые попадут в индекс данного языка"""
+    if language != normalize_language(None):
+        return {"term": {"language": language}}
+    others = [other for other in LANGUAGE_ANALYZERS if other != language]
+    return {"bool": {"must_not": [{"terms": {"language": others}}]}}
+
+def migrate_to_language_indices(index=None, profile=None, delete_old=True):
+    es = get_elasticsearch()
+    index = index or settings.ELASTICSEARCH_INDEX_NAME
+    profile = profile or get_index_profile()
+    if es.indices.exists_alias(name=index):
+        logger.info(f"{index} is already an alias, nothing to migrate")
+        return
+    if not es.indices.exists(index=index):
+        raise RuntimeError(f"Index {index} does not exist")
+
+    # Запись в старый индекс блокируется до первого _reindex: иначе изменения, пришедшие после переноса
+    # своего языка, пропали бы вместе со старым индексом
+    blocked_at = db_now()
+    set_write_block(es, index, True)
+    try:
+        targets = copy_to_language_indices(es, index, profile)
+    except Exception:
+        set_write_block(es, index, False)
+        raise
+
+    actions = [{"add": {"index": target, "alias": index}} for target in targets]
+    if delete_old:
+        actions.insert(0, {"remove_index": {"index": index}})
+    else:
+        # Алиас не может называться так же, как существующий индекс, поэтому старый индекс переименовывается
+        backup = f"{index}_single"
+        es.indices.clone(index=index, target=backup)
+        actions.insert(0, {"remove_index": {"index": index}})
+        logger.info(f"Old index kept as {backup}")
+    es.indices.update_aliases(body={"actions": actions})
+    replayed = replay_outbox(blocked_at)
+    logger.info(f"{index} now aliases {targets}; {replayed} outbox changes will be replayed; "
+                f"set ELASTICSEARCH_INDEX_LAYOUT=per_language")
+
+def set_write_block(es, index, blocked):
+    es.indices.put_settings(index=index, body={"index": {"blocks": {"write": blocked}}})
+
+def db_now():
+    """Время по часам базы: с ним сравнивается failed_at, который индексатор ставит через now()"""
+    with SessionLocal() as db:
+        return db.scalar(select(func.now()))
+
+def replay_outbox(since):
+    """
+    Сбрасывает попытки записей outbox, упавших после since: отказы из-за блокировки записи не должны
+    их исчерпать. Записи, исчерпавшие попытки до миграции, остаются как есть.
+    """
+    with SessionLocal() as db:
+        replayed = db.execute(
+            update(SearchOutbox)
+            .where(SearchOutbox.failed_at >= since)
+            .values(attempts=0, last_error=None)
+        ).rowcount
+        db.commit()
+    return replayed
+
+def copy_to_language_indices(es, index, profile):
+    """Копирует документы в языковые индексы и сверяет число документов; возвращает имена индексов"""
+    targets = []
+    for language in LANGUAGE_ANALYZERS:
+        target = language_index(language, index)
+        if es.indices.exists(index=target):
+            es.indices.delete(index=target)
+        es.indices.create(index=target, body=build_index_body(profile, language))
+        res = es.reindex(body={
+            "source": {"index": index, "query": language_filter(language)},
+            "dest": {"index": target},
+            "script": {
+                "lang": "painless",
+                "source": _STRIP_FIELDS_SCRIPT,
+                "params": {"languages": list(LANGUAGE_ANALYZERS), "keep": language}
+            }
+        }, refresh=True, wait_for_completion=True, request_timeout=3600)
+        if res.get("failures"):
+            raise RuntimeError(f"Reindex into {target} failed: {res['failures'][:3]}")
+        logger.info(f"Reindexed {res.get('created', 0)} fragments into {target}")
+        targets.append(target)
+
+    source_count = es.count(index=index)["count"]
+    migrated = sum(es.count(index=target)["count"] for target in targets)
+    if migrated != source_count:
+        raise RuntimeError(f"Migrated {migrated} of {source_count} fragments, {index} left untouched")
+    return targets
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the fragments index to per-language indices")
+    parser.add_argument("--index", help="Index name; defaults to ELASTICSEARCH_INDEX_NAME")
+    parser.add_argument("--profile", help="Index profile for the new indices")
+    parser.add_argument("--keep-old", action="store_true", help="Keep a copy of the old index as <index>_single")
+    args = parser.parse_args()
+    migrate_to_language_indices(args.index, get_index_profile(args.profile), delete_old=not args.keep_old)
+
+if __name__ == "__main__":
+    main()
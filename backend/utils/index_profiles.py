@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from core.config import settings
+
+@dataclass(frozen=True)
+class IndexProfile:
+    """
+    Набор анализаторов индекса фрагментов.
+    ngram_type: "ngram" или "edge_ngram" для подполя text.ngram
+    language_fields: стеммированный текст пишется только в поле text_<язык> фрагмента,
+    вместо подполей text.en_fuzzy и text.ru_fuzzy у каждого документа
+    """
+    name: str
+    ngram_type: str
+    min_gram: int
+    max_gram: int
+    phonetic: bool = True
+    language_fields: bool = False
+
+INDEX_PROFILES: Dict[str, IndexProfile] = {
+    # Исходная схема: n-граммы 2–20 и оба языка для каждого документа
+    "full": IndexProfile("full", "ngram", 2, 20),
+    "compact": IndexProfile("compact", "ngram", 3, 5),
+    "edge": IndexProfile("edge", "edge_ngram", 2, 15),
+    "language": IndexProfile("language", "ngram", 3, 5, language_fields=True),
+}
+
+LANGUAGE_ANALYZERS = {"en": "en_fuzzy", "ru": "ru_fuzzy"}
+
+# single — один индекс, каждый документ анализируется всеми языковыми анализаторами;
+# per_language — индекс <имя>_<язык> на каждый язык с одним анализатором в подполе text.stemmed,
+# объединенные алиасом <имя>
+INDEX_LAYOUTS = ("single", "per_language")
+STEMMED_SUBFIELD = "stemmed"
+
+def get_index_layout(layout: Optional[str] = None) -> str:
+    layout = layout or settings.ELASTICSEARCH_INDEX_LAYOUT
+    if layout not in INDEX_LAYOUTS:
+        raise ValueError(f"Unknown index layout '{layout}', expected one of {list(INDEX_LAYOUTS)}")
+    return layout
+
+def normalize_language(language: Optional[str]) -> str:
+    return language if language in LANGUAGE_ANALYZERS else settings.VIDEO_DEFAULT_LANGUAGE
+
+def language_index(language: Optional[str], base: Optional[str] = None) -> str:
+    return f"{base or settings.ELASTICSEARCH_INDEX_NAME}_{normalize_language(language)}"
+
+def language_indices(base: Optional[str] = None) -> List[str]:
+    return [language_index(language, base) for language in LANGUAGE_ANALYZERS]
+
+def get_index_profile(name: Optional[str] = None) -> IndexProfile:
+    name = name or settings.ELASTICSEARCH_INDEX_PROFILE
+    try:
+        return INDEX_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown index profile '{name}', expected one of {sorted(INDEX_PROFILES)}")
+
+def _language_field(language: str) -> str:
+    return f"text_{language}"
+
+def build_index_body(profile: IndexProfile, language: Optional[str] = None) -> dict:
+    """
+    Настройки и маппинг индекса. С language — индекс одного языка: стеммированный текст
+    в подполе text.stemmed и только completion-поле этого языка.
+    """
+    stem_filters = {
+        "en_fuzzy": ["lowercase", "english_stop", "english_stemmer"],
+        "ru_fuzzy": ["lowercase", "russian_stop", "russian_stemmer"],
+    }
+    if profile.phonetic:
+        for filters in stem_filters.values():
+            filters.append("my_phonetic")
+
+    analysis = {
+        "tokenizer": {
+            "ngram_tokenizer": {
+                "type": profile.ngram_type,
+                "min_gram": profile.min_gram,
+                "max_gram": profile.max_gram,
+                "token_chars": ["letter", "digit"]
+            }
+        },
+        "filter": {
+            "english_stop": {"type": "stop", "stopwords": "_english_"},
+            "english_stemmer": {"type": "stemmer", "language": "english"},
+            "russian_stop": {"type": "stop", "stopwords": "_russian_"},
+            "russian_stemmer": {"type": "stemmer", "language": "russian"},
+            "my_phonetic": {"type": "phonetic", "encoder": "metaphone", "replace": False}
+        },
+        "analyzer": {
+            "en_fuzzy": {"type": "custom", "tokenizer": "standard", "filter": stem_filters["en_fuzzy"]},
+            "ru_fuzzy": {"type": "custom", "tokenizer": "standard", "filter": stem_filters["ru_fuzzy"]},
+            "ngram_analyzer": {"type": "custom", "tokenizer": "ngram_tokenizer", "filter": ["lowercase"]},
+            "whitespace_lowercase": {"tokenizer": "whitespace", "filter": ["lowercase"]}
+        }
+    }
+
+    text_fields = {
+        "ngram": {
+            "type": "text",
+            "analyzer": "ngram_analyzer",
+            "search_analyzer": "whitespace_lowercase"
+        },
+        "keyword": {"type": "keyword", "ignore_above": 256}
+    }
+    properties = {
+        "fragment_id": {"type": "long"},
+        "video_id": {"type": "long"},
+        "text": {
+            "type": "text",
+            "analyzer": "standard",  # Основное поле индексируется стандартно
+            "fields": text_fields
+        },
+        "language": {"type": "keyword"},
+        "timecode_start": {"type": "float"},
+        "timecode_end": {"type": "float"},
+        "tags": {"type": "keyword"},
+        "s3_url": {"type": "keyword"},
+        "speech_confidence": {"type": "float"},
+        "no_speech_prob": {"type": "float"},
+        "thumbnail_url": {"type": "keyword", "index": False, "doc_values": False},
+        "renditions": {"type": "object", "enabled": False},  # {имя варианта: ключ S3}, только в _source
+        # Денормализованные поля видео: только хранятся в _source для выдачи без БД
+        "video_name": {"type": "text", "index": False},
+        "video_description": {"type": "text", "index": False},
+        "video_s3_url": {"type": "keyword", "index": False, "doc_values": False}
+    }
+
+    suggest_mapping = {
+        "type": "completion",
+        "analyzer": "simple",
+        "preserve_separators": True,
+        "max_input_length": 100
+    }
+    if language is not None:
+        language = normalize_language(language)
+        text_fields[STEMMED_SUBFIELD] = {"type": "text", "analyzer": LANGUAGE_ANALYZERS[language], "search_analyzer": "standard"}
+        properties[suggest_field(language)] = suggest_mapping
+    else:
+        for field_language, analyzer in LANGUAGE_ANALYZERS.items():
+            field = {"type": "text", "analyzer": analyzer, "search_analyzer": "standard"}
+            if profile.language_fields:
+                properties[_language_field(field_language)] = field
+            else:
+                text_fields[analyzer] = field
+            # Фразы для автодополнения заполняются только для языка фрагмента
+            properties[suggest_field(field_language)] = suggest_mapping
+
+    if settings.SEARCH_VECTOR_ENABLED:
+        from services.embedding_service import get_embedder
+        properties["embedding"] = {
+            "type": "dense_vector",
+            "dims": get_embedder().dim,
+            "index": True,
+            "similarity": "cosine"
+        }
+
+    index_settings = {"analysis": analysis}
+    if profile.ngram_type == "ngram":
+        index_settings["index.max_ngram_diff"] = profile.max_gram - profile.min_gram
+
+    return {"settings": index_settings, "mappings": {"properties": properties}}
+
+def suggest_field(language: str) -> str:
+    if language not in LANGUAGE_ANALYZERS:
+        language = settings.VIDEO_DEFAULT_LANGUAGE
+    return f"suggest_{language}"
+
+def search_fields(profile: IndexProfile, language: str, layout: Optional[str] = None) -> List[str]:
+    """Поля для multi_match; последнее поле всегда text для точного поиска фразы"""
+    if language not in LANGUAGE_ANALYZERS:
+        language = settings.VIDEO_DEFAULT_LANGUAGE
+    if get_index_layout(layout) == "per_language":
+        # В каждом языковом индексе text.stemmed проанализирован своим языком
+        stemmed = f"text.{STEMMED_SUBFIELD}"
+    elif profile.language_fields:
+        stemmed = _language_field(language)
+    else:
+        stemmed = f"text.{LANGUAGE_ANALYZERS[language]}"
+    return [f"{stemmed}^3", "text.ngram^2", "text"]
+
+def language_field_values(profile: IndexProfile, language: Optional[str], text: str, layout: Optional[str] = None) -> dict:
+    """Дополнительные поля документа для профилей с языковыми полями"""
+    if not profile.language_fields or get_index_layout(layout) == "per_language":
+        return {}
+    if language not in LANGUAGE_ANALYZERS:
+        language = settings.VIDEO_DEFAULT_LANGUAGE
+    return {_language_field(language): text}
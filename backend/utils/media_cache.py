@@ -0,0 +1,253 @@
+"""
+Локальный дисковый кэш файлов фрагментов, заполняемый из S3 по запросу (read-through).
+
+Файлы в S3 неизменяемы (ключ фрагмента уникален), поэтому запись кэша не устаревает и удаляется
+только вытеснением по LRU, когда объем превышает MEDIA_CACHE_MAX_BYTES. Параллельные промахи по
+одному ключу объединяются: файл скачивает один поток, остальные ждут его результат.
+Файл скачивается во временный *.part и атомарно переименовывается, поэтому читатели никогда не видят
+недокачанный файл, а несколько процессов API могут делить каталог кэша. Учет общий для всех процессов:
+порядок LRU — mtime файлов (попадание обновляет mtime), а объем перед вытеснением пересчитывается обходом
+каталога под flock, поэтому MEDIA_CACHE_MAX_BYTES ограничивает каталог целиком, а не каждый процесс.
+Вытеснение удаляет файл, но уже открытые дескрипторы остаются рабочими, поэтому отдаваемые в этот момент
+ответы не обрываются.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from core.config import settings
+from core.logger import logger
+from core import metrics
+from utils.cache import TTLCache
+from utils.s3_utils import download_file_from_s3
+from utils.hls import is_hls_key, fragment_playlist_url
+
+PART_SUFFIX = ".part"
+LOCK_FILE = ".lock"
+STALE_PART_SECONDS = 3600  # *.part старше — остаток упавшей загрузки
+
+# Ключи S3 фрагментов для эндпоинта отдачи по (id фрагмента, вариант), чтобы горячие фрагменты не ходили в БД
+fragment_keys = TTLCache(settings.MEDIA_KEY_CACHE_SIZE, settings.MEDIA_KEY_CACHE_TTL_SECONDS)
+
+def fragment_media_url(fragment_id, s3_key, signed_urls) -> str:
+    """
+    Ссылка на воспроизведение фрагмента: плейлист API для HLS, эндпоинт локального кэша
+    при FRAGMENT_MEDIA_DELIVERY=cache, иначе подписанная ссылка на файл в S3
+    """
+    if is_hls_key(s3_key):
+        return fragment_playlist_url(fragment_id)
+    if settings.FRAGMENT_MEDIA_DELIVERY == "cache":
+        return f"{settings.PUBLIC_API_URL}{settings.API_V1_STR}/videos/fragments/{fragment_id}/media"
+    return signed_urls.get(s3_key, "")
+
+def fragment_rendition_urls(fragment_id, renditions, signed_urls) -> dict:
+    """Ссылки на все варианты файла фрагмента; неподписанные варианты не включаются"""
+    urls = {}
+    for name, key in (renditions or {}).items():
+        if settings.FRAGMENT_MEDIA_DELIVERY == "cache":
+            urls[name] = f"{settings.PUBLIC_API_URL}{settings.API_V1_STR}/videos/fragments/{fragment_id}/media?rendition={name}"
+        elif key in signed_urls:
+            urls[name] = signed_urls[key]
+    return urls
+
+class MediaCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._files = 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # ключ S3 -> Future с путем к файлу
+        os.makedirs(root, exist_ok=True)
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + os.path.splitext(key)[1])
+
+    @contextmanager
+    def _dir_lock(self):
+        """Межпроцессная блокировка каталога кэша на время пересчета и вытеснения"""
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _scan(self):
+        """Файлы кэша [(mtime, путь, размер)]; брошенные *.part упавших загрузок удаляются"""
+        files = []
+        now = time.time()
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name == LOCK_FILE:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(PART_SUFFIX):
+                        # Свежий *.part скачивает другой процесс, его трогать нельзя
+                        if now - stat.st_mtime > STALE_PART_SECONDS:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _update_gauges(self):
+        metrics.set_gauge("media_cache_bytes", self._size, "Bytes of fragment media in the local cache")
+        metrics.set_gauge("media_cache_files", self._files, "Fragment media files in the local cache")
+
+    def _evict(self, keep: str = None):
+        """
+        Пересчитывает объем по каталогу и удаляет давно использованные файлы, пока он не уложится в лимит.
+        Объем считается под блокировкой каталога, поэтому лимит общий для всех процессов; keep — только что
+        скачанный файл, который вытеснять нельзя.
+        """
+        with self._dir_lock():
+            files = sorted(self._scan())
+            size = sum(file_size for _, _, file_size in files)
+            count = len(files)
+            for _, path, file_size in files:
+                if size <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= file_size
+                count -= 1
+                metrics.inc("media_cache_evictions_total", 1, "Fragment media files evicted from the local cache")
+        self._size, self._files = size, count
+        self._update_gauges()
+
+    @staticmethod
+    def _touch(path: str):
+        """Попадание обновляет mtime: по нему все процессы ведут общий порядок LRU"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def get(self, key: str) -> str:
+        """Путь к локальной копии объекта; при промахе объект скачивается из S3"""
+        path = self._path(key)
+        with self._lock:
+            if os.path.exists(path):
+                self._touch(path)
+                metrics.inc("media_cache_requests_total", 1, "Fragment media cache lookups", result="hit")
+                return path
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            metrics.inc("media_cache_requests_total", 1, "Fragment media cache lookups", result="coalesced")
+            return future.result()
+
+        metrics.inc("media_cache_requests_total", 1, "Fragment media cache lookups", result="miss")
+        try:
+            path = self._fetch(key, path)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def open_file(self, key: str):
+        """Открытый файл локальной копии; если файл вытеснили между поиском и открытием, он берется заново"""
+        for attempt in range(2):
+            path = self.get(key)
+            try:
+                return open(path, "rb")
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+    def _fetch(self, key: str, path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = f"{path}.{os.getpid()}.{threading.get_ident()}{PART_SUFFIX}"
+        start = time.perf_counter()
+        try:
+            download_file_from_s3(key, part_path)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        size = os.path.getsize(path)
+        metrics.observe("media_cache_fetch_seconds", time.perf_counter() - start, "Time to fill the media cache from S3")
+        metrics.inc("media_cache_fetched_bytes_total", size, "Bytes downloaded from S3 into the media cache")
+        self._evict(keep=path)
+        logger.info(f"Fragment media {key} cached ({size/1024/1024:.1f} MB)")
+        return path
+
+    def stats(self) -> dict:
+        hits = metrics.get("media_cache_requests_total", result="hit")
+        misses = metrics.get("media_cache_requests_total", result="miss")
+        coalesced = metrics.get("media_cache_requests_total", result="coalesced")
+        lookups = hits + misses + coalesced
+        return {
+            "bytes": self._size,
+            "files": self._files,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "coalesced": coalesced,
+            "hit_rate": (hits + coalesced) / lookups if lookups else 0.0,
+        }
+
+_media_cache = None
+_media_cache_lock = threading.Lock()
+
+def get_media_cache() -> MediaCache:
+    global _media_cache
+    with _media_cache_lock:
+        if _media_cache is None:
+            _media_cache = MediaCache(settings.MEDIA_CACHE_DIR, settings.MEDIA_CACHE_MAX_BYTES)
+        return _media_cache
+
+def parse_range(header: str, size: int):
+    """
+    Диапазон из заголовка Range (bytes=a-b, bytes=a-, bytes=-n) как (start, end) включительно.
+    None — отдать файл целиком: нет заголовка, несколько диапазонов или заголовок не разбирается
+    (RFC 9110 велит такой Range игнорировать). ValueError — корректный диапазон, который файл не покрывает.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[len("bytes="):].strip().partition("-")
+    if not sep or not (start or end) or not all(part.isdigit() for part in (start, end) if part):
+        return None
+    if not start:
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(int(end), size - 1) if end else size - 1
+
+def iter_file_range(f, start: int, length: int, chunk_size: int = 256 * 1024):
+    """Читает length байт с позиции start и закрывает файл по окончании"""
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            metrics.inc("media_cache_served_bytes_total", len(data), "Bytes of fragment media served from the local cache")
+            yield data
+    finally:
+        f.close()
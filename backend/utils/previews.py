@@ -0,0 +1,55 @@
+"""
+Превью для выдачи: кадр-миниатюра на каждый фрагмент и спрайт для перемотки на все видео.
+
+Все изображения получаются за один проход ffmpeg: декодированный поток раздваивается фильтром split,
+одна ветка (select) оставляет по кадру в середине каждого фрагмента, другая (fps + tile) берет кадр
+раз в interval секунд и складывает уменьшенные кадры в сетку columns x rows одного JPEG.
+Файлы лежат рядом с фрагментами в fragments/previews/<video_id>/ и удаляются вместе с видео по префиксу.
+Клиент находит кадр спрайта для времени t: index = int(t / interval), столбец index % columns, строка index // columns.
+"""
+import math
+
+PREVIEWS_PREFIX = "fragments/previews/"
+THUMBNAIL_PATTERN = "thumb_%04d.jpg"
+SPRITE_NAME = "sprite.jpg"
+
+def previews_prefix(video_id) -> str:
+    return f"{PREVIEWS_PREFIX}{video_id}/"
+
+def thumbnail_time(start: float, end: float) -> float:
+    """Кадр миниатюры — середина фрагмента: на границах часто склейка или затемнение"""
+    return round((start + end) / 2, 3)
+
+def sprite_layout(duration: float, columns: int, max_frames: int, min_interval: float,
+                  tile_width: int, tile_height: int) -> dict:
+    """Геометрия спрайта: не больше max_frames кадров, чтобы все видео поместилось в один лист"""
+    # Округление вверх: иначе кадров может выйти на один больше сетки и tile начнет второй лист
+    interval = math.ceil(max(min_interval, duration / max_frames) * 1000) / 1000
+    frames = max(1, min(max_frames, math.ceil(duration / interval)))
+    columns = min(columns, frames)
+    return {
+        "interval": interval,
+        "columns": columns,
+        "rows": math.ceil(frames / columns),
+        "frames": frames,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+    }
+
+def build_preview_filter(thumb_times, layout: dict, thumb_width: int) -> str:
+    """
+    filter_complex для одного прохода: [thumbs] — по кадру на каждое время из thumb_times
+    (первый кадр не раньше времени), [sprite] — лист спрайта по layout.
+    thumb_times должны быть отсортированы и различаться больше чем на длительность кадра.
+    """
+    # Кадр выбирается, если он не раньше t, а предыдущий выбранный кадр был раньше t
+    select = "+".join(f"gte(t,{t})*(isnan(prev_selected_t)+lt(prev_selected_t,{t}))" for t in thumb_times)
+    width, height = layout["tile_width"], layout["tile_height"]
+    return (
+        "[0:v]split=2[t][s];"
+        f"[t]select='{select}',scale={thumb_width}:-2[thumbs];"
+        f"[s]fps=1/{layout['interval']},"
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+        f"tile={layout['columns']}x{layout['rows']}[sprite]"
+    )
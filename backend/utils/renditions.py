@@ -0,0 +1,64 @@
+"""
+Варианты файла фрагмента (FRAGMENT_RENDITIONS) из одного декодирования.
+
+Отрезок фрагмента читается один раз (-ss/-t на входе), видеопоток раздваивается фильтром split на столько
+веток, сколько видеовариантов, каждая ветка масштабируется до своей высоты и кодируется в свой файл;
+вариант audio — только звуковая дорожка. Основной вариант (первый видео) хранится в s3_url фрагмента,
+все варианты — в Fragment.renditions как {имя: ключ S3}. В режиме HLS варианты не строятся.
+"""
+from typing import List, Optional
+from core.config import settings
+
+# Имя варианта -> максимальная высота кадра; None — исходное разрешение. Меньшие видео не растягиваются.
+VIDEO_RENDITIONS = {"source": None, "1080p": 1080, "720p": 720, "480p": 480, "360p": 360}
+AUDIO_RENDITION = "audio"
+
+def configured_renditions(has_audio: bool = True) -> List[str]:
+    """
+    Варианты из настроек в порядке объявления; первый видеовариант — основной.
+    Без видеовариантов основным становится source; audio пропускается у видео без звука.
+    """
+    renditions = []
+    for name in settings.FRAGMENT_RENDITIONS:
+        if name != AUDIO_RENDITION and name not in VIDEO_RENDITIONS:
+            raise ValueError(f"Unknown fragment rendition '{name}', expected one of {list(VIDEO_RENDITIONS) + [AUDIO_RENDITION]}")
+        if name == AUDIO_RENDITION and not has_audio:
+            continue
+        if name not in renditions:
+            renditions.append(name)
+    if not any(name in VIDEO_RENDITIONS for name in renditions):
+        renditions.insert(0, "source")
+    return renditions
+
+def primary_rendition(renditions: List[str]) -> str:
+    return next(name for name in renditions if name in VIDEO_RENDITIONS)
+
+def rendition_extension(name: str) -> str:
+    return ".m4a" if name == AUDIO_RENDITION else ".mp4"
+
+def rendition_media_type(key: Optional[str]) -> str:
+    return "audio/mp4" if key and key.endswith(".m4a") else "video/mp4"
+
+def build_rendition_command(video_path: str, start: float, end: float, outputs) -> List[str]:
+    """Команда ffmpeg, пишущая все варианты отрезка [start, end]; outputs — [(имя варианта, путь)]"""
+    video_outputs = [(name, path) for name, path in outputs if name in VIDEO_RENDITIONS]
+    cmd = ["ffmpeg", "-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", video_path]
+    if video_outputs:
+        labels = [f"[v{i}]" for i in range(len(video_outputs))]
+        graph = [f"[0:v]split={len(video_outputs)}" + "".join(f"[s{i}]" for i in range(len(video_outputs)))]
+        for i, (name, _) in enumerate(video_outputs):
+            height = VIDEO_RENDITIONS[name]
+            scale = f"scale=-2:'min({height},ih)'" if height else "null"
+            graph.append(f"[s{i}]{scale}{labels[i]}")
+        cmd += ["-filter_complex", ";".join(graph)]
+    video_index = 0
+    for name, path in outputs:
+        if name == AUDIO_RENDITION:
+            cmd += ["-map", "0:a:0", "-vn", "-c:a", "aac", "-b:a", settings.FRAGMENT_AUDIO_BITRATE]
+        else:
+            cmd += ["-map", f"[v{video_index}]", "-map", "0:a:0?",
+                    "-c:v", "libx264", "-preset", settings.FFMPEG_PRESET, "-crf", str(settings.FFMPEG_CRF),
+                    "-threads", str(settings.FFMPEG_THREADS), "-c:a", "aac"]
+            video_index += 1
+        cmd += ["-movflags", "+faststart", path]
+    return cmd
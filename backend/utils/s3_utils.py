@@ -1,27 +1,57 @@
 import boto3
 import os
+import io
+import mmap
 import logging
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 from urllib.parse import urlparse
 from core.config import settings
+from core import metrics
 from botocore.exceptions import ClientError
 import time
 import math
 
 logger = logging.getLogger("ReeLearnLogger")
 
+MIN_PART_SIZE = 5 * 1024 * 1024  # Минимум S3 для всех частей, кроме последней
+MAX_PARTS = 10000
+
+_clients = {}
+_clients_lock = threading.Lock()
+_bucket_ready = False
+
 def get_s3_client():
-    return boto3.client("s3", 
-                       endpoint_url=settings.S3_ENDPOINT_URL, 
-                       aws_access_key_id=settings.S3_ACCESS_KEY, 
-                       aws_secret_access_key=settings.S3_SECRET_KEY,
-                       config=boto3.session.Config(
-                           connect_timeout=300,  # 5 минут для соединения
-                           read_timeout=300,     # 5 минут для чтения
-                           retries={'max_attempts': 5}  # 5 повторов при ошибках
-                       ))
-
-def ensure_bucket_exists():
+    """
+    Один клиент на процесс: клиенты boto3 потокобезопасны, а создание нового стоит заметного времени.
+    Ключ — pid, чтобы воркеры Celery после fork не делили соединения родителя.
+    """
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                client = boto3.client("s3",
+                                      endpoint_url=settings.S3_ENDPOINT_URL,
+                                      aws_access_key_id=settings.S3_ACCESS_KEY,
+                                      aws_secret_access_key=settings.S3_SECRET_KEY,
+                                      config=boto3.session.Config(
+                                          connect_timeout=300,  # 5 минут для соединения
+                                          read_timeout=300,     # 5 минут для чтения
+                                          retries={'max_attempts': 5},  # 5 повторов при ошибках
+                                          # Соединений хватает на все параллельные части загрузки
+                                          max_pool_connections=max(10, settings.S3_UPLOAD_CONCURRENCY * 2)
+                                      ))
+                _clients[pid] = client
+    return client
+
+def ensure_bucket_exists(force: bool = False):
+    """Проверяет (и при необходимости создает) бакет; успешная проверка запоминается на весь процесс"""
+    global _bucket_ready
+    if _bucket_ready and not force:
+        return
     s3 = get_s3_client()
     try:
         s3.head_bucket(Bucket=settings.S3_BUCKET_NAME)
@@ -34,23 +64,243 @@ def ensure_bucket_exists():
         else:
             logger.error(f"Ошибка при проверке бакета: {str(e)}")
             raise
+    _bucket_ready = True
 
 def calculate_part_size(file_size):
     """
     Рассчитывает оптимальный размер части для многопоточной загрузки.
     Для S3 API минимальный размер части должен быть 5MB, а максимальное количество частей - 10000.
     """
-    min_part_size = 5 * 1024 * 1024  # 5 MB
-    max_parts = 10000
-    
     # Рассчитываем минимальный размер части, чтобы не превысить максимальное количество частей
-    optimal_part_size = max(min_part_size, math.ceil(file_size / max_parts))
+    optimal_part_size = max(MIN_PART_SIZE, settings.S3_MULTIPART_PART_SIZE, math.ceil(file_size / MAX_PARTS))
     
     # Округляем до ближайшего целого МБ
     optimal_part_size = math.ceil(optimal_part_size / (1024 * 1024)) * 1024 * 1024
     
     return optimal_part_size
 
+class PartReader(io.RawIOBase):
+    """
+    Файловый объект поверх memoryview части отображенного в память файла.
+    botocore читает тело блоками, поэтому в памяти процесса не копится вся часть целиком.
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __len__(self):
+        return len(self._view)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = min(max(0, base + offset), len(self._view))
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def create_multipart_upload(key: str) -> str:
+    ensure_bucket_exists()
+    return get_s3_client().create_multipart_upload(Bucket=settings.S3_BUCKET_NAME, Key=key)["UploadId"]
+
+def upload_part(key: str, upload_id: str, part_number: int, body, max_retries: int = 3) -> dict:
+    """Загружает часть с повторами; body — bytes или файловый объект с seek. Возвращает {"PartNumber", "ETag"}"""
+    s3 = get_s3_client()
+    for attempt in range(max_retries):
+        try:
+            if hasattr(body, "seek"):
+                body.seek(0)
+            part = s3.upload_part(Bucket=settings.S3_BUCKET_NAME, Key=key, PartNumber=part_number,
+                                  UploadId=upload_id, Body=body)
+            return {"PartNumber": part_number, "ETag": part["ETag"]}
+        except Exception as e:
+            if attempt < max_retries - 1:
+                logger.warning(f"Ошибка при загрузке части {part_number}, повтор {attempt + 1}: {str(e)}")
+                time.sleep(1)  # Пауза перед повторной попыткой
+            else:
+                logger.error(f"Ошибка при загрузке части {part_number} после {max_retries} попыток: {str(e)}")
+                raise
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list):
+    get_s3_client().complete_multipart_upload(
+        Bucket=settings.S3_BUCKET_NAME,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])}
+    )
+
+def abort_multipart_upload(key: str, upload_id: str):
+    try:
+        get_s3_client().abort_multipart_upload(Bucket=settings.S3_BUCKET_NAME, Key=key, UploadId=upload_id)
+    except Exception as e:
+        logger.error(f"Не удалось отменить multipart-загрузку {key}: {str(e)}")
+
+def list_uploaded_parts(key: str, upload_id: str) -> list:
+    """Части multipart-загрузки, уже принятые хранилищем: [{"PartNumber", "ETag", "Size"}]"""
+    s3 = get_s3_client()
+    parts = []
+    marker = 0
+    while True:
+        res = s3.list_parts(Bucket=settings.S3_BUCKET_NAME, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        parts.extend(res.get("Parts", []))
+        if not res.get("IsTruncated"):
+            return parts
+        marker = res["NextPartNumberMarker"]
+
+def presign(client_method: str, params: dict, expiration: int = 3600) -> str:
+    """Подписанная ссылка на операцию S3 с адресом, доступным клиентам"""
+    url = get_s3_client().generate_presigned_url(client_method, Params=params, ExpiresIn=expiration)
+    if settings.S3_ENDPOINT_URL != settings.S3_PUBLIC_URL:
+        url = url.replace(settings.S3_ENDPOINT_URL, settings.S3_PUBLIC_URL)
+    return url
+
+def presign_upload_parts(key: str, upload_id: str, part_count: int, expiration: int = 3600) -> list:
+    return [presign("upload_part", {"Bucket": settings.S3_BUCKET_NAME, "Key": key, "UploadId": upload_id,
+                                    "PartNumber": part_number}, expiration)
+            for part_number in range(1, part_count + 1)]
+
+def record_transfer(direction: str, size: int, duration: float):
+    """Метрики объема и скорости передачи; возвращает скорость в МБ/с"""
+    rate = size / (1024 * 1024) / duration if duration > 0 else 0.0
+    metrics.inc("s3_transfer_bytes_total", size, "Bytes transferred to or from object storage", direction=direction)
+    metrics.observe("s3_transfer_seconds", duration, "Object storage transfer duration", direction=direction)
+    metrics.set_gauge("s3_transfer_last_mb_per_second", rate, "Throughput of the last object storage transfer",
+                      direction=direction)
+    return rate
+
+def _upload_multipart(file_path: str, key: str, file_size: int) -> None:
+    """
+    Части загружаются параллельно (S3_UPLOAD_CONCURRENCY потоков) из отображенного в память файла.
+    Одновременно в полете не больше S3_UPLOAD_MAX_INFLIGHT_BYTES: следующая часть ставится в пул,
+    только когда освобождается место.
+    """
+    part_size = calculate_part_size(file_size)
+    chunk_count = math.ceil(file_size / part_size)
+    concurrency = max(1, settings.S3_UPLOAD_CONCURRENCY)
+    in_flight = threading.BoundedSemaphore(max(1, min(concurrency, settings.S3_UPLOAD_MAX_INFLIGHT_BYTES // part_size)))
+    logger.info(f"Используется многопоточная загрузка: {chunk_count} частей по {part_size/1024/1024:.2f} МБ, "
+                f"до {concurrency} потоков")
+
+    upload_id = create_multipart_upload(key)
+
+    def send(part_number, offset):
+        # Срез создается в потоке части и освобождается сразу после отправки, иначе mmap не закроется
+        view = memoryview(mapped)[offset:offset + part_size]
+        try:
+            # Логируем прогресс каждые 10 частей
+            if part_number % 10 == 0 or part_number == 1 or part_number == chunk_count:
+                logger.info(f"Загрузка части {part_number}/{chunk_count} размером {len(view)/1024/1024:.2f} МБ")
+            return upload_part(key, upload_id, part_number, PartReader(view))
+        finally:
+            view.release()
+            in_flight.release()
+
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="s3-part") as pool:
+                for part_number in range(1, chunk_count + 1):
+                    in_flight.acquire()
+                    if any(future.done() and future.exception() for future in futures):
+                        in_flight.release()
+                        break
+                    futures.append(pool.submit(send, part_number, (part_number - 1) * part_size))
+                wait(futures, return_when=FIRST_EXCEPTION)
+            parts = [future.result() for future in futures]
+            if len(parts) != chunk_count:
+                raise RuntimeError(f"Загружено {len(parts)} из {chunk_count} частей")
+            complete_multipart_upload(key, upload_id, parts)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # Отменяем многопоточную загрузку при ошибке
+            abort_multipart_upload(key, upload_id)
+            raise
+
+class StreamingMultipartUpload:
+    """
+    Multipart-загрузка потока, длина которого заранее неизвестна: данные копятся до размера части
+    и отправляются пулом потоков, пока вызывающий продолжает писать. В памяти не больше
+    S3_UPLOAD_MAX_INFLIGHT_BYTES частей: write блокируется, пока не освободится место.
+    """
+
+    def __init__(self, key: str, part_size: int = None):
+        self.key = key
+        self.part_size = max(MIN_PART_SIZE, part_size or settings.S3_MULTIPART_PART_SIZE)
+        self.size = 0
+        self.upload_id = create_multipart_upload(key)
+        self._buffer = bytearray()
+        self._futures = []
+        self._aborted = False
+        self._started_at = time.time()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, settings.S3_UPLOAD_CONCURRENCY), thread_name_prefix="s3-stream")
+        self._in_flight = threading.BoundedSemaphore(max(1, settings.S3_UPLOAD_MAX_INFLIGHT_BYTES // self.part_size))
+
+    def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def _submit(self, body: bytes):
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        self._in_flight.acquire()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._pool.submit(self._send, part_number, body))
+
+    def _send(self, part_number: int, body: bytes):
+        try:
+            return upload_part(self.key, self.upload_id, part_number, body)
+        finally:
+            self._in_flight.release()
+
+    def complete(self) -> str:
+        try:
+            # Последняя часть может быть меньше минимума; пустой поток — одна пустая часть
+            if self._buffer or not self._futures:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            complete_multipart_upload(self.key, self.upload_id, [future.result() for future in self._futures])
+        except BaseException:
+            self.abort()
+            raise
+        self._pool.shutdown(wait=True)
+        duration = time.time() - self._started_at
+        transfer_rate = record_transfer("upload", self.size, duration)
+        logger.info(f"Потоковая загрузка {self.key} завершена: {self.size/1024/1024:.2f} МБ за {duration:.2f} секунд. "
+                    f"Скорость: {transfer_rate:.2f} МБ/с")
+        return self.key
+
+    def abort(self):
+        if self._aborted:
+            return
+        self._aborted = True
+        for future in self._futures:
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        abort_multipart_upload(self.key, self.upload_id)
+
 def upload_file_to_s3(file_path: str, key: str = None, use_multipart: bool = True) -> str:
     """
     Загружает файл в S3 с оптимизацией для больших файлов.
@@ -65,7 +315,6 @@ def upload_file_to_s3(file_path: str, key: str = None, use_multipart: bool = Tru
         key = os.path.basename(file_path)
         
     ensure_bucket_exists()
-    s3 = get_s3_client()
     file_size = os.path.getsize(file_path)
     
     # Логируем информацию о загрузке
@@ -73,75 +322,16 @@ def upload_file_to_s3(file_path: str, key: str = None, use_multipart: bool = Tru
     start_time = time.time()
     
     try:
-        if use_multipart and file_size > 5 * 1024 * 1024:  # Используем многопоточную загрузку для файлов > 5 МБ
-            # Рассчитываем оптимальный размер части
-            part_size = calculate_part_size(file_size)
-            
-            logger.info(f"Используется многопоточная загрузка с размером части {part_size/1024/1024:.2f} МБ")
-            
-            # Инициализация многопоточной загрузки
-            mpu = s3.create_multipart_upload(Bucket=settings.S3_BUCKET_NAME, Key=key)
-            upload_id = mpu["UploadId"]
-            
-            parts = []
-            chunk_count = math.ceil(file_size / part_size)
-            
-            with open(file_path, "rb") as f:
-                for part_number in range(1, chunk_count + 1):
-                    offset = (part_number - 1) * part_size
-                    f.seek(offset)
-                    chunk = f.read(part_size)
-                    
-                    if not chunk:  # Конец файла
-                        break
-                        
-                    # Логируем прогресс каждые 10 частей
-                    if part_number % 10 == 0 or part_number == 1 or part_number == chunk_count:
-                        logger.info(f"Загрузка части {part_number}/{chunk_count} размером {len(chunk)/1024/1024:.2f} МБ")
-                        
-                    # Повторные попытки загрузки части при сбоях
-                    max_retries = 3
-                    for attempt in range(max_retries):
-                        try:
-                            part = s3.upload_part(
-                                Bucket=settings.S3_BUCKET_NAME,
-                                Key=key,
-                                PartNumber=part_number,
-                                UploadId=upload_id,
-                                Body=chunk
-                            )
-                            parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
-                            break
-                        except Exception as e:
-                            if attempt < max_retries - 1:
-                                logger.warning(f"Ошибка при загрузке части {part_number}, повтор {attempt + 1}: {str(e)}")
-                                time.sleep(1)  # Пауза перед повторной попыткой
-                            else:
-                                logger.error(f"Ошибка при загрузке части {part_number} после {max_retries} попыток: {str(e)}")
-                                # Отменяем многопоточную загрузку при ошибке
-                                s3.abort_multipart_upload(
-                                    Bucket=settings.S3_BUCKET_NAME,
-                                    Key=key,
-                                    UploadId=upload_id
-                                )
-                                raise
-            
-            # Завершаем многопоточную загрузку
-            s3.complete_multipart_upload(
-                Bucket=settings.S3_BUCKET_NAME,
-                Key=key,
-                UploadId=upload_id,
-                MultipartUpload={"Parts": parts}
-            )
+        if use_multipart and file_size > settings.S3_MULTIPART_THRESHOLD:
+            _upload_multipart(file_path, key, file_size)
         else:
-            # Для небольших файлов используем обычную загрузку
+            # Небольшие файлы (фрагменты) одним запросом
             logger.info(f"Используется обычная загрузка для файла размером {file_size/1024/1024:.2f} МБ")
             with open(file_path, "rb") as f:
-                s3.upload_fileobj(f, settings.S3_BUCKET_NAME, key)
+                get_s3_client().put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=f)
         
-        end_time = time.time()
-        duration = end_time - start_time
-        transfer_rate = file_size / (1024 * 1024) / duration if duration > 0 else 0
+        duration = time.time() - start_time
+        transfer_rate = record_transfer("upload", file_size, duration)
         logger.info(f"Загрузка файла {key} завершена за {duration:.2f} секунд. Скорость: {transfer_rate:.2f} МБ/с")
         
         return key
@@ -165,7 +355,12 @@ def download_file_from_s3(s3_url: str, destination_path: str) -> bool:
     max_retries = 3
     for attempt in range(max_retries):
         try:
+            start_time = time.time()
             s3.download_file(bucket, key, destination_path)
+            duration = time.time() - start_time
+            size = os.path.getsize(destination_path)
+            transfer_rate = record_transfer("download", size, duration)
+            logger.info(f"Скачивание файла {key} завершено за {duration:.2f} секунд. Скорость: {transfer_rate:.2f} МБ/с")
             return True
         except Exception as e:
             if attempt < max_retries - 1:
@@ -175,6 +370,11 @@ def download_file_from_s3(s3_url: str, destination_path: str) -> bool:
                 logger.error(f"Ошибка при скачивании файла {key} после {max_retries} попыток: {str(e)}")
                 raise
 
+def read_object_from_s3(key: str) -> bytes:
+    """Содержимое небольшого объекта (плейлиста) целиком"""
+    response = get_s3_client().get_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+    return response["Body"].read()
+
 def generate_presigned_url(s3_key: str, expiration: int = 3600) -> str:
     if not s3_key or len(s3_key.strip()) == 0:
         logger.warning("generate_presigned_url вызвана с пустым ключом.")
@@ -185,18 +385,8 @@ def generate_presigned_url(s3_key: str, expiration: int = 3600) -> str:
             key = parsed.path.lstrip("/")
         else:
             key = s3_key.lstrip("/")
-        s3_client = get_s3_client()
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': settings.S3_BUCKET_NAME,
-                'Key': key
-            },
-            ExpiresIn=expiration
-        )
+        url = presign('get_object', {'Bucket': settings.S3_BUCKET_NAME, 'Key': key}, expiration)
         logger.info(f"Сгенерирован предоподписанный URL для ключа {key}: {url}")
-        if settings.S3_ENDPOINT_URL != settings.S3_PUBLIC_URL:
-            url = url.replace(settings.S3_ENDPOINT_URL, settings.S3_PUBLIC_URL)
         return url
     except Exception as e:
         logger.error(f"Error generating presigned URL for key '{s3_key}': {str(e)}", exc_info=True)
@@ -227,3 +417,20 @@ def delete_file_from_s3(s3_url: str) -> bool:
     except Exception as e:
         logger.error(f"Ошибка при удалении файла {s3_url} из S3: {str(e)}")
         return False
+
+def delete_prefix_from_s3(prefix: str) -> int:
+    """
+    Удаляет все объекты с префиксом (каталог HLS-транскода) пачками по 1000 ключей.
+    Возвращает число удаленных объектов.
+    """
+    s3 = get_s3_client()
+    deleted = 0
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=settings.S3_BUCKET_NAME, Prefix=prefix):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if not objects:
+            continue
+        s3.delete_objects(Bucket=settings.S3_BUCKET_NAME, Delete={"Objects": objects, "Quiet": True})
+        deleted += len(objects)
+    logger.info(f"Удалено {deleted} объектов с префиксом {prefix}")
+    return deleted
@@ -0,0 +1,286 @@
+"""
+Временное хранилище видео, общее для API и воркеров (TEMP_UPLOAD_DIR на общем томе).
+
+Каждая задача (загрузка, обработка видео) получает свой каталог jobs/<job_id>. Учет ведется в файле
+.ledger.json под блокировкой flock, поэтому он согласован между процессами и контейнерами:
+- резерв — сколько байт задача еще собирается записать; свободным считается место на диске
+  за вычетом недописанных резервов и запаса CRITICAL_FREE_SPACE_MB;
+- аренда — задача использует каталог до lease_until; арендованные каталоги никогда не удаляются,
+  аренда без продления истекает, чтобы каталоги упавших процессов не занимали место вечно.
+При нехватке места удаляются только неарендованные каталоги, давно неиспользуемые первыми (LRU),
+и файлы старой раскладки в корне TEMP_UPLOAD_DIR.
+Размеры каталогов считаются обходом диска до взятия блокировки: блокировка держится только на чтение
+и запись учета, поэтому /metrics и /health не ждут обхода многогигабайтных каталогов других процессов.
+Каталоги, созданные после обхода, в него не попадают и не вытесняются; аренды проверяются уже под блокировкой.
+"""
+import fcntl
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from core.config import settings
+from core.logger import logger
+from core import metrics
+
+JOBS_DIR = "jobs"
+LEDGER_FILE = ".ledger.json"
+LOCK_FILE = ".ledger.lock"
+
+class InsufficientTempSpace(OSError):
+    """Места не хватает даже после удаления всех неиспользуемых временных файлов"""
+
+    def __init__(self, required: int, available: int):
+        super().__init__(f"Not enough temporary disk space. Required: {required} bytes, available: {available} bytes")
+        self.required = required
+        self.available = available
+
+def _path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class TempStorageManager:
+    def __init__(self, root: str = None):
+        self.root = root or settings.TEMP_UPLOAD_DIR
+        self.jobs_root = os.path.join(self.root, JOBS_DIR)
+
+    # --- каталоги задач ---
+
+    @staticmethod
+    def new_job_id() -> str:
+        return str(uuid.uuid4())
+
+    def job_dir(self, job_id: str) -> str:
+        path = os.path.join(self.jobs_root, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def job_path(self, job_id: str, filename: str) -> str:
+        return os.path.join(self.job_dir(job_id), os.path.basename(filename))
+
+    def job_of(self, path: str):
+        """job_id каталога, в котором лежит файл, или None для файлов вне jobs/"""
+        parent = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(parent) == os.path.abspath(self.jobs_root):
+            return os.path.basename(parent)
+        return None
+
+    # --- учет ---
+
+    @contextmanager
+    def _ledger(self):
+        """Учет под межпроцессной блокировкой; изменения записываются атомарной заменой файла"""
+        os.makedirs(self.jobs_root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            ledger_path = os.path.join(self.root, LEDGER_FILE)
+            try:
+                with open(ledger_path) as f:
+                    jobs = json.load(f).get("jobs", {})
+            except (FileNotFoundError, ValueError):
+                jobs = {}
+            yield jobs
+            tmp_path = ledger_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"jobs": jobs}, f)
+            os.replace(tmp_path, ledger_path)
+
+    @staticmethod
+    def _entry(jobs, job_id):
+        return jobs.setdefault(job_id, {"reserved": 0, "lease_until": 0, "last_used": time.time()})
+
+    def _leased(self, entry, now):
+        return entry.get("lease_until", 0) > now
+
+    def _walk(self):
+        """Обход диска без блокировки: {путь: (job_id или None, размер, mtime)} каталогов задач и старых файлов"""
+        os.makedirs(self.jobs_root, exist_ok=True)
+        paths = [(os.path.join(self.jobs_root, name), name) for name in os.listdir(self.jobs_root)]
+        paths += [(os.path.join(self.root, name), None) for name in os.listdir(self.root)
+                  if name not in (JOBS_DIR, LEDGER_FILE, LOCK_FILE, LEDGER_FILE + ".tmp")]
+        walked = {}
+        for path, job_id in paths:
+            try:
+                walked[path] = (job_id, _path_size(path), os.path.getmtime(path))
+            except OSError:
+                # Удален параллельно
+                continue
+        return walked
+
+    def _scan(self, jobs, walked):
+        """Сводит обход с учетом под блокировкой: {путь: (job_id или None, размер, last_used)}"""
+        items = {}
+        for path, (job_id, size, mtime) in walked.items():
+            entry = jobs.get(job_id) if job_id else None
+            items[path] = (job_id, size, entry["last_used"] if entry else mtime)
+        # Записи задач, каталоги которых уже удалены и аренда истекла, больше не нужны
+        now = time.time()
+        present = {job_id for job_id, _, _ in items.values() if job_id}
+        for job_id in [job_id for job_id, entry in jobs.items() if job_id not in present and not self._leased(entry, now)]:
+            del jobs[job_id]
+        return items
+
+    def _available(self, jobs, items, exclude=None) -> int:
+        disk = shutil.disk_usage(self.root)
+        sizes = {job_id: size for job_id, size, _ in items.values() if job_id}
+        outstanding = sum(max(0, entry["reserved"] - sizes.get(job_id, 0))
+                          for job_id, entry in jobs.items() if job_id != exclude)
+        return disk.free - settings.CRITICAL_FREE_SPACE_MB * 1024 * 1024 - outstanding
+
+    def _evict(self, jobs, items, bytes_needed=None, max_age_seconds=None, exclude=None) -> int:
+        """
+        Удаляет неарендованные каталоги и старые файлы в порядке LRU: до освобождения bytes_needed,
+        только старше max_age_seconds, либо все (оба параметра None).
+        """
+        now = time.time()
+        candidates = sorted(
+            ((last_used, path, job_id, size) for path, (job_id, size, last_used) in items.items()
+             if not (job_id and (job_id == exclude or self._leased(jobs.get(job_id, {}), now)))),
+            key=lambda item: item[0]
+        )
+        freed = 0
+        for last_used, path, job_id, size in candidates:
+            if bytes_needed is not None and freed >= bytes_needed:
+                break
+            if max_age_seconds is not None and now - last_used < max_age_seconds:
+                break
+            try:
+                _remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить временные файлы {path}: {str(e)}")
+                continue
+            freed += size
+            items.pop(path, None)
+            if job_id:
+                jobs.pop(job_id, None)
+            logger.info(f"Удалены временные файлы {path}: {size/1024/1024:.1f} МБ, "
+                        f"не использовались {(now - last_used)/3600:.1f} ч")
+            metrics.inc("temp_storage_evicted_bytes_total", size, "Bytes of unreferenced temporary files evicted")
+            metrics.inc("temp_storage_evictions_total", 1, "Temporary job directories and files evicted")
+        return freed
+
+    # --- резервы и аренды ---
+
+    def reserve(self, job_id: str, size: int, lease_seconds: float = None) -> int:
+        """
+        Резервирует место под size байт с запасом TEMP_RESERVATION_FACTOR на обработку и берет аренду
+        каталога задачи. При нехватке удаляет неиспользуемые файлы, иначе InsufficientTempSpace.
+        Возвращает зарезервированный объем.
+        """
+        required = int(size * settings.TEMP_RESERVATION_FACTOR)
+        walked = self._walk()
+        with self._ledger() as jobs:
+            items = self._scan(jobs, walked)
+            available = self._available(jobs, items, exclude=job_id)
+            if available < required:
+                logger.warning(f"Недостаточно временного места: требуется {required/1024/1024:.1f} МБ, "
+                               f"доступно {available/1024/1024:.1f} МБ, освобождаем неиспользуемые файлы")
+                self._evict(jobs, items, bytes_needed=required - available, exclude=job_id)
+                available = self._available(jobs, items, exclude=job_id)
+            if available < required:
+                metrics.inc("temp_storage_reservation_failures_total", 1,
+                            "Temporary space reservations rejected for lack of space")
+                raise InsufficientTempSpace(required, available)
+            entry = self._entry(jobs, job_id)
+            entry["reserved"] = max(entry["reserved"], required)
+            self._lease(entry, lease_seconds)
+        self.job_dir(job_id)
+        return required
+
+    def _lease(self, entry, lease_seconds=None):
+        now = time.time()
+        entry["lease_until"] = max(entry.get("lease_until", 0), now + (lease_seconds or settings.TEMP_LEASE_SECONDS))
+        entry["last_used"] = now
+        entry["holder"] = f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self, job_id: str, lease_seconds: float = None):
+        """Берет или продлевает аренду каталога задачи"""
+        with self._ledger() as jobs:
+            self._lease(self._entry(jobs, job_id), lease_seconds)
+        self.job_dir(job_id)
+
+    def release(self, job_id: str, delete: bool = False):
+        """Снимает аренду и резерв; delete — сразу удалить каталог, иначе он остается до вытеснения по LRU"""
+        with self._ledger() as jobs:
+            entry = jobs.get(job_id)
+            if delete:
+                _remove(os.path.join(self.jobs_root, job_id))
+                jobs.pop(job_id, None)
+            elif entry:
+                entry.update(reserved=0, lease_until=0, last_used=time.time())
+
+    @contextmanager
+    def lease(self, job_id: str, lease_seconds: float = None):
+        self.acquire(job_id, lease_seconds)
+        try:
+            yield self.job_dir(job_id)
+        finally:
+            self.release(job_id)
+
+    # --- очистка и статистика ---
+
+    def cleanup(self, max_age_hours: float = None) -> int:
+        """Плановая очистка: неарендованные файлы старше max_age_hours; при критической нехватке места — все"""
+        max_age_hours = settings.TEMP_FILES_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+        walked = self._walk()
+        with self._ledger() as jobs:
+            items = self._scan(jobs, walked)
+            freed = self._evict(jobs, items, max_age_seconds=max_age_hours * 3600)
+            disk = shutil.disk_usage(self.root)
+            if (disk.free < settings.CRITICAL_FREE_SPACE_MB * 1024 * 1024
+                    or disk.free * 100 / disk.total < settings.MIN_FREE_SPACE_PERCENTAGE):
+                logger.warning(f"Критически мало свободного места: {disk.free/1024/1024:.1f} МБ, "
+                               f"удаляем все неиспользуемые временные файлы")
+                freed += self._evict(jobs, items)
+        logger.info(f"Очистка временных файлов: освобождено {freed/1024/1024:.1f} МБ")
+        self.usage()
+        return freed
+
+    def evict_all(self) -> int:
+        """Удаляет все неарендованные временные файлы"""
+        walked = self._walk()
+        with self._ledger() as jobs:
+            return self._evict(jobs, self._scan(jobs, walked))
+
+    def usage(self) -> dict:
+        """Занятость временного хранилища; заодно обновляет гауги метрик"""
+        walked = self._walk()
+        with self._ledger() as jobs:
+            items = self._scan(jobs, walked)
+            available = self._available(jobs, items)
+        now = time.time()
+        sizes = {job_id: size for job_id, size, _ in items.values() if job_id}
+        leased = [job_id for job_id, entry in jobs.items() if self._leased(entry, now)]
+        stats = {
+            "used_bytes": sum(size for _, size, _ in items.values()),
+            "leased_bytes": sum(sizes.get(job_id, 0) for job_id in leased),
+            "reserved_bytes": sum(max(0, entry["reserved"] - sizes.get(job_id, 0)) for job_id, entry in jobs.items()),
+            "available_bytes": max(0, available),
+            "jobs": len(sizes),
+            "leased_jobs": len(leased),
+            "files": len(items),
+        }
+        metrics.set_gauge("temp_storage_used_bytes", stats["used_bytes"], "Bytes in the temporary video directory")
+        metrics.set_gauge("temp_storage_leased_bytes", stats["leased_bytes"], "Bytes of temporary files held by running jobs")
+        metrics.set_gauge("temp_storage_reserved_bytes", stats["reserved_bytes"], "Reserved but not yet written temporary bytes")
+        metrics.set_gauge("temp_storage_available_bytes", stats["available_bytes"], "Temporary space available for new reservations")
+        metrics.set_gauge("temp_storage_leased_jobs", stats["leased_jobs"], "Job directories currently leased")
+        return stats
+
+temp_storage = TempStorageManager()
@@ -0,0 +1,25 @@
+import re
+from functools import lru_cache
+from typing import List
+from nltk.stem.snowball import SnowballStemmer
+from core.config import settings
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STEMMER_LANGUAGES = {"en": "english", "ru": "russian"}
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре; ё приводится к е, как в русском стеммере"""
+    return TOKEN_RE.findall((text or "").lower().replace("ё", "е"))
+
+@lru_cache(maxsize=None)
+def get_stemmer(language: str) -> SnowballStemmer:
+    if language not in STEMMER_LANGUAGES:
+        language = settings.VIDEO_DEFAULT_LANGUAGE
+    return SnowballStemmer(STEMMER_LANGUAGES[language])
+
+@lru_cache(maxsize=100000)
+def stem(token: str, language: str) -> str:
+    return get_stemmer(language).stem(token)
+
+def analyze(text: str, language: str) -> List[str]:
+    return [stem(token, language) for token in tokenize(text)]
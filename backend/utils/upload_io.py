@@ -0,0 +1,49 @@
+"""
+Блокирующие операции загрузок (запись на диск, disk_usage, очистка, БД, постановка задач) вне цикла событий.
+
+Операции выполняются в отдельном пуле из UPLOAD_IO_THREADS потоков, а не в пуле по умолчанию,
+которым пользуется поиск (asyncio.to_thread при подписи ссылок): несколько многогигабайтных загрузок
+занимают не больше UPLOAD_IO_THREADS потоков, и поиск не ждет освобождения пула.
+Противодавление есть только там, где тело запроса читается потоком (/upload/stream, куски возобновляемых
+загрузок): следующий кусок читается после записи предыдущего, поэтому в памяти на загрузку не больше
+одного куска, а медленный диск замедляет клиента через TCP. Multipart /upload получает UploadFile, который
+Starlette уже целиком сохранил во временный файл; здесь из цикла событий убирается только копирование.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.config import settings
+from core import metrics
+
+upload_executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_IO_THREADS, thread_name_prefix="upload-io")
+
+async def run_io(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков загрузок"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(upload_executor, functools.partial(func, *args, **kwargs))
+
+def _copy_chunk(src, dst, chunk_size):
+    data = src.read(chunk_size)
+    if data:
+        dst.write(data)
+    return len(data)
+
+async def copy_file_async(src, dst, max_size=None, chunk_size=None):
+    """
+    Копирует файловый объект кусками по UPLOAD_CHUNK_SIZE, каждый кусок — отдельная операция в пуле,
+    поэтому копирование можно прервать между кусками. Возвращает число скопированных байт.
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    copied = 0
+    start = time.perf_counter()
+    while True:
+        size = await run_io(_copy_chunk, src, dst, chunk_size)
+        if not size:
+            break
+        copied += size
+        if max_size and copied > max_size:
+            raise ValueError(f"File exceeds {max_size} bytes")
+    metrics.inc("upload_bytes_written_total", copied, "Bytes of uploaded videos written to temporary files")
+    metrics.observe("upload_write_seconds", time.perf_counter() - start, "Time spent writing an upload to disk")
+    return copied
@@ -3,7 +3,35 @@ from core.config import settings
 
 celery_app = Celery("worker", broker=settings.CELERY_BROKER_URL, backend=settings.CELERY_RESULT_BACKEND)
 celery_app.conf.update(task_serializer="json", accept_content=["json"], result_serializer="json", timezone=settings.TIMEZONE, enable_utc=True)
+celery_app.conf.task_routes = {
+    # Индексация идет отдельной очередью, чтобы не ждать за долгой обработкой видео
+    "tasks.indexing_task.drain_search_outbox_task": {"queue": "indexing"},
+    "tasks.tagging_task.retag_fragments_task": {"queue": "indexing"},
+    # Обслуживание не должно ждать за многочасовой обработкой видео в основной очереди
+    "tasks.upload_cleanup_task.expire_upload_sessions_task": {"queue": "indexing"},
+}
+celery_app.conf.beat_schedule = {
+    "drain-search-outbox": {
+        "task": "tasks.indexing_task.drain_search_outbox_task",
+        "schedule": settings.SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS,
+        # Пока индексатор недоступен, запуски не копятся в очереди
+        "options": {"expires": settings.SEARCH_OUTBOX_DRAIN_INTERVAL_SECONDS},
+    },
+    "retag-fragments": {
+        "task": "tasks.tagging_task.retag_fragments_task",
+        "schedule": settings.KEYWORD_RETAG_INTERVAL_SECONDS,
+        "options": {"expires": settings.KEYWORD_RETAG_INTERVAL_SECONDS},
+    },
+    "expire-upload-sessions": {
+        "task": "tasks.upload_cleanup_task.expire_upload_sessions_task",
+        "schedule": settings.UPLOAD_SESSION_EXPIRE_INTERVAL_SECONDS,
+        "options": {"expires": settings.UPLOAD_SESSION_EXPIRE_INTERVAL_SECONDS},
+    },
+}
 celery_app.autodiscover_tasks(['tasks'], force=True)
 
 import tasks.process_video_task
-import tasks.search_task
\ No newline at end of file
+import tasks.search_task
+import tasks.indexing_task
+import tasks.tagging_task
+import tasks.upload_cleanup_task
@@ -39,6 +39,7 @@ const SearchResults = ({ results, highlightWords, exactSearch }) => {
                   <Grid item xs={12} sm={6} md={4} key={frag.fragment_id}>
                     <VideoPlayer
                       videoUrl={frag.s3_url}
+                      posterUrl={frag.thumbnail_url}
                       fragments={[]} // Режим статичного воспроизведения для фрагмента
                       staticSubtitle={frag.text}
                       searchWords={highlightWords}
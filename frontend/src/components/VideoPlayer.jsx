@@ -14,6 +14,7 @@ const VideoPlayer = ({
   searchWords = [],
   exactSearch = false,
   staticSubtitle,
+  posterUrl, // Миниатюра фрагмента: пока видео не запущено, файл не скачивается
   preview = false // Если true, ограничиваем размер видео для превью
 }) => {
   const containerRef = useRef(null);
@@ -88,6 +89,8 @@ const VideoPlayer = ({
         <video
           ref={videoRef}
           src={videoUrl}
+          poster={posterUrl}
+          preload={posterUrl ? "none" : "metadata"}
           style={{ width: "100%", display: "block" }}
           // Скрываем нативные элементы управления для использования кастомных кнопок
           controls={false}
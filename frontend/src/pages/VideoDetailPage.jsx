@@ -142,6 +142,7 @@ const VideoDetailPage = () => {
                     >
                       <VideoPlayer
                         videoUrl={frag.s3_url}
+                        posterUrl={frag.thumbnail_url}
                         fragments={[]} // Статичный режим для фрагмента
                         staticSubtitle={frag.text}
                         searchWords={searchQuery.split(" ").filter((w) => w.trim() !== "")}